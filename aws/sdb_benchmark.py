@@ -0,0 +1,141 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sdbcli import SimpleDbHelper, RequestThrottler
+from sdb_emulator import SimpleDbEmulator
+from tools.stopwatch import percentile
+
+BENCH_DOMAIN = "benchmark"
+
+
+class TimedBackend(object):
+    """Wraps a backend and records the latency of every call per operation."""
+
+    def __init__(self, backend):
+        self._backend = backend
+        self._lock = threading.Lock()
+        self.latencies = {}
+
+    def __getattr__(self, name):
+        operation = getattr(self._backend, name)
+
+        def timed(**params):
+            start = time.time()
+            try:
+                return operation(**params)
+            finally:
+                elapsed = time.time() - start
+                with self._lock:
+                    self.latencies.setdefault(name, []).append(elapsed)
+
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.latencies = {}
+
+
+def make_items(count, attrs_per_item):
+    for i in range(count):
+        yield {'Name': "item{:08d}".format(i),
+               'Attributes': [{'Name': "attr{}".format(a), 'Value': "value{}-{}".format(i, a), 'Replace': True}
+                              for a in range(attrs_per_item)]}
+
+
+def bench_single_puts(helper, backend, args):
+    latencies = []
+    for item in make_items(args.items, args.attrs):
+        start = time.time()
+        helper.put_attributes(BENCH_DOMAIN, item['Name'], item['Attributes'])
+        latencies.append(time.time() - start)
+    return args.items, latencies
+
+
+def bench_batched_writes(helper, backend, args):
+    helper.batch_put_items(BENCH_DOMAIN, make_items(args.items, args.attrs), workers=args.workers)
+    return args.items, backend.latencies.get('batch_put_attributes', [])
+
+
+def bench_paged_selects(helper, backend, args):
+    count = 0
+    for _ in helper.select_iter("select * from `{}`".format(BENCH_DOMAIN), page_prefetch=args.prefetch):
+        count += 1
+    return count, backend.latencies.get('select', [])
+
+
+def bench_cached_reads(helper, backend, args):
+    hot_items = ["item{:08d}".format(i) for i in range(min(args.hot_items, args.items))]
+    attr_names = ["attr{}".format(a) for a in range(args.attrs)]
+    latencies = []
+    for i in range(args.reads):
+        start = time.time()
+        helper.get_attributes(BENCH_DOMAIN, hot_items[i % len(hot_items)], attr_names)
+        latencies.append(time.time() - start)
+    return args.reads, latencies
+
+
+BENCHMARKS = [
+    ("single puts", bench_single_puts),
+    ("batched writes", bench_batched_writes),
+    ("paged selects", bench_paged_selects),
+    ("cached reads", bench_cached_reads),
+]
+
+
+def run(args):
+    emulator = SimpleDbEmulator(latency=args.latency, throttle_rate=args.throttle_rate, seed=args.seed)
+    backend = TimedBackend(emulator)
+    throttler = RequestThrottler(base_delay=0.01)
+    helper = SimpleDbHelper(backend=backend, cache_size=args.hot_items, throttler=throttler, verbose=False)
+    helper.create_domain(BENCH_DOMAIN)
+
+    results = []
+    for name, bench in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        backend.reset()
+        start = time.time()
+        count, latencies = bench(helper, backend, args)
+        elapsed = time.time() - start
+        results.append((name, count, elapsed, latencies))
+
+    print("\n{:<16}{:>10}{:>12}{:>14}{:>12}{:>12}".format("benchmark", "items", "seconds", "items/sec",
+                                                         "p50 ms", "p99 ms"))
+    for name, count, elapsed, latencies in results:
+        print("{:<16}{:>10}{:>12.3f}{:>14.1f}{:>12.3f}{:>12.3f}".format(
+            name, count, elapsed, count / elapsed if elapsed else 0.0,
+            percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000))
+
+    stats = helper.throttle_stats()
+    print("\nCache: {}".format(helper.cache_stats()))
+    print("Throttler: concurrency limit {:.1f}, retries {}, throttles {}".format(
+        stats['ConcurrencyLimit'],
+        sum(op['Retries'] for op in stats['Operations'].values()),
+        sum(op['Throttles'] for op in stats['Operations'].values())))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks SimpleDbHelper against the in-process SimpleDB "
+                                                 "emulator and reports items/sec and p50/p99 latency.")
+    parser.add_argument("--items", type=int, default=2000, help="Number of items written and selected")
+    parser.add_argument("--attrs", type=int, default=4, help="Number of attributes per item")
+    parser.add_argument("--latency", type=float, default=0.002, help="Seconds of latency injected per call")
+    parser.add_argument("--throttle-rate", dest="throttle_rate", type=float, default=0.0,
+                        help="Probability of a call being throttled")
+    parser.add_argument("--workers", type=int, default=8, help="Requests in flight for batched writes")
+    parser.add_argument("--prefetch", type=int, default=1, help="Pages fetched ahead by paged selects")
+    parser.add_argument("--hot-items", dest="hot_items", type=int, default=100,
+                        help="Number of items read repeatedly by cached reads, also the cache size")
+    parser.add_argument("--reads", type=int, default=10000, help="Number of cached reads")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the injected throttling")
+    parser.add_argument("--only", nargs="*", choices=[name for name, _ in BENCHMARKS],
+                        help="Only run these benchmarks")
+
+    run(parser.parse_args())
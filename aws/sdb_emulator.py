@@ -0,0 +1,548 @@
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+# SimpleDB limits enforced by the emulator
+MAX_BATCH_ITEMS = 25
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 2500
+
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<name>`(?:[^`]|``)*`)
+      | (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+      | (?P<op>!=|<=|>=|=|<|>|\(|\)|,|\*)
+      | (?P<word>[A-Za-z_$][\w$]*)
+      | (?P<number>\d+)
+    )""", re.VERBOSE)
+
+KEYWORDS = {"select", "from", "where", "and", "or", "not", "like", "between", "in", "is", "null", "order", "by",
+            "asc", "desc", "limit", "every", "itemname", "count", "intersection"}
+
+
+#########################
+# SimpleDB Stand-in API #
+#########################
+
+
+class SimpleDbEmulator(object):
+    """In-process, in-memory stand-in for the boto3 sdb client.
+    Implements the domain, attribute and select calls SimpleDbHelper makes with the same request and response
+    formats, and can inject latency and throttling so the helper can be measured and tested without AWS.
+    """
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, seed=None):
+        """INPUTS:
+                latency (float|func)  : Seconds every call sleeps, or a function returning them
+                                        Default: 0.0
+                                        OPTIONAL
+                throttle_rate (float) : Probability of a call failing with ServiceUnavailable
+                                        Default: 0.0
+                                        OPTIONAL
+                seed (int)            : Seed for the throttling randomness
+                                        OPTIONAL
+            OUTPUTS:
+                None
+        """
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.calls = {}
+        self._random = random.Random(seed)
+        self._domains = {}
+        self._cursors = OrderedDict()
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    ###########
+    # Domains #
+    ###########
+
+    def create_domain(self, DomainName):
+        self._simulate("CreateDomain")
+        with self._lock:
+            self._domains.setdefault(DomainName, {})
+        return _response()
+
+    def delete_domain(self, DomainName):
+        self._simulate("DeleteDomain")
+        with self._lock:
+            self._domains.pop(DomainName, None)
+        return _response()
+
+    def list_domains(self, MaxNumberOfDomains=100, NextToken=None):
+        self._simulate("ListDomains")
+        with self._lock:
+            names = sorted(self._domains)
+        offset = int(NextToken) if NextToken else 0
+        resp = _response(DomainNames=names[offset:offset + MaxNumberOfDomains])
+        if offset + MaxNumberOfDomains < len(names):
+            resp['NextToken'] = str(offset + MaxNumberOfDomains)
+        return resp
+
+    def domain_metadata(self, DomainName):
+        self._simulate("DomainMetadata")
+        with self._lock:
+            items = self._domain(DomainName)
+            attr_names = set()
+            values = 0
+            values_size = 0
+            for attrs in items.values():
+                for name, vals in attrs.items():
+                    attr_names.add(name)
+                    values += len(vals)
+                    values_size += sum(len(v.encode('utf-8')) for v in vals)
+            return _response(ItemCount=len(items),
+                             ItemNamesSizeBytes=sum(len(n.encode('utf-8')) for n in items),
+                             AttributeNameCount=len(attr_names),
+                             AttributeNamesSizeBytes=sum(len(n.encode('utf-8')) for n in attr_names),
+                             AttributeValueCount=values,
+                             AttributeValuesSizeBytes=values_size,
+                             Timestamp=int(time.time()))
+
+    ##############
+    # Attributes #
+    ##############
+
+    def put_attributes(self, DomainName, ItemName, Attributes, Expected=None):
+        self._simulate("PutAttributes")
+        with self._lock:
+            items = self._domain(DomainName)
+            self._check_expected(items.get(ItemName, {}), Expected)
+            self._put(items, ItemName, Attributes)
+        return _response()
+
+    def batch_put_attributes(self, DomainName, Items):
+        self._simulate("BatchPutAttributes")
+        self._check_batch_size(Items)
+        with self._lock:
+            items = self._domain(DomainName)
+            for item in Items:
+                self._put(items, item['Name'], item['Attributes'])
+        return _response()
+
+    def delete_attributes(self, DomainName, ItemName, Attributes=None, Expected=None):
+        self._simulate("DeleteAttributes")
+        with self._lock:
+            items = self._domain(DomainName)
+            self._check_expected(items.get(ItemName, {}), Expected)
+            self._delete(items, ItemName, Attributes)
+        return _response()
+
+    def batch_delete_attributes(self, DomainName, Items):
+        self._simulate("BatchDeleteAttributes")
+        self._check_batch_size(Items)
+        with self._lock:
+            items = self._domain(DomainName)
+            for item in Items:
+                self._delete(items, item['Name'], item.get('Attributes'))
+        return _response()
+
+    def get_attributes(self, DomainName, ItemName, AttributeNames=None, ConsistentRead=False):
+        self._simulate("GetAttributes")
+        with self._lock:
+            attrs = self._domain(DomainName).get(ItemName, {})
+            attributes = _attributes(attrs, AttributeNames)
+        return _response(Attributes=attributes) if attributes else _response()
+
+    ##########
+    # Select #
+    ##########
+
+    def select(self, SelectExpression, NextToken=None, ConsistentRead=False):
+        """Runs a select with NextToken paging. The matching items are computed on the first page and
+        later pages are served from that snapshot.
+        """
+        self._simulate("Select")
+        with self._lock:
+            if NextToken:
+                cursor_id, offset = _decode_token(NextToken)
+                cursor = self._cursors.get(cursor_id)
+                if cursor is None or cursor[0] != SelectExpression:
+                    raise _client_error("InvalidNextToken", "The specified next token is not valid.", "Select")
+                results, page_size = cursor[1], cursor[2]
+            else:
+                query = SelectQuery(SelectExpression)
+                results = query.run(self._domain(query.domain))
+                page_size = query.limit
+                cursor_id = None
+                offset = 0
+
+            page = results[offset:offset + page_size]
+            resp = _response(Items=page) if page else _response()
+            if offset + page_size < len(results):
+                if cursor_id is None:
+                    cursor_id = "{:x}".format(self._random.getrandbits(64))
+                    self._cursors[cursor_id] = (SelectExpression, results, page_size)
+                    while len(self._cursors) > 64:
+                        self._cursors.popitem(last=False)
+                resp['NextToken'] = _encode_token(cursor_id, offset + page_size)
+            elif cursor_id is not None:
+                self._cursors.pop(cursor_id, None)
+        return resp
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _simulate(self, operation):
+        self._local.operation = operation
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+            throttled = self.throttle_rate and self._random.random() < self.throttle_rate
+        latency = self.latency() if callable(self.latency) else self.latency
+        if latency:
+            time.sleep(latency)
+        if throttled:
+            raise self._error("ServiceUnavailable", "Service AmazonSimpleDB is currently unavailable.", 503)
+
+    def _error(self, code, message, status=400):
+        return _client_error(code, message, self._local.operation, status)
+
+    def _domain(self, domain_name):
+        if domain_name not in self._domains:
+            raise self._error("NoSuchDomain", "The specified domain does not exist.")
+        return self._domains[domain_name]
+
+    def _check_batch_size(self, items):
+        if len(items) > MAX_BATCH_ITEMS:
+            raise self._error("NumberSubmittedItemsExceeded",
+                              "Too many items in a single call. Up to {} items per call allowed."
+                              .format(MAX_BATCH_ITEMS))
+
+    def _check_expected(self, attrs, expected):
+        if not expected:
+            return
+        values = attrs.get(expected['Name'], [])
+        if 'Exists' in expected and not expected['Exists']:
+            if values:
+                raise self._error("ConditionalCheckFailed", "Conditional check failed.", 409)
+            return
+        if expected.get('Value') not in values:
+            code = "AttributeDoesNotExist" if not values else "ConditionalCheckFailed"
+            raise self._error(code, "Conditional check failed.", 404 if not values else 409)
+
+    @staticmethod
+    def _put(items, item_name, attributes):
+        attrs = items.setdefault(item_name, {})
+        replaced = set()
+        for attr in attributes:
+            name = attr['Name']
+            if attr.get('Replace') and name not in replaced:
+                attrs[name] = []
+                replaced.add(name)
+            values = attrs.setdefault(name, [])
+            if attr['Value'] not in values:
+                values.append(attr['Value'])
+
+    @staticmethod
+    def _delete(items, item_name, attributes):
+        attrs = items.get(item_name)
+        if attrs is None:
+            return
+        if not attributes:
+            del items[item_name]
+            return
+        for attr in attributes:
+            if attr['Name'] not in attrs:
+                continue
+            if 'Value' in attr:
+                values = attrs[attr['Name']]
+                if attr['Value'] in values:
+                    values.remove(attr['Value'])
+                if not values:
+                    del attrs[attr['Name']]
+            else:
+                del attrs[attr['Name']]
+        if not attrs:
+            del items[item_name]
+
+
+class SelectQuery(object):
+    """Parsed subset of the SimpleDB select grammar:
+
+        select * | itemName() | count(*) | name, ... from domain
+            [where <predicates>] [order by itemName() | name [asc | desc]] [limit N]
+
+    Predicates support =, !=, <, <=, >, >=, like, not like, between, in, is null, is not null, every(name),
+    and, or, not and parentheses. Values are compared as strings like SimpleDB does, and a predicate on a
+    multi-valued attribute matches if any value matches (every() requires all values to match).
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        self._tokens = _tokenize(expression)
+        self._pos = 0
+        self.output = None
+        self.domain = None
+        self.where = None
+        self.order_by = None
+        self.descending = False
+        self.limit = DEFAULT_PAGE_SIZE
+        self._parse()
+
+    def run(self, items):
+        """Returns the items of a domain that match the query, sorted and projected.
+
+        :param items: (dict) { item_name: { attr_name: [values] } }
+        :return: (list) [ <SimpleDB_Attribute>, ... ]
+        """
+        matches = [(name, attrs) for name, attrs in items.items() if self.where is None or self.where(name, attrs)]
+        if self.output == "count":
+            return [{'Name': 'Domain', 'Attributes': [{'Name': 'Count', 'Value': str(len(matches))}]}]
+
+        if self.order_by is not None:
+            matches.sort(key=lambda m: _sort_key(m, self.order_by), reverse=self.descending)
+        if self.output == "itemName":
+            return [{'Name': name} for name, _ in matches]
+        attr_names = None if self.output == "*" else self.output
+        return [{'Name': name, 'Attributes': _attributes(attrs, attr_names)} for name, attrs in matches]
+
+    ##########
+    # Parser #
+    ##########
+
+    def _parse(self):
+        self._expect_word("select")
+        self.output = self._parse_output()
+        self._expect_word("from")
+        self.domain = self._parse_name()
+        if self._accept_word("where"):
+            self.where = self._parse_or()
+        if self._accept_word("order"):
+            self._expect_word("by")
+            self.order_by = self._parse_operand()[1]
+            if self._accept_word("desc"):
+                self.descending = True
+            else:
+                self._accept_word("asc")
+        if self._accept_word("limit"):
+            kind, value = self._next()
+            if kind != "number" or not 0 < int(value) <= MAX_PAGE_SIZE:
+                self._error("limit must be between 1 and {}".format(MAX_PAGE_SIZE))
+            self.limit = int(value)
+        if self._pos < len(self._tokens):
+            self._error("unexpected '{}'".format(self._tokens[self._pos][1]))
+
+    def _parse_output(self):
+        if self._accept_op("*"):
+            return "*"
+        if self._accept_word("count"):
+            self._expect_op("(")
+            self._expect_op("*")
+            self._expect_op(")")
+            return "count"
+        if self._accept_itemname():
+            return "itemName"
+        names = [self._parse_name()]
+        while self._accept_op(","):
+            names.append(self._parse_name())
+        return names
+
+    def _parse_or(self):
+        left = self._parse_and()
+        while self._accept_word("or"):
+            right = self._parse_and()
+            left = (lambda l, r: lambda n, a: l(n, a) or r(n, a))(left, right)
+        return left
+
+    def _parse_and(self):
+        left = self._parse_not()
+        while self._accept_word("and"):
+            right = self._parse_not()
+            left = (lambda l, r: lambda n, a: l(n, a) and r(n, a))(left, right)
+        return left
+
+    def _parse_not(self):
+        if self._accept_word("not"):
+            inner = self._parse_not()
+            return lambda n, a: not inner(n, a)
+        if self._accept_op("("):
+            inner = self._parse_or()
+            self._expect_op(")")
+            return inner
+        return self._parse_predicate()
+
+    def _parse_predicate(self):
+        every, name = self._parse_operand()
+        if self._accept_word("is"):
+            negate = self._accept_word("not")
+            self._expect_word("null")
+            return lambda n, a: (len(_values(n, a, name)) > 0) == negate
+
+        negate = self._accept_word("not")
+        if self._accept_word("like"):
+            pattern = _like_to_regex(self._parse_value())
+            test = lambda v: pattern.match(v) is not None
+            if negate:
+                test = (lambda t: lambda v: not t(v))(test)
+        elif negate:
+            self._error("expected like after not")
+        elif self._accept_word("between"):
+            low = self._parse_value()
+            self._expect_word("and")
+            high = self._parse_value()
+            test = lambda v: low <= v <= high
+        elif self._accept_word("in"):
+            self._expect_op("(")
+            choices = {self._parse_value()}
+            while self._accept_op(","):
+                choices.add(self._parse_value())
+            self._expect_op(")")
+            test = lambda v: v in choices
+        else:
+            kind, op = self._next()
+            if kind != "op" or op not in COMPARISONS:
+                self._error("expected a comparison operator")
+            value = self._parse_value()
+            compare = COMPARISONS[op]
+            test = lambda v: compare(v, value)
+
+        if every:
+            return lambda n, a: bool(_values(n, a, name)) and all(test(v) for v in _values(n, a, name))
+        return lambda n, a: any(test(v) for v in _values(n, a, name))
+
+    def _parse_operand(self):
+        """Returns (every, name) where name is None for itemName()."""
+        if self._accept_word("every"):
+            self._expect_op("(")
+            name = self._parse_name()
+            self._expect_op(")")
+            return True, name
+        if self._accept_itemname():
+            return False, None
+        return False, self._parse_name()
+
+    def _parse_name(self):
+        kind, value = self._next()
+        if kind == "name":
+            return value[1:-1].replace("``", "`")
+        if kind == "word" and value.lower() not in KEYWORDS:
+            return value
+        self._error("expected a name but got '{}'".format(value))
+
+    def _parse_value(self):
+        kind, value = self._next()
+        if kind != "string":
+            self._error("expected a quoted value but got '{}'".format(value))
+        quote = value[0]
+        return value[1:-1].replace(quote * 2, quote)
+
+    def _accept_itemname(self):
+        kind, value = self._peek()
+        if kind == "word" and value.lower() == "itemname":
+            self._pos += 1
+            self._expect_op("(")
+            self._expect_op(")")
+            return True
+        return False
+
+    def _accept_word(self, word):
+        kind, value = self._peek()
+        if kind == "word" and value.lower() == word:
+            self._pos += 1
+            return True
+        return False
+
+    def _expect_word(self, word):
+        if not self._accept_word(word):
+            self._error("expected '{}'".format(word))
+
+    def _accept_op(self, op):
+        if self._peek() == ("op", op):
+            self._pos += 1
+            return True
+        return False
+
+    def _expect_op(self, op):
+        if not self._accept_op(op):
+            self._error("expected '{}'".format(op))
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        if token[0] is None:
+            self._error("unexpected end of expression")
+        self._pos += 1
+        return token
+
+    def _error(self, msg):
+        raise _client_error("InvalidQueryExpression",
+                            "The specified query expression syntax is not valid: {} in '{}'".format(msg,
+                                                                                                  self.expression),
+                            "Select")
+
+
+COMPARISONS = {
+    "=": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+}
+
+
+def _tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = TOKEN_RE.match(expression, pos)
+        if match is None:
+            raise _client_error("InvalidQueryExpression",
+                                "The specified query expression syntax is not valid: '{}'".format(expression),
+                                "Select")
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+
+def _values(item_name, attrs, name):
+    return [item_name] if name is None else attrs.get(name, ())
+
+
+def _sort_key(match, name):
+    item_name, attrs = match
+    values = _values(item_name, attrs, name)
+    return (0, min(values)) if values else (1, "")
+
+
+def _like_to_regex(pattern):
+    """Converts a SimpleDB like pattern, where % matches any characters, into a compiled regex."""
+    return re.compile("^{}$".format(".*".join(re.escape(part) for part in pattern.split("%"))), re.DOTALL)
+
+
+def _attributes(attrs, attr_names=None):
+    names = attr_names if attr_names else attrs.keys()
+    return [{'Name': name, 'Value': value} for name in names for value in attrs.get(name, ())]
+
+
+def _encode_token(cursor_id, offset):
+    raw = json.dumps({'cursor': cursor_id, 'offset': offset}).encode('utf-8')
+    return base64.b64encode(raw).decode('ascii')
+
+
+def _decode_token(token):
+    try:
+        data = json.loads(base64.b64decode(token.encode('ascii')).decode('utf-8'))
+        return data['cursor'], int(data['offset'])
+    except (ValueError, KeyError, TypeError):
+        raise _client_error("InvalidNextToken", "The specified next token is not valid.", "Select")
+
+
+def _response(**fields):
+    fields['ResponseMetadata'] = {'HTTPStatusCode': 200}
+    return fields
+
+
+def _client_error(code, message, operation, status=400):
+    return ClientError({'Error': {'Code': code, 'Message': message},
+                        'ResponseMetadata': {'HTTPStatusCode': status}}, operation)
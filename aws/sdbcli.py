@@ -1,14 +1,436 @@
+import os
+import sys
 import pprint
 import json
+import random
+import re
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import jmespath
 import pprint
+import queue
+import threading
 import time
+import asyncio
+import bisect
+import functools
+import heapq
+import zlib
+from urllib.parse import quote
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import files.csv_helper as csv_helper
 
 # Globals
 pp = pprint.PrettyPrinter(indent=4)
 
+# SimpleDB batch operation limits
+BATCH_MAX_ITEMS = 25
+BATCH_MAX_BYTES = 1024 * 1024
+# Request bytes besides the items: action, version, domain name, credentials and signature parameters
+BATCH_REQUEST_OVERHEAD = 4096
+
+# Characters item names are assumed to be made of when splitting the keyspace, in sort order
+ITEM_NAME_ALPHABET = ''.join(chr(c) for c in range(32, 127))
+
+# Error codes SimpleDB returns when it is overloaded or wants callers to slow down
+THROTTLING_ERROR_CODES = {"ServiceUnavailable", "Throttling", "ThrottlingException", "RequestLimitExceeded",
+                          "SlowDown"}
+# Other error codes that are safe to retry
+RETRYABLE_ERROR_CODES = {"InternalError", "RequestTimeout", "RequestTimeTooSkewed"}
+
+# Domain name in the from clause of a select expression, quoted or not
+SELECT_DOMAIN_RE = re.compile(r"\bfrom\s+(?:`((?:[^`]|``)+)`|([\w.-]+))", re.IGNORECASE)
+SELECT_ORDER_RE = re.compile(r"\border\s+by\s+(itemName\(\)|`(?:[^`]|``)+`|[\w$]+)(?:\s+(asc|desc))?",
+                             re.IGNORECASE)
+SELECT_LIMIT_RE = re.compile(r"\blimit\s+(\d+)\s*$", re.IGNORECASE)
+
+
+#########
+# Cache #
+#########
+
+
+class AttributeCache(object):
+    """Thread safe LRU cache with a TTL for get_attributes responses.
+    Entries are keyed by (domain, item, attribute names) and indexed by (domain, item) so writes can invalidate
+    every attribute set cached for an item.
+    """
+
+    def __init__(self, max_size=1024, ttl=60):
+        """INPUTS:
+                max_size (int)    : Max number of cached responses before the least recently used is evicted
+                                    Default: 1024
+                                    OPTIONAL
+                ttl (float)       : Seconds a cached response stays valid
+                                    Default: 60
+                                    OPTIONAL
+            OUTPUTS:
+                None
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._keys_by_item = {}
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(domain_name, item_name, attr_names):
+        return domain_name, item_name, tuple(sorted(attr_names))
+
+    def get(self, key):
+        """Returns (found, value) for key, counting a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return False, None
+
+    def write_count(self):
+        """Number of invalidations so far. Pass it to put to skip storing a response that a write raced with."""
+        with self._lock:
+            return self._writes
+
+    def put(self, key, value, write_count=None):
+        with self._lock:
+            if write_count is not None and write_count != self._writes:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._keys_by_item.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, domain_name, item_name=None):
+        """Drops cached responses for an item, or for the whole domain if item_name is None."""
+        with self._lock:
+            self._writes += 1
+            if item_name is not None:
+                item_keys = [(domain_name, item_name)]
+            else:
+                item_keys = [k for k in self._keys_by_item if k[0] == domain_name]
+            for item_key in item_keys:
+                for key in list(self._keys_by_item.get(item_key, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._writes += 1
+            self._entries.clear()
+            self._keys_by_item.clear()
+
+    def stats(self):
+        """Returns counters of the cache.
+
+        :return: (dict) { 'Hits': 0, 'Misses': 0, 'Evictions': 0, 'Invalidations': 0, 'Size': 0 }
+        """
+        with self._lock:
+            return {'Hits': self.hits,
+                    'Misses': self.misses,
+                    'Evictions': self.evictions,
+                    'Invalidations': self.invalidations,
+                    'Size': len(self._entries)}
+
+    def _remove(self, key):
+        del self._entries[key]
+        item_keys = self._keys_by_item.get(key[:2])
+        if item_keys is not None:
+            item_keys.discard(key)
+            if not item_keys:
+                del self._keys_by_item[key[:2]]
+
+
+##############
+# Throttling #
+##############
+
+
+class TokenBucket(object):
+    """Thread safe token bucket that limits calls to `rate` per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(1, rate))
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes a token, sleeping until one is available.
+
+        :return: (float) Seconds spent waiting
+        """
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait_time = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait_time:
+            time.sleep(wait_time)
+        return wait_time
+
+
+class AimdLimiter(object):
+    """Thread safe concurrency limit that grows additively on success and shrinks multiplicatively on throttling.
+    The limit grows by `increase` per limit's worth of successful calls, i.e. roughly once per round trip.
+    """
+
+    def __init__(self, initial=16, min_limit=1, max_limit=64, increase=1.0, decrease=0.5, cooldown=1.0):
+        """INPUTS:
+                initial (int)     : Starting concurrency limit
+                min_limit (int)   : Lowest concurrency limit
+                max_limit (int)   : Highest concurrency limit
+                increase (float)  : Amount the limit grows per limit's worth of successful calls
+                decrease (float)  : Factor the limit is multiplied by on throttling
+                cooldown (float)  : Min seconds between decreases so one burst of throttles only backs off once
+            OUTPUTS:
+                None
+        """
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                now = time.time()
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self._last_decrease = now
+            else:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._cond.notify_all()
+
+
+class RequestThrottler(object):
+    """Client side rate limit, concurrency limit and retry policy shared by every SimpleDbHelper call.
+    Calls to each domain go through a token bucket, all calls share an AIMD concurrency limit and
+    throttled or transient failures are retried with full jitter exponential backoff.
+    """
+
+    def __init__(self, rate_per_domain=None, burst=None, initial_concurrency=16, max_concurrency=64,
+                 max_attempts=6, base_delay=0.1, max_delay=20):
+        """INPUTS:
+                rate_per_domain (float)   : Max calls per second to each domain. None disables the rate limit
+                                            OPTIONAL
+                burst (int)               : Max burst of calls per domain
+                                            Default: rate_per_domain
+                                            OPTIONAL
+                initial_concurrency (int) : Starting concurrency limit across all calls
+                                            Default: 16
+                                            OPTIONAL
+                max_concurrency (int)     : Highest concurrency limit across all calls
+                                            Default: 64
+                                            OPTIONAL
+                max_attempts (int)        : Max attempts per call, including the first
+                                            Default: 6
+                                            OPTIONAL
+                base_delay (float)        : Seconds of the first backoff before jitter
+                                            Default: 0.1
+                                            OPTIONAL
+                max_delay (float)         : Max seconds of a backoff before jitter
+                                            Default: 20
+                                            OPTIONAL
+            OUTPUTS:
+                None
+        """
+        self.rate_per_domain = rate_per_domain
+        self.burst = burst
+        self.limiter = AimdLimiter(initial=initial_concurrency, max_limit=max_concurrency)
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def call(self, operation_name, operation, domain_name=None, **params):
+        """Calls operation(**params), retrying throttled and transient failures.
+
+            INPUT:
+                operation_name (str) : Name of the operation for the stats
+                                       REQUIRED
+                operation (func)     : Client method to call
+                                       REQUIRED
+                domain_name (str)    : Domain the call is rate limited against. None skips the rate limit
+                                       OPTIONAL
+            OUTPUTS:
+                Response of the operation
+        """
+        bucket = self._bucket(domain_name)
+        for attempt in range(self.max_attempts):
+            waited = bucket.acquire() if bucket else 0
+            self.limiter.acquire()
+            throttled = False
+            try:
+                resp = operation(**params)
+            except ClientError as e:
+                code = e.response.get('Error', {}).get('Code')
+                status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+                throttled = code in THROTTLING_ERROR_CODES or status in (429, 503)
+                retryable = throttled or code in RETRYABLE_ERROR_CODES or status >= 500
+                error = e
+            except (BotoConnectionError, HTTPClientError) as e:
+                retryable = True
+                error = e
+            else:
+                self._record(operation_name, waited, attempt, throttled=False, failed=False)
+                return resp
+            finally:
+                # Released for every outcome, an exception not handled above must not leak the slot
+                self.limiter.release(throttled)
+
+            if not retryable or attempt == self.max_attempts - 1:
+                self._record(operation_name, waited, attempt, throttled, failed=True)
+                raise error
+            self._record(operation_name, waited, attempt, throttled, failed=False, retried=True)
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+    def stats(self):
+        """Returns the call counters per operation and the current concurrency limit.
+
+        :return: (dict) {
+                            'ConcurrencyLimit': 16.0,
+                            'InFlight': 0,
+                            'Operations': { 'select': { 'Calls': 0, 'Retries': 0, 'Throttles': 0, 'Failures': 0,
+                                                        'RateLimitWaitSeconds': 0.0 } }
+                        }
+        """
+        with self._lock:
+            operations = {name: dict(counters) for name, counters in self._stats.items()}
+        return {'ConcurrencyLimit': self.limiter.limit,
+                'InFlight': self.limiter.in_flight,
+                'Operations': operations}
+
+    def _bucket(self, domain_name):
+        if not self.rate_per_domain or not domain_name:
+            return None
+        with self._lock:
+            if domain_name not in self._buckets:
+                self._buckets[domain_name] = TokenBucket(self.rate_per_domain, self.burst)
+            return self._buckets[domain_name]
+
+    def _record(self, operation_name, waited, attempt, throttled, failed, retried=False):
+        with self._lock:
+            counters = self._stats.get(operation_name)
+            if counters is None:
+                counters = {'Calls': 0, 'Retries': 0, 'Throttles': 0, 'Failures': 0, 'RateLimitWaitSeconds': 0.0}
+                self._stats[operation_name] = counters
+            if attempt == 0:
+                counters['Calls'] += 1
+            counters['Retries'] += 1 if retried else 0
+            counters['Throttles'] += 1 if throttled else 0
+            counters['Failures'] += 1 if failed else 0
+            counters['RateLimitWaitSeconds'] += waited
+
+
+###########
+# Clients #
+###########
+
+
+class SdbClientPool(object):
+    """Lazily builds one boto3 sdb client for a (profile, region) and shares it between threads.
+    Clients are thread safe once built and building one is slow, so every thread, including the short lived
+    workers of the parallel helpers, reuses the same client and its pool of keep-alive HTTP connections.
+    The pool is sized to the most calls made at once, see reserve.
+    """
+
+    # Session and client creation touches shared botocore loaders, so only one is built at a time
+    _create_lock = threading.Lock()
+
+    def __init__(self, profile="default", region="us-west-2", max_pool_connections=10):
+        """INPUTS:
+                profile (str)              : AWS profile to use for the session
+                                             Default: default
+                                             OPTIONAL
+                region (str)               : AWS region of the SimpleDB endpoint
+                                             Default: us-west-2
+                                             OPTIONAL
+                max_pool_connections (int) : Max HTTP connections kept open by the client
+                                             Default: 10
+                                             OPTIONAL
+            OUTPUTS:
+                None
+        """
+        self.profile = profile
+        self.region = region
+        self.max_pool_connections = max_pool_connections
+        self.clients_created = 0
+        self._client = None
+
+    def reserve(self, connections):
+        """Makes the client's connection pool hold at least `connections`, so that many threads can call at once
+        without waiting for or discarding connections. A client with a smaller pool is replaced, calls already
+        made with it finish on it.
+        """
+        with self._create_lock:
+            if connections > self.max_pool_connections:
+                self.max_pool_connections = connections
+                self._client = None
+
+    def client(self):
+        """Returns the shared sdb client, building it on first use."""
+        client = self._client
+        if client is None:
+            with self._create_lock:
+                if self._client is None:
+                    session = boto3.session.Session(profile_name=self.profile, region_name=self.region)
+                    # Retries are left to the RequestThrottler so it sees every throttling response
+                    config = Config(max_pool_connections=self.max_pool_connections, retries={'max_attempts': 0})
+                    self._client = session.client('sdb', config=config)
+                    self.clients_created += 1
+                client = self._client
+        return client
+
+
+_client_pools = {}
+_client_pools_lock = threading.Lock()
+
+
+def get_client_pool(profile="default", region="us-west-2", max_pool_connections=10):
+    """Returns the process wide SdbClientPool for (profile, region) so helpers with the same settings share one
+    client, with a connection pool of at least max_pool_connections.
+    """
+    key = (profile, region)
+    with _client_pools_lock:
+        if key not in _client_pools:
+            _client_pools[key] = SdbClientPool(profile, region, max_pool_connections)
+        pool = _client_pools[key]
+    pool.reserve(max_pool_connections)
+    return pool
+
 
 ############
 # SimpleDB #
@@ -16,16 +438,55 @@ pp = pprint.PrettyPrinter(indent=4)
 
 
 class SimpleDbHelper(object):
-    def __init__(self, profile="default", region="us-west-2"):
+    def __init__(self, profile="default", region="us-west-2", cache_size=0, cache_ttl=60, throttler=None,
+                 backend=None, verbose=True, max_pool_connections=10):
         """INPUTS:
                 profile (str)     : AWS profile to use for session
                                     Default: default
                                     OPTIONAL
+                region (str)      : AWS region of the SimpleDB endpoint
+                                    Default: us-west-2
+                                    OPTIONAL
+                cache_size (int)  : Max number of get_attributes responses to cache. 0 disables the cache
+                                    Default: 0
+                                    OPTIONAL
+                cache_ttl (float) : Seconds a cached get_attributes response stays valid
+                                    Default: 60
+                                    OPTIONAL
+                throttler (RequestThrottler) : Rate limit, concurrency limit and retry policy of every call.
+                                               Can be shared between helpers
+                                               Default: RequestThrottler()
+                                               OPTIONAL
+                backend (object)  : Object with the boto3 sdb client methods to send calls to instead of AWS,
+                                    e.g. sdb_emulator.SimpleDbEmulator
+                                    OPTIONAL
+                verbose (bool)    : Print a message for every call
+                                    Default: True
+                                    OPTIONAL
+                max_pool_connections (int) : Max HTTP connections kept open by the shared client. Raised to the
+                                             throttler's max concurrency, the most calls in flight at once
+                                             Default: 10
+                                             OPTIONAL
             OUTPUTS:
                 None
         """
-        boto3.setup_default_session(profile_name=profile)
-        self.sdb_client = boto3.client('sdb', region_name=region)
+        self.profile = profile
+        self.region = region
+        self.verbose = verbose
+        self._backend = backend
+        self.cache = AttributeCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.throttler = throttler if throttler is not None else RequestThrottler()
+        self._client_pool = None
+        if backend is None:
+            connections = max(max_pool_connections, self.throttler.limiter.max_limit)
+            self._client_pool = get_client_pool(profile, region, connections)
+
+    @property
+    def sdb_client(self):
+        """The backend if one was given, otherwise the shared boto3 sdb client."""
+        if self._backend is not None:
+            return self._backend
+        return self._client_pool.client()
 
     def get_domain_metadata(self, domain_name):
         """Retrieves the domain's metadata.
@@ -45,10 +506,10 @@ class SimpleDbHelper(object):
                                     REQUIRED
         """
         self._validate_input({'domain_name': domain_name}, "GetDomainMetadata")
-        print('SimpleDBHelper::GetDomainMetadata: Domain {}'.format(domain_name))
+        self._log('SimpleDBHelper::GetDomainMetadata: Domain {}'.format(domain_name))
         resp = None
         try:
-            resp = self.sdb_client.domain_metadata(
+            resp = self._call('domain_metadata',
                 DomainName=domain_name
             )
         except ClientError as e:
@@ -56,20 +517,28 @@ class SimpleDbHelper(object):
                 return None
         return resp
 
-    def create_domain(self, domain_name):
+    def create_domain(self, domain_name, wait=True, timeout=120):
         """Creates SimpleDB domain.
-        It takes at least 10 seconds (maybe more) for AWS to create a domain.
+        It takes at least 10 seconds (maybe more) for AWS to create a domain, so by default
+        this polls until the domain is visible.
 
             INPUT:
                 domain_name (str) : SimpleDB domain name
                                     REQUIRED
+                wait (bool)       : Wait until the domain exists
+                                    Default: True
+                                    OPTIONAL
+                timeout (float)   : Max seconds to wait
+                                    Default: 120
+                                    OPTIONAL
         """
         self._validate_input({'domain_name': domain_name}, "CreateDomain")
-        print('SimpleDBHelper::CreateDomain: {}'.format(domain_name))
-        self.sdb_client.create_domain(
+        self._log('SimpleDBHelper::CreateDomain: {}'.format(domain_name))
+        self._call('create_domain',
             DomainName=domain_name
         )
-        time.sleep(15)
+        if wait:
+            self.wait_for_domain(domain_name, exists=True, timeout=timeout)
 
     def put_attributes(self, domain_name, item_name, attrs):
         """Put attributes into SimpleDB domain.
@@ -90,12 +559,15 @@ class SimpleDbHelper(object):
         self._validate_input({'domain_name': domain_name,
                               'item_name': item_name,
                               'attrs': attrs}, "PutAttributes")
-        print('SimpleDB::PutAttributes: Attrs {}'.format(attrs))
-        self.sdb_client.put_attributes(
-            DomainName=domain_name,
-            ItemName=item_name,
-            Attributes=attrs
-        )
+        self._log('SimpleDB::PutAttributes: Attrs {}'.format(attrs))
+        try:
+            self._call('put_attributes',
+                DomainName=domain_name,
+                ItemName=item_name,
+                Attributes=attrs
+            )
+        finally:
+            self._invalidate(domain_name, [item_name])
 
     def delete_attributes(self, domain_name, item_name, attrs):
         """Delete attributes from SimpleDB domain.
@@ -116,12 +588,15 @@ class SimpleDbHelper(object):
         self._validate_input({'domain_name': domain_name,
                               'item_name': item_name,
                               'attrs': attrs}, "PutAttributes")
-        print('SimpleDB::DeleteAttributes: Attrs {}'.format(attrs))
-        self.sdb_client.delete_attributes(
-            DomainName=domain_name,
-            ItemName=item_name,
-            Attributes=attrs
-        )
+        self._log('SimpleDB::DeleteAttributes: Attrs {}'.format(attrs))
+        try:
+            self._call('delete_attributes',
+                DomainName=domain_name,
+                ItemName=item_name,
+                Attributes=attrs
+            )
+        finally:
+            self._invalidate(domain_name, [item_name])
 
     def batch_delete_attributes(self, domain_name, items):
         """Batch delete attributes from SimpleDB domain.
@@ -139,11 +614,63 @@ class SimpleDbHelper(object):
                                     },]
                                     REQUIRED
         """
-        print('SimpleDB::BatchDeleteAttributes: Items {}'.format(items))
-        self.sdb_client.batch_delete_attributes(
-            DomainName=domain_name,
-            Items=items
-        )
+        self._log('SimpleDB::BatchDeleteAttributes: Items {}'.format(items))
+        try:
+            self._call('batch_delete_attributes',
+                DomainName=domain_name,
+                Items=items
+            )
+        finally:
+            self._invalidate(domain_name, [item['Name'] for item in items])
+
+    def batch_put_items(self, domain_name, items, workers=8):
+        """Batch put an arbitrarily large number of items into SimpleDB domain.
+        Items are split into BatchPutAttributes requests that respect the 25 item and 1 MB
+        limits and the requests are sent concurrently on a bounded thread pool.
+
+            INPUT:
+                domain_name (str) : SimpleDB domain name
+                                    REQUIRED
+                items (iterable)  : Items with Attributes. Format:
+                                    {
+                                        'Name': 'string',
+                                        'Attributes': [{ 'Name' : 'string', 'Value' : 'string', 'Replace': True|False },]
+                                    }
+                                    REQUIRED
+                workers (int)     : Max number of requests in flight
+                                    Default: 8
+                                    OPTIONAL
+            OUTPUTS:
+                (list) Per chunk results, see _run_batches
+        """
+        self._validate_input({'domain_name': domain_name}, "BatchPutItems")
+        return self._run_batches('batch_put_attributes', _domain_chunks(domain_name, items), workers,
+                                 "BatchPutItems", domain_name)
+
+    def batch_delete_items(self, domain_name, items, workers=8):
+        """Batch delete an arbitrarily large number of items from SimpleDB domain.
+        Items are split into BatchDeleteAttributes requests that respect the 25 item and 1 MB
+        limits and the requests are sent concurrently on a bounded thread pool.
+
+            INPUT:
+                domain_name (str) : SimpleDB domain name
+                                    REQUIRED
+                items (iterable)  : Items with Attributes. If an item has no Attributes, the whole item is deleted.
+                                    Format:
+                                    {
+                                        'Name': 'string',
+                                        'Attributes': [{ 'Name' : 'string', 'Value' : 'string' },]
+                                    }
+                                    REQUIRED
+                workers (int)     : Max number of requests in flight
+                                    Default: 8
+                                    OPTIONAL
+            OUTPUTS:
+                (list) Per chunk results, see _run_batches
+        """
+        self._validate_input({'domain_name': domain_name}, "BatchDeleteItems")
+        return self._run_batches('batch_delete_attributes', _domain_chunks(domain_name, items), workers,
+                                 "BatchDeleteItems", domain_name)
 
     def get_attributes(self, domain_name, item_name, attr_names):
         """Get attributes associated with specified item from SimpleDB domain.
@@ -159,55 +686,167 @@ class SimpleDbHelper(object):
         self._validate_input({'domain_name': domain_name,
                               'item_name': item_name,
                               'attr_names': attr_names}, "PutAttributes")
-        print('SimpleDB::DeleteAttributes: Attribute Names {}'.format(attr_names))
-        resp = self.sdb_client.get_attributes(
+        self._log('SimpleDB::DeleteAttributes: Attribute Names {}'.format(attr_names))
+        if self.cache is not None:
+            key = AttributeCache.make_key(domain_name, item_name, attr_names)
+            found, attrs = self.cache.get(key)
+            if found:
+                return [dict(attr) for attr in attrs]
+            write_count = self.cache.write_count()
+
+        resp = self._call('get_attributes',
             DomainName=domain_name,
             ItemName=item_name,
             AttributeNames=attr_names,
             ConsistentRead=True
         )
-        print('AWSQA::SimpleDB: Response: {}'.format(resp))
-        return resp['Attributes']
+        self._log('AWSQA::SimpleDB: Response: {}'.format(resp))
+        attrs = resp.get('Attributes', [])
+        if self.cache is not None:
+            self.cache.put(key, [dict(attr) for attr in attrs], write_count)
+        return attrs
 
-    def delete_domain(self, domain_name):
+    def delete_domain(self, domain_name, wait=True, timeout=120):
         """Deletes SimpleDB domain.
-        It takes at least 10 seconds (maybe more) for AWS to delete a domain.
+        It takes at least 10 seconds (maybe more) for AWS to delete a domain, so by default
+        this polls until the domain is gone.
 
             INPUT:
                 domain_name (str) : SimpleDB domain name
                                     REQUIRED
+                wait (bool)       : Wait until the domain no longer exists
+                                    Default: True
+                                    OPTIONAL
+                timeout (float)   : Max seconds to wait
+                                    Default: 120
+                                    OPTIONAL
         """
         self._validate_input({'domain_name': domain_name}, "DeleteDomain")
-        print('SimpleDB::DeleteDomain: {}'.format(domain_name))
-        self.sdb_client.delete_domain(
-            DomainName=domain_name
-        )
-        time.sleep(15)
+        self._log('SimpleDB::DeleteDomain: {}'.format(domain_name))
+        try:
+            self._call('delete_domain',
+                DomainName=domain_name
+            )
+        finally:
+            self._invalidate(domain_name)
+        if wait:
+            self.wait_for_domain(domain_name, exists=False, timeout=timeout)
+
+    def wait_for_domain(self, domain_name, exists=True, timeout=120, initial_delay=0.5, max_delay=5):
+        """Polls domain metadata with exponential backoff until the domain exists or is gone.
+
+            INPUT:
+                domain_name (str)     : SimpleDB domain name
+                                        REQUIRED
+                exists (bool)         : True waits for the domain to appear, False for it to disappear
+                                        Default: True
+                                        OPTIONAL
+                timeout (float)       : Max seconds to wait before raising an Exception
+                                        Default: 120
+                                        OPTIONAL
+                initial_delay (float) : Seconds before the first poll. Doubles after every poll
+                                        Default: 0.5
+                                        OPTIONAL
+                max_delay (float)     : Max seconds between polls
+                                        Default: 5
+                                        OPTIONAL
+        """
+        deadline = time.time() + timeout
+        delay = initial_delay
+        while True:
+            try:
+                self._call('domain_metadata', DomainName=domain_name)
+                found = True
+            except ClientError as e:
+                if e.response['Error']['Code'] != "NoSuchDomain":
+                    raise
+                found = False
+            if found == exists:
+                return
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                state = "does not exist" if exists else "still exists"
+                raise Exception("SimpleDB::WaitForDomainError: Domain {} {} after {} seconds."
+                                .format(domain_name, state, timeout))
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, max_delay)
 
     def list_domains(self):
         """Lists all domains in SimpleDB.
 
         """
-        resp = self.sdb_client.list_domains()
+        resp = self._call('list_domains')
         domain_names = resp['DomainNames'] if 'DomainNames' in resp else []
         while 'NextToken' in resp:
-            resp = self.sdb_client.list_domains(NextToken=resp['NextToken'])
+            resp = self._call('list_domains', NextToken=resp['NextToken'])
             domain_names += resp['DomainNames']
 
         return domain_names
 
-    def select(self, query):
-        """Query SimpleDB Table
+    def select(self, query, next_token=None):
+        """Query SimpleDB Table. Only returns a single page of results.
 
         :param query: (str) SQL query string
+        :param next_token: (str) NextToken of the previous page. Optional
         :return: (dict) { 'Items': [ <SimpleDB_Attribute>, ...], 'NextToken': 'string' }
         """
-        resp = self.sdb_client.select(
-            SelectExpression=query,
-            ConsistentRead=True
-        )
+        params = {'SelectExpression': query, 'ConsistentRead': True}
+        if next_token:
+            params['NextToken'] = next_token
+        resp = self._call('select', **params)
         return resp
 
+    def select_iter(self, query, page_prefetch=1):
+        """Query SimpleDB Table and yield every item, following NextToken until the last page.
+        Up to `page_prefetch` pages are fetched in the background while the caller handles
+        the current one, so only a few pages are held in memory at a time.
+
+        :param query: (str) SQL query string
+        :param page_prefetch: (int) Number of pages to fetch ahead. 0 fetches pages inline
+        :return: (generator) <SimpleDB_Attribute> items
+        """
+        if page_prefetch <= 0:
+            next_token = None
+            while True:
+                resp = self.select(query, next_token)
+                for item in resp.get('Items', []):
+                    yield item
+                next_token = resp.get('NextToken')
+                if not next_token:
+                    return
+
+        pages = queue.Queue(maxsize=page_prefetch)
+        stop = threading.Event()
+
+        def fetch_pages():
+            next_token = None
+            try:
+                while not stop.is_set():
+                    resp = self.select(query, next_token)
+                    next_token = resp.get('NextToken')
+                    if not _put_unless_stopped(pages, (resp.get('Items', []), None), stop) or not next_token:
+                        break
+            except Exception as e:
+                _put_unless_stopped(pages, (None, e), stop)
+                return
+            _put_unless_stopped(pages, (None, None), stop)
+
+        fetcher = threading.Thread(target=fetch_pages, name="sdb-select-prefetch")
+        fetcher.daemon = True
+        fetcher.start()
+        try:
+            while True:
+                items, error = pages.get()
+                if error is not None:
+                    raise error
+                if items is None:
+                    return
+                for item in items:
+                    yield item
+        finally:
+            stop.set()
+
     def display_items(self, domains):
         """Displays all the items in each of the domains requested.
             INPUT:
@@ -215,17 +854,355 @@ class SimpleDbHelper(object):
         """
         for d in domains:
             query = 'select * from `{}`'.format(d)
-            resp = self.select(query)
             print('\nHere is the response for domain {}'.format(d))
-            if 'Items' in resp:
-                items = resp['Items']
-                for i, item in enumerate(items):
-                    print("=" * 20 + str(i) + "=" * 20)
-                    pp.pprint(item)
-                    print("=" * 41)
-            else:
+            i = -1
+            for i, item in enumerate(self.select_iter(query)):
+                print("=" * 20 + str(i) + "=" * 20)
+                pp.pprint(item)
+                print("=" * 41)
+            if i < 0:
                 print("Empty response")
-                pprint.pprint(resp, indent=4)
+
+    def scan_items(self, domain_name, segments=8, boundaries=None, attr_names=None, page_prefetch=1):
+        """Scans a whole domain by splitting the itemName() keyspace into ranges that are selected
+        concurrently. Items from all ranges are merged into one stream in no particular order.
+
+            INPUT:
+                domain_name (str)  : SimpleDB domain name
+                                     REQUIRED
+                segments (int)     : Number of ranges to split the keyspace into when boundaries is not given
+                                     Default: 8
+                                     OPTIONAL
+                boundaries (list)  : Sorted item names to split the keyspace on. N boundaries make N + 1 ranges.
+                                     Default: keyspace_boundaries(domain_name, segments)
+                                     OPTIONAL
+                attr_names (list)  : Attribute names to select. Default selects all attributes
+                                     OPTIONAL
+                page_prefetch (int): Pages fetched ahead by each range, see select_iter
+                                     Default: 1
+                                     OPTIONAL
+            OUTPUTS:
+                (generator) <SimpleDB_Attribute> items
+        """
+        self._validate_input({'domain_name': domain_name}, "ScanItems")
+        if boundaries is None:
+            boundaries = self.keyspace_boundaries(domain_name, segments) if segments > 1 else []
+        queries = _segment_queries(domain_name, boundaries, attr_names)
+        self._log('SimpleDB::ScanItems: Domain {} in {} segments'.format(domain_name, len(queries)))
+        return self.merge_selects(queries, page_prefetch)
+
+    def keyspace_boundaries(self, domain_name, segments=8, alphabet=ITEM_NAME_ALPHABET, max_counts=100):
+        """Picks itemName() boundaries that split a domain into `segments` ranges of about as many items each.
+        The range with the most items is bisected with a count(*) select until no range holds more than a quarter
+        of a segment, and neighbouring ranges are then grouped into segments. A range is bisected between its
+        first and last item names, so clustered names (user-..., numeric ids, UUIDs), long common prefixes and
+        names outside the alphabet are split where they are. Falls back to split_keyspace for an empty domain.
+
+            INPUT:
+                domain_name (str) : SimpleDB domain name
+                                    REQUIRED
+                segments (int)    : Number of ranges
+                                    Default: 8
+                                    OPTIONAL
+                alphabet (str)    : Characters item names are made of, see split_keyspace. Characters of the
+                                    item names are added to it
+                                    OPTIONAL
+                max_counts (int)  : Max count(*) and itemName() selects, the ranges found by then are used
+                                    Default: 100
+                                    OPTIONAL
+            OUTPUTS:
+                (list) Sorted boundaries, one less than the number of ranges at most
+        """
+        self._validate_input({'domain_name': domain_name}, "KeyspaceBoundaries")
+        alphabet = ''.join(sorted(set(alphabet)))
+        total = self._count_items(domain_name, None, None)
+        if not total:
+            return split_keyspace(segments, alphabet)
+
+        # Split into ranges of at most a quarter segment, then group neighbouring ranges into segments
+        target = float(total) / max(1, segments)
+        # [count, low, high, first, last], None low and high are the ends of the keyspace, None first and last
+        # item names are not looked up yet
+        ranges = [[total, None, None, None, None]]
+        counts = 1
+        while counts < max_counts:
+            index = max(range(len(ranges)), key=lambda i: ranges[i][0])
+            count, low, high, first, last = ranges[index]
+            if count <= max(1, target / 4):
+                break
+            if first is None:
+                first = ranges[index][3] = self._edge_item_name(domain_name, low, high)
+                counts += 1
+            if last is None:
+                last = ranges[index][4] = self._edge_item_name(domain_name, low, high, last=True)
+                counts += 1
+            if first is None or first == last:
+                # Items were deleted since the range was counted
+                ranges[index][0] = 0 if first is None else 1
+                continue
+            middle = _name_between(first, last, alphabet)
+            below = self._count_items(domain_name, low, middle)
+            counts += 1
+            ranges[index:index + 1] = [[below, low, middle, first, None], [count - below, middle, high, None, last]]
+
+        boundaries = []
+        before = 0
+        for count, low, _, _, _ in ranges:
+            # A segment ends before the range that would take it closer past its share. Empty ranges join the
+            # segment before them
+            if count and before and len(boundaries) < segments - 1 and \
+                    before + count / 2.0 >= target * (len(boundaries) + 1):
+                boundaries.append(low)
+            before += count
+        self._log('SimpleDB::KeyspaceBoundaries: Domain {} of {} items split on {} after {} selects'.format(
+            domain_name, total, boundaries, counts))
+        return boundaries
+
+    def _count_items(self, domain_name, low, high):
+        """Counts the items with low <= itemName() < high, None low or high leaves that side open."""
+        query = "select count(*) from {}{}".format(_quote_name(domain_name), _item_name_range(low, high))
+        # A count that runs out of time returns a partial count and a NextToken for the rest
+        return sum(int(a['Value']) for item in self.select_iter(query) for a in item.get('Attributes', [])
+                   if a['Name'] == 'Count')
+
+    def _edge_item_name(self, domain_name, low, high, last=False):
+        """Returns the first, or last, item name with low <= itemName() < high, None if there is none."""
+        query = "select itemName() from {}{} order by itemName(){} limit 1".format(
+            _quote_name(domain_name), _item_name_range(low, high, " where itemName() is not null"),
+            " desc" if last else "")
+        # A select that runs out of time returns no items and a NextToken to go on from
+        return next((item['Name'] for item in self.select_iter(query, page_prefetch=0)), None)
+
+    def merge_selects(self, queries, page_prefetch=1):
+        """Runs every query concurrently, following NextToken, and merges the items into one stream
+        in no particular order.
+
+        :param queries: (list) Select expressions
+        :param page_prefetch: (int) Pages fetched ahead by each query, see select_iter
+        :return: (generator) <SimpleDB_Attribute> items
+        """
+        results = queue.Queue(maxsize=len(queries) * 4)
+        stop = threading.Event()
+
+        def scan_segment(query, page_size=100):
+            batch = []
+            try:
+                for item in self.select_iter(query, page_prefetch):
+                    batch.append(item)
+                    if len(batch) >= page_size:
+                        if not _put_unless_stopped(results, (batch, None), stop):
+                            return
+                        batch = []
+                _put_unless_stopped(results, (batch, None), stop)
+            except Exception as e:
+                _put_unless_stopped(results, (None, e), stop)
+                return
+            _put_unless_stopped(results, (None, None), stop)
+
+        executor = ThreadPoolExecutor(max_workers=len(queries))
+        for query in queries:
+            executor.submit(scan_segment, query)
+        try:
+            remaining = len(queries)
+            while remaining:
+                items, error = results.get()
+                if error is not None:
+                    raise error
+                if items is None:
+                    remaining -= 1
+                    continue
+                for item in items:
+                    yield item
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+
+    def export_domain(self, domain_name, file_name, fmt="jsonl", attr_names=None, segments=8, boundaries=None,
+                      path_to_file=None):
+        """Exports a whole domain with a segmented scan to {path_to_file}/{file_name}.jsonl or .csv.
+        JSON lines are written as { "Name": "string", "Attributes": { "name": "value" | ["value",] } }.
+
+            INPUT:
+                domain_name (str) : SimpleDB domain name
+                                    REQUIRED
+                file_name (str)   : File name without the extension
+                                    REQUIRED
+                fmt (str)         : jsonl or csv
+                                    Default: jsonl
+                                    OPTIONAL
+                attr_names (list) : Attribute names to export. REQUIRED for csv since they are the columns
+                                    OPTIONAL
+                segments (int)    : See scan_items
+                                    OPTIONAL
+                boundaries (list) : See scan_items
+                                    OPTIONAL
+                path_to_file (str): Directory to write the file into
+                                    OPTIONAL
+            OUTPUTS:
+                (int) Number of items exported
+        """
+        _validate_export(fmt, attr_names, "ExportDomain")
+        count = _write_items(self.scan_items(domain_name, segments, boundaries, attr_names), file_name, fmt,
+                             attr_names, path_to_file)
+        self._log('SimpleDB::ExportDomain: Exported {} items from domain {}'.format(count, domain_name))
+        return count
+
+    def iter_changes(self, domain_name, attr_name, checkpoint_file, attr_names=None, checkpoint_every=1000,
+                     page_prefetch=1):
+        """Yields only the items whose attr_name is at or past the high-water mark saved in checkpoint_file by
+        the previous run, in attr_name order, and moves the high-water mark forward as items are consumed.
+        Values are compared as strings, so attr_name should be a zero padded version or an ISO 8601 timestamp.
+
+        The checkpoint is saved every `checkpoint_every` items once the caller asks for the next item, and when
+        the generator is exhausted, so an item is never checkpointed before the caller has handled it. Items that
+        share the high-water mark value are remembered by name so they are not yielded twice.
+
+            INPUT:
+                domain_name (str)      : SimpleDB domain name
+                                         REQUIRED
+                attr_name (str)        : Timestamp or version attribute that increases on every change
+                                         REQUIRED
+                checkpoint_file (str)  : JSON file the high-water mark is loaded from and saved to. A missing file
+                                         starts from the beginning
+                                         REQUIRED
+                attr_names (list)      : Attribute names to select. Default selects all attributes
+                                         OPTIONAL
+                checkpoint_every (int) : Items between checkpoint saves. None only saves at the end
+                                         Default: 1000
+                                         OPTIONAL
+                page_prefetch (int)    : See select_iter
+                                         Default: 1
+                                         OPTIONAL
+            OUTPUTS:
+                (generator) <SimpleDB_Attribute> items
+        """
+        state = {}
+        for item in self._iter_changes(domain_name, attr_name, checkpoint_file, attr_names, checkpoint_every,
+                                       page_prefetch, state):
+            yield item
+        self._save_changes_checkpoint(domain_name, attr_name, checkpoint_file, state)
+
+    def _iter_changes(self, domain_name, attr_name, checkpoint_file, attr_names, checkpoint_every, page_prefetch,
+                      state):
+        """iter_changes without the final checkpoint save. The high-water mark reached and the item count are
+        left in state for _save_changes_checkpoint.
+        """
+        self._validate_input({'domain_name': domain_name, 'attr_name': attr_name,
+                              'checkpoint_file': checkpoint_file}, "IterChanges")
+        checkpoint = _load_checkpoint(checkpoint_file, domain_name, attr_name)
+        if attr_names and attr_name not in attr_names:
+            attr_names = list(attr_names) + [attr_name]
+        output = ', '.join(_quote_name(a) for a in attr_names) if attr_names else '*'
+        if checkpoint['Value'] is None:
+            predicate = "{} is not null".format(_quote_name(attr_name))
+        else:
+            predicate = "{} >= {}".format(_quote_name(attr_name), _quote_value(checkpoint['Value']))
+        query = "select {} from {} where {} order by {}".format(output, _quote_name(domain_name), predicate,
+                                                                 _quote_name(attr_name))
+        self._log('SimpleDB::IterChanges: Domain {} since {} {}'.format(domain_name, attr_name, checkpoint['Value']))
+
+        seen = set(checkpoint['ItemNames'])
+        unsaved = 0
+        state.update(Checkpoint=checkpoint, ItemNames=seen, Count=0)
+        for item in self.select_iter(query, page_prefetch):
+            values = [a['Value'] for a in item.get('Attributes', []) if a['Name'] == attr_name]
+            value = max(values) if values else None
+            if value is None or (value == checkpoint['Value'] and item['Name'] in seen):
+                continue
+
+            yield item
+
+            state['Count'] += 1
+            if value != checkpoint['Value']:
+                checkpoint['Value'] = value
+                seen = state['ItemNames'] = set()
+            seen.add(item['Name'])
+            unsaved += 1
+            if checkpoint_every and unsaved >= checkpoint_every:
+                _save_checkpoint(checkpoint_file, checkpoint, seen)
+                unsaved = 0
+
+    def _save_changes_checkpoint(self, domain_name, attr_name, checkpoint_file, state):
+        checkpoint = state['Checkpoint']
+        _save_checkpoint(checkpoint_file, checkpoint, state['ItemNames'])
+        self._log('SimpleDB::IterChanges: Domain {} had {} changed items, {} is now {}'.format(
+            domain_name, state['Count'], attr_name, checkpoint['Value']))
+
+    def export_changes(self, domain_name, attr_name, checkpoint_file, file_name, fmt="jsonl", attr_names=None,
+                       path_to_file=None):
+        """Exports the items changed since the last run, see iter_changes, to {path_to_file}/{file_name}.jsonl
+        or .csv, see export_domain. The checkpoint is only saved once the whole file is written.
+
+            OUTPUTS:
+                (int) Number of items exported
+        """
+        _validate_export(fmt, attr_names, "ExportChanges")
+        state = {}
+        items = self._iter_changes(domain_name, attr_name, checkpoint_file, attr_names, None, 1, state)
+        if fmt == "csv" and attr_name not in attr_names:
+            attr_names = list(attr_names) + [attr_name]
+        count = _write_items(items, file_name, fmt, attr_names, path_to_file)
+        # _write_items has closed the file, so every item the new high-water mark covers is written
+        self._save_changes_checkpoint(domain_name, attr_name, checkpoint_file, state)
+        self._log('SimpleDB::ExportChanges: Exported {} items from domain {}'.format(count, domain_name))
+        return count
+
+    def cleanup_domains(self, prefixes, workers=8, timeout=120):
+        """Deletes every domain that starts with one of the prefixes, many at a time.
+
+            INPUT:
+                prefixes (list)   : Domain name prefixes to delete
+                                    REQUIRED
+                workers (int)     : Max number of domains being deleted at once
+                                    Default: 8
+                                    OPTIONAL
+                timeout (float)   : Max seconds to wait for each domain to be gone
+                                    Default: 120
+                                    OPTIONAL
+            OUTPUTS:
+                (dict) { 'Deleted': ['string',], 'Failed': { 'domain': 'error' } }
+        """
+        self._validate_input({'prefixes': prefixes}, "CleanupDomains")
+        domains = [d for d in self.list_domains() if d.startswith(tuple(prefixes))]
+        self._log('SimpleDB::CleanupDomains: Deleting {} domains'.format(len(domains)))
+        return self.delete_domains(domains, workers, timeout)
+
+    def delete_domains(self, domains, workers=8, timeout=120):
+        """Deletes the domains many at a time.
+
+            INPUT:
+                domains (list)    : Domain names to delete
+                                    REQUIRED
+                workers (int)     : Max number of domains being deleted at once
+                                    Default: 8
+                                    OPTIONAL
+                timeout (float)   : Max seconds to wait for each domain to be gone
+                                    Default: 120
+                                    OPTIONAL
+            OUTPUTS:
+                (dict) { 'Deleted': ['string',], 'Failed': { 'domain': 'error' } }
+        """
+        result = {'Deleted': [], 'Failed': {}}
+        if not domains:
+            return result
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(self.delete_domain, d, True, timeout): d for d in domains}
+            for future in futures:
+                domain = futures[future]
+                try:
+                    future.result()
+                    result['Deleted'].append(domain)
+                except Exception as e:
+                    result['Failed'][domain] = str(e)
+        return result
+
+    def throttle_stats(self):
+        """Returns the retry and throttle counters of every call made through the helper, see RequestThrottler.stats"""
+        return self.throttler.stats()
+
+    def cache_stats(self):
+        """Returns the get_attributes cache counters, see AttributeCache.stats. None if the cache is disabled."""
+        return self.cache.stats() if self.cache is not None else None
 
     ###################
     # Private Methods #
@@ -241,10 +1218,669 @@ class SimpleDbHelper(object):
                 method (str)  : Name of the method where input validation is happening
                                 REQUIRED
         """
-        for key, val in params.iteritems():
+        for key, val in params.items():
             if not val:
                 raise Exception("SimpleDB::{}Error: {} cannot be None.".format(method, key))
 
+    def _log(self, msg):
+        if self.verbose:
+            print(msg)
+
+    def _call(self, operation_name, **params):
+        """Calls sdb_client.{operation_name}(**params) through the throttler.
+        Calls are rate limited against DomainName, or the domain in the from clause of a SelectExpression.
+        """
+        domain_name = params.get('DomainName')
+        if domain_name is None and 'SelectExpression' in params:
+            match = SELECT_DOMAIN_RE.search(params['SelectExpression'])
+            domain_name = (match.group(1) or match.group(2)).replace("``", "`") if match else None
+        operation = getattr(self.sdb_client, operation_name)
+        return self.throttler.call(operation_name, operation, domain_name, **params)
+
+    def _invalidate(self, domain_name, item_names=None):
+        """Drops cached get_attributes responses for the items, or for the whole domain if item_names is None."""
+        if self.cache is None:
+            return
+        if item_names is None:
+            self.cache.invalidate(domain_name)
+            return
+        for item_name in item_names:
+            self.cache.invalidate(domain_name, item_name)
+
+    def _run_batches(self, operation, chunks, workers, method, log_name):
+        """Sends chunks of items through a batch operation with at most `workers` requests in flight.
+        Chunks are only pulled as fast as they are sent, so `chunks` can be a generator of any size.
+
+            INPUT:
+                operation (str)   : Name of the sdb_client batch method to call with DomainName and Items
+                                    REQUIRED
+                chunks (iterable) : (domain_name, items) pairs, the items of a chunk within the batch limits, see
+                                    _chunk_items
+                                    REQUIRED
+                workers (int)     : Max number of requests in flight
+                                    REQUIRED
+                method (str)      : Name of the calling method for logging
+                                    REQUIRED
+                log_name (str)    : Domain, or logical domain of the chunks' domains, for logging
+                                    REQUIRED
+            OUTPUTS:
+                (list) One result per chunk in chunk order. Only failed chunks keep the names of their items, so
+                       the results of a large load stay small. Format:
+                       {
+                           'Chunk': 0,
+                           'Domain': 'string',
+                           'ItemCount': 0,
+                           'ItemNames': ['string',] if it failed, else [],
+                           'Success': True|False,
+                           'Error': None|'string'
+                       }
+        """
+        workers = max(1, workers)
+        results = []
+        in_flight = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, (domain_name, chunk) in enumerate(chunks):
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    results.extend(f.result() for f in done)
+                in_flight.add(executor.submit(self._send_batch, operation, domain_name, index, chunk))
+            done, _ = wait(in_flight)
+            results.extend(f.result() for f in done)
+
+        return self._batch_results(results, log_name, method)
+
+    def _send_batch(self, operation, domain_name, index, chunk):
+        """Sends one chunk through a batch operation and returns its result, see _run_batches."""
+        item_names = [item['Name'] for item in chunk]
+        result = {'Chunk': index, 'Domain': domain_name, 'ItemCount': len(chunk), 'ItemNames': [], 'Success': True,
+                  'Error': None}
+        try:
+            self._call(operation, DomainName=domain_name, Items=chunk)
+        except Exception as e:
+            result['ItemNames'] = item_names
+            result['Success'] = False
+            result['Error'] = str(e)
+        self._invalidate(domain_name, item_names)
+        return result
+
+    def _batch_results(self, results, domain_name, method):
+        """Sorts chunk results into chunk order and logs how many failed."""
+        results.sort(key=lambda r: r['Chunk'])
+        failed = [r for r in results if not r['Success']]
+        self._log('SimpleDB::{}: Domain {} sent {} chunks, {} failed'.format(method, domain_name, len(results),
+                                                                            len(failed)))
+        return results
+
+
+#########
+# Async #
+#########
+
+
+class AsyncSimpleDbHelper(object):
+    """asyncio interface to SimpleDbHelper. Every method is a coroutine that runs the matching SimpleDbHelper
+    call on a bounded thread pool, so any number of coroutines can be gathered while at most `max_concurrency`
+    calls are in flight. Validation, caching, throttling and result formats are shared with the wrapped helper,
+    so sync and async callers can use the same helper.
+
+        async with AsyncSimpleDbHelper(SimpleDbHelper()) as sdb:
+            config, sessions = await asyncio.gather(sdb.get_attributes('config', 'app', ['version']),
+                                                    sdb.select("select * from `sessions`"))
+    """
+
+    def __init__(self, helper=None, max_concurrency=16, **helper_kwargs):
+        """INPUTS:
+                helper (SimpleDbHelper) : Helper to run the calls with
+                                          Default: SimpleDbHelper(**helper_kwargs)
+                                          OPTIONAL
+                max_concurrency (int)   : Max number of calls in flight
+                                          Default: 16
+                                          OPTIONAL
+            OUTPUTS:
+                None
+        """
+        self.helper = helper if helper is not None else SimpleDbHelper(**helper_kwargs)
+        self.max_concurrency = max(1, max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    async def get_domain_metadata(self, domain_name):
+        return await self._run(self.helper.get_domain_metadata, domain_name)
+
+    async def create_domain(self, domain_name, wait=True, timeout=120):
+        return await self._run(self.helper.create_domain, domain_name, wait, timeout)
+
+    async def delete_domain(self, domain_name, wait=True, timeout=120):
+        return await self._run(self.helper.delete_domain, domain_name, wait, timeout)
+
+    async def list_domains(self):
+        return await self._run(self.helper.list_domains)
+
+    async def put_attributes(self, domain_name, item_name, attrs):
+        return await self._run(self.helper.put_attributes, domain_name, item_name, attrs)
+
+    async def delete_attributes(self, domain_name, item_name, attrs):
+        return await self._run(self.helper.delete_attributes, domain_name, item_name, attrs)
+
+    async def batch_delete_attributes(self, domain_name, items):
+        return await self._run(self.helper.batch_delete_attributes, domain_name, items)
+
+    async def get_attributes(self, domain_name, item_name, attr_names):
+        return await self._run(self.helper.get_attributes, domain_name, item_name, attr_names)
+
+    async def select(self, query, next_token=None):
+        return await self._run(self.helper.select, query, next_token)
+
+    async def select_iter(self, query, page_prefetch=1):
+        """Async generator version of SimpleDbHelper.select_iter. Up to `page_prefetch` pages are fetched
+        by a background task while the caller handles the current one.
+        """
+        if page_prefetch <= 0:
+            next_token = None
+            while True:
+                resp = await self.select(query, next_token)
+                for item in resp.get('Items', []):
+                    yield item
+                next_token = resp.get('NextToken')
+                if not next_token:
+                    return
+
+        pages = asyncio.Queue(maxsize=page_prefetch)
+
+        async def fetch_pages():
+            next_token = None
+            try:
+                while True:
+                    resp = await self.select(query, next_token)
+                    next_token = resp.get('NextToken')
+                    await pages.put((resp.get('Items', []), None))
+                    if not next_token:
+                        break
+            except Exception as e:
+                await pages.put((None, e))
+                return
+            await pages.put((None, None))
+
+        fetcher = asyncio.ensure_future(fetch_pages())
+        try:
+            while True:
+                items, error = await pages.get()
+                if error is not None:
+                    raise error
+                if items is None:
+                    return
+                for item in items:
+                    yield item
+        finally:
+            fetcher.cancel()
+
+    async def batch_put_items(self, domain_name, items, workers=8):
+        """See SimpleDbHelper.batch_put_items."""
+        self.helper._validate_input({'domain_name': domain_name}, "BatchPutItems")
+        return await self._run(self.helper._run_batches, 'batch_put_attributes', _domain_chunks(domain_name, items),
+                               workers, "BatchPutItems", domain_name)
+
+    async def batch_delete_items(self, domain_name, items, workers=8):
+        """See SimpleDbHelper.batch_delete_items."""
+        self.helper._validate_input({'domain_name': domain_name}, "BatchDeleteItems")
+        return await self._run(self.helper._run_batches, 'batch_delete_attributes',
+                               _domain_chunks(domain_name, items), workers, "BatchDeleteItems", domain_name)
+
+    async def gather(self, coros, limit=None):
+        """Awaits coroutines concurrently with at most `limit` of them running at once and returns their
+        results in order. Exceptions are returned in place of results instead of being raised.
+
+        :param coros: (iterable) Coroutines, e.g. [sdb.get_attributes(d, i, names) for i in item_names]
+        :param limit: (int) Max number running at once. Default max_concurrency
+        :return: (list) Results in the same order as coros
+        """
+        semaphore = asyncio.Semaphore(limit or self.max_concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        return await asyncio.gather(*[bounded(c) for c in coros], return_exceptions=True)
+
+    ###################
+    # Private Methods #
+    ###################
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args))
+
+
+############
+# Sharding #
+############
+
+
+class ShardedDomain(object):
+    """Spreads the items of one logical domain across N physical SimpleDB domains by hashing itemName.
+    Item calls go to the item's shard and selects fan out to every shard concurrently and are merged.
+
+        sessions = ShardedDomain(SimpleDbHelper(), "sessions", shards=8)
+        sessions.create()
+        sessions.put_attributes("user1", [{'Name': 'token', 'Value': 'abc', 'Replace': True}])
+        sessions.select("select * from `sessions` where expires < '2020' order by expires limit 100")
+    """
+
+    def __init__(self, helper, base_name, shards=4, workers=None):
+        """INPUTS:
+                helper (SimpleDbHelper) : Helper to make the calls with
+                                          REQUIRED
+                base_name (str)         : Logical domain name. Shards are named {base_name}-shard-{index:03d}
+                                          REQUIRED
+                shards (int)            : Number of physical domains. Must stay the same for the life of the data
+                                          Default: 4
+                                          OPTIONAL
+                workers (int)           : Max number of shards called at once
+                                          Default: shards
+                                          OPTIONAL
+            OUTPUTS:
+                None
+        """
+        helper._validate_input({'base_name': base_name, 'shards': shards}, "ShardedDomain")
+        self.helper = helper
+        self.base_name = base_name
+        self.shards = shards
+        self.workers = workers or shards
+        self.domain_names = ["{}-shard-{:03d}".format(base_name, i) for i in range(shards)]
+
+    def domain_for(self, item_name):
+        """Returns the name of the shard domain that holds the item."""
+        return self.domain_names[(zlib.crc32(item_name.encode('utf-8')) & 0xffffffff) % self.shards]
+
+    def create(self, timeout=120):
+        """Creates every shard domain concurrently and waits until they exist."""
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for future in [executor.submit(self.helper.create_domain, d, True, timeout) for d in self.domain_names]:
+                future.result()
+
+    def list_shards(self):
+        """Returns the shard domains that exist."""
+        existing = set(self.helper.list_domains())
+        return [d for d in self.domain_names if d in existing]
+
+    def delete(self, timeout=120):
+        """Deletes every existing shard domain concurrently, see SimpleDbHelper.delete_domains."""
+        return self.helper.delete_domains(self.list_shards(), self.workers, timeout)
+
+    def put_attributes(self, item_name, attrs):
+        return self.helper.put_attributes(self.domain_for(item_name), item_name, attrs)
+
+    def delete_attributes(self, item_name, attrs):
+        return self.helper.delete_attributes(self.domain_for(item_name), item_name, attrs)
+
+    def get_attributes(self, item_name, attr_names):
+        return self.helper.get_attributes(self.domain_for(item_name), item_name, attr_names)
+
+    def batch_put_items(self, items, workers=8):
+        """See SimpleDbHelper.batch_put_items, every chunk goes to one shard."""
+        return self.helper._run_batches('batch_put_attributes', self._shard_chunks(items), workers, "BatchPutItems",
+                                        self.base_name)
+
+    def batch_delete_items(self, items, workers=8):
+        """See SimpleDbHelper.batch_delete_items, every chunk goes to one shard."""
+        return self.helper._run_batches('batch_delete_attributes', self._shard_chunks(items), workers,
+                                        "BatchDeleteItems", self.base_name)
+
+    def select_iter(self, query, page_prefetch=1):
+        """Runs the query against every shard concurrently and merges the results.
+        The query names the logical domain in its from clause, e.g. select * from `sessions`.
+
+        - Without order by, items are streamed in no particular order.
+        - With order by, every shard returns its items sorted and they are merged in order. The sort
+          attribute must be selected, i.e. select * or select itemName() when ordering by itemName().
+        - limit N caps the merged result at N items instead of being a page size.
+        - count(*) is summed across shards.
+
+        :param query: (str) SQL query string
+        :param page_prefetch: (int) Pages fetched ahead by each shard, see select_iter
+        :return: (generator) <SimpleDB_Attribute> items
+        """
+        blanked = _blank_literals(query)
+        match = SELECT_DOMAIN_RE.search(blanked)
+        if match is None:
+            raise Exception("SimpleDB::ShardedSelectError: No from clause in query {}".format(query))
+        queries = [query[:match.start()] + "from " + _quote_name(d) + query[match.end():] for d in self.domain_names]
+
+        limit_match = SELECT_LIMIT_RE.search(blanked)
+        limit = int(limit_match.group(1)) if limit_match else None
+        if re.match(r"\s*select\s+count\s*\(\s*\*\s*\)", blanked, re.IGNORECASE):
+            total = sum(int(item['Attributes'][0]['Value']) for item in self.helper.merge_selects(queries))
+            yield {'Name': 'Domain', 'Attributes': [{'Name': 'Count', 'Value': str(total)}]}
+            return
+
+        order_match = SELECT_ORDER_RE.search(blanked)
+        if order_match is None:
+            merged = self.helper.merge_selects(queries, page_prefetch)
+        else:
+            attr = order_match.group(1)
+            attr = None if attr.lower().startswith("itemname") else attr.strip("`").replace("``", "`")
+            descending = (order_match.group(2) or "").lower() == "desc"
+            streams = [self.helper.select_iter(q, max(1, page_prefetch)) for q in queries]
+            merged = heapq.merge(*streams, key=functools.partial(_sort_value, attr), reverse=descending)
+
+        count = 0
+        try:
+            for item in merged:
+                if limit is not None and count >= limit:
+                    return
+                count += 1
+                yield item
+        finally:
+            if order_match is not None:
+                for stream in streams:
+                    stream.close()
+
+    def select(self, query):
+        """Runs the query against every shard and returns the merged result, see select_iter.
+
+        :param query: (str) SQL query string
+        :return: (dict) { 'Items': [ <SimpleDB_Attribute>, ...] }
+        """
+        return {'Items': list(self.select_iter(query))}
+
+    ###################
+    # Private Methods #
+    ###################
+
+    def _shard_chunks(self, items):
+        """Lazily groups items by shard into chunks that fit within the batch limits.
+
+        :return: (generator) (domain_name, chunk) tuples
+        """
+        buffers = {}
+        for item in items:
+            domain_name = self.domain_for(item['Name'])
+            chunk, size = buffers.get(domain_name, ([], 0))
+            item_size = _item_size(item)
+            if chunk and (len(chunk) >= BATCH_MAX_ITEMS or
+                          size + item_size > BATCH_MAX_BYTES - BATCH_REQUEST_OVERHEAD):
+                yield domain_name, chunk
+                chunk, size = [], 0
+            chunk.append(item)
+            buffers[domain_name] = (chunk, size + item_size)
+        for domain_name, (chunk, _) in buffers.items():
+            if chunk:
+                yield domain_name, chunk
+
+
+def _blank_literals(query):
+    """Replaces the contents of quoted values with spaces so clauses can be searched for without matching
+    inside values. The result has the same length as the query.
+    """
+    return re.sub(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"", lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", query)
+
+
+def _sort_value(attr_name, item):
+    """Sort key of an item for an order by on attr_name, or on itemName() if attr_name is None."""
+    if attr_name is None:
+        return item['Name']
+    values = [a['Value'] for a in item.get('Attributes', []) if a['Name'] == attr_name]
+    if not values:
+        raise Exception("SimpleDB::ShardedSelectError: Attribute {} must be selected to order by it."
+                        .format(attr_name))
+    return min(values)
+
+
+def _put_unless_stopped(q, entry, stop, poll=0.1):
+    """Puts entry on a bounded queue, giving up once stop is set.
+
+    :param q: (queue.Queue) Bounded queue
+    :param entry: Value to put on the queue
+    :param stop: (threading.Event) Set when the consumer has gone away
+    :param poll: (float) Seconds between checks of stop
+    :return: (bool) True if the entry was queued
+    """
+    while not stop.is_set():
+        try:
+            q.put(entry, timeout=poll)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def split_keyspace(segments, alphabet=ITEM_NAME_ALPHABET):
+    """Splits the itemName() keyspace into evenly spaced ranges over two character prefixes, without looking at
+    the domain. Real item names rarely spread over the whole alphabet, so scans pick their boundaries with
+    SimpleDbHelper.keyspace_boundaries and only fall back to this.
+
+    :param segments: (int) Number of ranges
+    :param alphabet: (str) Characters item names start with, in sort order
+    :return: (list) Sorted boundaries, one less than the number of ranges
+    """
+    alphabet = ''.join(sorted(set(alphabet)))
+    total = len(alphabet) ** 2
+    boundaries = []
+    for k in range(1, max(1, segments)):
+        position = k * total // segments
+        boundary = alphabet[position // len(alphabet)] + alphabet[position % len(alphabet)]
+        if not boundaries or boundary > boundaries[-1]:
+            boundaries.append(boundary)
+    return boundaries
+
+
+def _midpoint(low, high, alphabet, max_length=32):
+    """Returns a string between low and high, or None when there is none of up to max_length alphabet characters.
+    Strings are taken as base len(alphabet) fractions, a None low or high is the start or the end of the keyspace.
+    """
+    for length in range(1, max_length + 1):
+        start = _key_position(low, alphabet, length) if low is not None else 0
+        end = _key_position(high, alphabet, length) if high is not None else len(alphabet) ** length
+        if end - start < 2:
+            continue
+        position = (start + end) // 2
+        digits = []
+        for _ in range(length):
+            position, digit = divmod(position, len(alphabet))
+            digits.append(alphabet[digit])
+        middle = ''.join(reversed(digits)).rstrip(alphabet[0]) or alphabet[0]
+        if (low is None or middle > low) and (high is None or middle < high):
+            return middle
+    return None
+
+
+def _name_between(first, last, alphabet):
+    """Returns a name with first < name <= last, to split a range holding both between them. The names' common
+    prefix is kept and the rest is bisected over the alphabet and their own characters, see _midpoint.
+    """
+    prefix = os.path.commonprefix([first, last])
+    first, last = first[len(prefix):], last[len(prefix):]
+    middle = _midpoint(first, last, ''.join(sorted(set(alphabet + first + last))))
+    return prefix + (middle if middle is not None else last)
+
+
+def _item_name_range(low, high, otherwise=""):
+    """Where clause of low <= itemName() < high, None low or high leaves that side open."""
+    predicates = []
+    if low is not None:
+        predicates.append("itemName() >= {}".format(_quote_value(low)))
+    if high is not None:
+        predicates.append("itemName() < {}".format(_quote_value(high)))
+    return " where " + " and ".join(predicates) if predicates else otherwise
+
+
+def _key_position(key, alphabet, length):
+    # Characters outside the alphabet take the place of the nearest one
+    position = 0
+    for c in key[:length].ljust(length, alphabet[0]):
+        position = position * len(alphabet) + min(bisect.bisect_left(alphabet, c), len(alphabet) - 1)
+    return position
+
+
+def _quote_value(value):
+    return "'{}'".format(value.replace("'", "''"))
+
+
+def _quote_name(name):
+    return "`{}`".format(name.replace("`", "``"))
+
+
+def _segment_queries(domain_name, boundaries, attr_names=None):
+    """Builds one select per itemName() range between consecutive boundaries.
+
+    :param domain_name: (str) SimpleDB domain name
+    :param boundaries: (list) Sorted item names to split on
+    :param attr_names: (list) Attribute names to select. Default selects all attributes
+    :return: (list) Select expressions
+    """
+    output = ', '.join(_quote_name(a) for a in attr_names) if attr_names else '*'
+    base = 'select {} from {}'.format(output, _quote_name(domain_name))
+    if not boundaries:
+        return [base]
+
+    queries = ["{} where itemName() < {}".format(base, _quote_value(boundaries[0]))]
+    for low, high in zip(boundaries, boundaries[1:]):
+        queries.append("{} where itemName() >= {} and itemName() < {}".format(base, _quote_value(low),
+                                                                             _quote_value(high)))
+    queries.append("{} where itemName() >= {}".format(base, _quote_value(boundaries[-1])))
+    return queries
+
+
+def _validate_export(fmt, attr_names, method):
+    if fmt not in ["jsonl", "csv"]:
+        raise Exception("SimpleDB::{}Error: Unknown format {}. Must be jsonl or csv.".format(method, fmt))
+    if fmt == "csv" and not attr_names:
+        raise Exception("SimpleDB::{}Error: attr_names cannot be None for csv exports.".format(method))
+
+
+def _write_items(items, file_name, fmt, attr_names=None, path_to_file=None):
+    """Writes items to {path_to_file}/{file_name}.jsonl or .csv as they arrive.
+    JSON lines are written as { "Name": "string", "Attributes": { "name": "value" | ["value",] } }.
+
+    :return: (int) Number of items written
+    """
+    count = [0]
+
+    def rows():
+        for item in items:
+            count[0] += 1
+            yield _flatten_item(item)
+
+    if fmt == "csv":
+        csv_keys = ['itemName()'] + list(attr_names)
+        csv_helper.write_to_files(csv_keys, file_name, (_csv_row(row) for row in rows()), path_to_file)
+    else:
+        if path_to_file:
+            file_name = os.path.expanduser("{}/{}".format(path_to_file, file_name))
+        with open("{}.jsonl".format(file_name), 'w') as f:
+            for row in rows():
+                name = row.pop('itemName()')
+                f.write(json.dumps({'Name': name, 'Attributes': row}) + "\n")
+    return count[0]
+
+
+def _load_checkpoint(checkpoint_file, domain_name, attr_name):
+    """Loads a delta sync checkpoint, or an empty one if the file does not exist.
+
+    :return: (dict) { 'Domain': 'string', 'Attribute': 'string', 'Value': None|'string', 'ItemNames': ['string',] }
+    """
+    checkpoint = {'Domain': domain_name, 'Attribute': attr_name, 'Value': None, 'ItemNames': []}
+    if not os.path.exists(checkpoint_file):
+        return checkpoint
+    with open(checkpoint_file) as f:
+        saved = json.load(f)
+    if saved.get('Domain') != domain_name or saved.get('Attribute') != attr_name:
+        raise Exception("SimpleDB::IterChangesError: Checkpoint {} is for {}.{}, not {}.{}".format(
+            checkpoint_file, saved.get('Domain'), saved.get('Attribute'), domain_name, attr_name))
+    checkpoint.update(saved)
+    return checkpoint
+
+
+def _save_checkpoint(checkpoint_file, checkpoint, item_names):
+    """Atomically saves a delta sync checkpoint with the names of the items at the high-water mark."""
+    checkpoint = dict(checkpoint, ItemNames=sorted(item_names))
+    tmp_file = "{}.tmp".format(checkpoint_file)
+    with open(tmp_file, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_file, checkpoint_file)
+
+
+def _flatten_item(item):
+    """Flattens a SimpleDB item into { 'itemName()': name, attr: value }.
+    Attributes with multiple values become a list of values.
+    """
+    row = {'itemName()': item['Name']}
+    for attr in item.get('Attributes', []):
+        name = attr['Name']
+        if name not in row:
+            row[name] = attr['Value']
+        elif isinstance(row[name], list):
+            row[name].append(attr['Value'])
+        else:
+            row[name] = [row[name], attr['Value']]
+    return row
+
+
+def _csv_row(row):
+    """Encodes multi-valued attributes of a flattened item as a JSON list for a csv cell."""
+    return {k: json.dumps(v) if isinstance(v, list) else v for k, v in row.items()}
+
+
+def _item_size(item):
+    """Size in bytes of a batch item in the form encoded request, i.e.
+    Item.25.ItemName=a%20b&Item.25.Attribute.1.Name=n&Item.25.Attribute.1.Value=v&Item.25.Attribute.1.Replace=true&
+    Item numbers are counted at two digits, the most a batch of BATCH_MAX_ITEMS has.
+    """
+    size = len("Item.NN.ItemName=&") + _encoded_size(item['Name'])
+    for number, attr in enumerate(item.get('Attributes', []), 1):
+        prefix = len("Item.NN.Attribute.{}.".format(number))
+        size += prefix + len("Name=&") + _encoded_size(attr['Name'])
+        if 'Value' in attr:
+            size += prefix + len("Value=&") + _encoded_size(attr['Value'])
+        if attr.get('Replace'):
+            size += prefix + len("Replace=true&")
+    return size
+
+
+def _encoded_size(value):
+    # Requests are percent encoded except for unreserved characters, which is how AWS signs them
+    return len(quote(value.encode('utf-8'), safe='-_.~'))
+
+
+def _chunk_items(items, max_items=BATCH_MAX_ITEMS, max_bytes=BATCH_MAX_BYTES - BATCH_REQUEST_OVERHEAD):
+    """Lazily splits items into lists that fit within the SimpleDB batch operation limits.
+
+    :param items: (iterable) Batch items of format { 'Name': 'string', 'Attributes': [...] }
+    :param max_items: (int) Max number of items per chunk
+    :param max_bytes: (int) Max encoded size in bytes of the items of a chunk, see _item_size
+    :return: (generator) Lists of items
+    """
+    chunk = []
+    chunk_size = 0
+    for item in items:
+        size = _item_size(item)
+        if chunk and (len(chunk) >= max_items or chunk_size + size > max_bytes):
+            yield chunk
+            chunk = []
+            chunk_size = 0
+        chunk.append(item)
+        chunk_size += size
+    if chunk:
+        yield chunk
+
+
+def _domain_chunks(domain_name, items):
+    """Chunks of items for one domain, see SimpleDbHelper._run_batches.
+
+    :return: (generator) (domain_name, chunk) tuples
+    """
+    for chunk in _chunk_items(items):
+        yield domain_name, chunk
+
+
 def cleanup_simpledb_domains(sdb):
     """There is a limit on how many simpledb domains that each region has. Our controller
     does not clean up after itself and we have no way of cleaning up atm. Have this for the
@@ -253,18 +1889,13 @@ def cleanup_simpledb_domains(sdb):
     :return:
     """
     # Prefixes are from plt/controller/db.py
-    simpledb_domains_prefixes = ["subscriptions", "config", "sessions"]
-
-    domains = sdb.list_domains()
+    simpledb_domains_prefixes = ["subscriptionsX", "configX", "sessionsX"]
 
-    for domain in domains:
-        if domain.startswith("subscriptionsX") or domain.startswith("configX") or domain.startswith("sessionsX"):
-            print('\nDeleting domain "{}"...'.format(domain))
-            try:
-                sdb.delete_domain(domain)
-                print('\nSuccessfully deleted domain "{}"'.format(domain))
-            except Exception as e:
-                print("\nUnable to delete domain {}. Error: {}".format(domain, e))
+    result = sdb.cleanup_domains(simpledb_domains_prefixes)
+    for domain in result['Deleted']:
+        print('\nSuccessfully deleted domain "{}"'.format(domain))
+    for domain, error in result['Failed'].items():
+        print("\nUnable to delete domain {}. Error: {}".format(domain, error))
 
 
 ###############
@@ -276,11 +1907,11 @@ def interact():
     list_of_actions = ['create_domain', 'check_domain', 'list_domain', 'delete_domain', 'select', 'display_items',
                        'delete_attrs', 'delete_controller_domains']
 
-    action_index = raw_input("\nInput index of which action you would like to take\n"
-                             "(0) create domain | (1) domain exists | (2) list domains | "
-                             "(3) delete domain | (4) query domain | (5) display items | "
-                             "(6) delete attrs | (7) delete controller domains"
-                             "\nAction Index: ")
+    action_index = input("\nInput index of which action you would like to take\n"
+                         "(0) create domain | (1) domain exists | (2) list domains | "
+                         "(3) delete domain | (4) query domain | (5) display items | "
+                         "(6) delete attrs | (7) delete controller domains"
+                         "\nAction Index: ")
     action_index = int(action_index)
 
     actions_keymap = {}
@@ -292,28 +1923,28 @@ def interact():
 
     params = {}
     if action_index in [0, 1, 3, 5, 6]:
-        params['domain'] = raw_input("\nPlease input domain name: ")
+        params['domain'] = input("\nPlease input domain name: ")
     elif action_index in [4]:
-        params['query'] = raw_input("\nPlease input query: ")
+        params['query'] = input("\nPlease input query: ")
 
     if action_index in [6]:
-        params['item_name'] = raw_input("\nPlease input item name: ")
+        params['item_name'] = input("\nPlease input item name: ")
         try:
-            params['attrs'] = [json.loads(raw_input("\nPlease enter one attribute to delete. Please use double quotes. "
-                                                    "Must be of form {'Name' : 'string', 'Value': 'string'}: "))]
+            params['attrs'] = [json.loads(input("\nPlease enter one attribute to delete. Please use double quotes. "
+                                                "Must be of form {'Name' : 'string', 'Value': 'string'}: "))]
         except ValueError as e:
             print("Please use double quotes instead of single quotes.\n\tError: {}".format(e))
-            params['attrs'] = [json.loads(raw_input("\nPlease enter one attribute to delete. "
-                                                    "Must be of form {'Name' : 'string', 'Value': 'string'}: "))]
+            params['attrs'] = [json.loads(input("\nPlease enter one attribute to delete. "
+                                                "Must be of form {'Name' : 'string', 'Value': 'string'}: "))]
 
     return actions_keymap, params
 
 
 if __name__ == "__main__":
-    profile = raw_input("AWS Profile [Enter is 'default']: ")
+    profile = input("AWS Profile [Enter is 'default']: ")
     if not profile:
         profile = 'default'
-    region = raw_input("Region [Enter is 'us-west-2']: ")
+    region = input("Region [Enter is 'us-west-2']: ")
     sdb = SimpleDbHelper(profile)
     if region:
         sdb = SimpleDbHelper(profile, region)
@@ -405,6 +2036,6 @@ if __name__ == "__main__":
         if actions_keymap['delete_controller_domains']:
             cleanup_simpledb_domains(sdb)
 
-        answer = raw_input("\nWould you like to take another action? (y/N) ")
+        answer = input("\nWould you like to take another action? (y/N) ")
         if answer.lower() not in ['y', 'yes', 'ye']:
             break
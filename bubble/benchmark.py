@@ -0,0 +1,80 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bubble.users as users
+from bubble.mock_server import add_server_arguments, server_from_args
+from bubble.rate_control import RateController
+from tools.stopwatch import percentile
+
+
+def bench_concurrency(base_url, concurrency, args):
+    """Creates args.users fresh users at one concurrency setting.
+
+    :return: (tuple) (create_users results, seconds taken, request latencies)
+    """
+    latencies = []
+    controller = RateController(initial_rate=args.initial_rate, max_rate=args.max_rate,
+                                initial_concurrency=concurrency if args.fixed else min(8, concurrency),
+                                max_concurrency=concurrency)
+    start = time.time()
+    results = users.create_users(users.iter_dummy_users(args.users), concurrency=concurrency,
+                                 max_tries=args.max_tries, controller=controller, base_url=base_url,
+                                 latencies=latencies)
+    return results, time.time() - start, latencies
+
+
+def run(args):
+    users.VERBOSE = args.verbose
+    mock = None
+    base_url = args.base_url
+    if base_url is None:
+        mock = server_from_args(args).start()
+        base_url = mock.url
+
+    rows = []
+    try:
+        for concurrency in args.concurrency:
+            if mock is not None:
+                mock.reset()
+            results, elapsed, latencies = bench_concurrency(base_url, concurrency, args)
+            rows.append((concurrency, results, elapsed, latencies))
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    print("\n{:>12}{:>10}{:>8}{:>10}{:>12}{:>10}{:>10}{:>10}{:>8}{:>8}".format(
+        "concurrency", "created", "failed", "seconds", "users/sec", "p50 ms", "p90 ms", "p99 ms", "429s", "5xx"))
+    for concurrency, results, elapsed, latencies in rows:
+        status_counts = results["status_counts"]
+        print("{:>12}{:>10}{:>8}{:>10.2f}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>8}{:>8}".format(
+            concurrency, results["created"], len(results["failed"]), elapsed,
+            results["created"] / elapsed if elapsed else 0.0, percentile(latencies, 50) * 1000,
+            percentile(latencies, 90) * 1000, percentile(latencies, 99) * 1000, status_counts.get(429, 0),
+            sum(count for status, count in status_counts.items() if isinstance(status, int) and status >= 500)))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks create_users against the local mock Bubble server, "
+                                                 "or --base-url, and reports users/sec and latency percentiles "
+                                                 "per concurrency setting.")
+    parser.add_argument("--users", type=int, default=2000, help="Number of users created per concurrency setting")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="Concurrency settings to compare")
+    parser.add_argument("--fixed", action="store_true",
+                        help="Start at the full concurrency instead of ramping up from 8")
+    parser.add_argument("--initial-rate", dest="initial_rate", type=float, default=20.0,
+                        help="Users/sec the rate controller starts at")
+    parser.add_argument("--max-rate", dest="max_rate", type=float, default=2000.0,
+                        help="Highest users/sec the rate controller goes to")
+    parser.add_argument("--max-tries", dest="max_tries", type=int, default=8, help="Max attempts per user")
+    parser.add_argument("--base-url", dest="base_url", default=None,
+                        help="Benchmark this workflow API URL instead of starting a mock server")
+    parser.add_argument("--verbose", action="store_true", help="Print create_users progress")
+    add_server_arguments(parser)
+
+    run(parser.parse_args())
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import re
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import files.csv_helper as csv_helper
+
+# Loose check for one @ and a dot in the domain, Bubble does the real validation
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# Key iter_csv_dicts stores each row's line number under
+LINE_KEY = "_line"
+
+# User fields and the CSV column they are read from by default
+DEFAULT_COLUMNS = {"email": "email", "password": "password"}
+
+
+class CsvUserSource:
+    """
+    Streams users from a CSV export one row at a time, so rows are never held in memory.
+    Columns are mapped to user fields, and every row is validated and deduplicated by email as it is read.
+    Deduplication keeps a digest of every unique email, so memory still grows with the number of unique emails,
+    by about 80 bytes each (some 80 MB for a million users).
+    Rows that fail are written to a reject CSV with the reason as soon as they are seen.
+    Use it as a context manager so the files are closed.
+    """
+
+    def __init__(self, file_name, columns=None, reject_file=None, path_to_file=None, min_password=1,
+                 encoding=None, append_rejects=False):
+        """
+
+        :param file_name: (str) CSV file, its first line must be the headers
+        :param columns: (dict) User field to CSV column, i.e. {"email": "Email Address", "password": "Password"}
+        :param reject_file: (str) Reject CSV name without .csv, written through csv_helper. Default no rejects file
+        :param path_to_file: (str) Directory of the reject CSV
+        :param min_password: (int) Shortest password accepted
+        :param encoding: (str) Encoding of the CSV, detected by default
+        :param append_rejects: (bool) Add to an existing reject CSV instead of replacing it, i.e. when a journaled
+            load resumes and the rows rejected by the first run are only in the reject CSV
+        """
+        self.file_name = file_name
+        self.columns = dict(DEFAULT_COLUMNS, **(columns or {}))
+        self.reject_file = reject_file
+        self.path_to_file = path_to_file
+        self.min_password = min_password
+        self.encoding = encoding
+        self.append_rejects = append_rejects
+        self.rows = 0
+        self.accepted = 0
+        self.rejected = {}
+        self._seen = set()
+        self._rows = None
+        self._rejects_cm = None
+        self._rejects = None
+
+    def open(self):
+        encoding, dialect = csv_helper.csv_format(self.file_name, self.encoding)
+        headers = csv_helper.read_csv_headers(self.file_name, encoding, dialect)
+        missing = [column for column in self.columns.values() if column not in headers]
+        if missing:
+            self.close()
+            raise ValueError("CSV {} has no column {}. Headers are {}".format(self.file_name, missing, headers))
+        self._rows = csv_helper.iter_csv_dicts(self.file_name, encoding=encoding, dialect=dialect, fill_value=None,
+                                               line_key=LINE_KEY)
+        if self.reject_file:
+            self._rejects_cm = csv_helper.csv_writer(["line", "reason"] + headers, self.reject_file,
+                                                     self.path_to_file, append=self.append_rejects)
+            self._rejects = self._rejects_cm.__enter__()
+        return self
+
+    def close(self):
+        if self._rejects_cm is not None:
+            self._rejects_cm.__exit__(None, None, None)
+            self._rejects_cm = None
+            self._rejects = None
+        if self._rows is not None:
+            self._rows.close()
+            self._rows = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        """
+        Yields the valid, first seen users in file order.
+
+        :return: (generator) Users of format {"email": "string", "password": "string"}
+        """
+        if self._rows is None:
+            self.open()
+        email_column = self.columns["email"]
+        password_column = self.columns["password"]
+        for row in self._rows:
+            self.rows += 1
+            line = row.pop(LINE_KEY)
+            email = (row.get(email_column) or "").strip()
+            password = row.get(password_column) or ""
+            if None in row:
+                reason = "too many fields"
+            elif not EMAIL_RE.match(email):
+                reason = "invalid email"
+            elif len(password) < self.min_password:
+                reason = "invalid password"
+            elif not self._first_seen(email):
+                reason = "duplicate email"
+            else:
+                self.accepted += 1
+                yield {"email": email, "password": password}
+                continue
+            self._reject(row, reason, line)
+
+    def reject_user(self, user, reason):
+        """
+        Writes a user that was read from the CSV but could not be created to the reject CSV.
+
+        :param user: (dict) User of format {"email": "string", "password": "string"}
+        :param reason: (str) Why it was rejected
+        """
+        self._reject({column: user.get(field) for field, column in self.columns.items()}, reason, None)
+
+    def stats(self):
+        """
+
+        :return: (dict) {"rows": 0, "accepted": 0, "rejected": {"invalid email": 0, ...}}
+        """
+        return {"rows": self.rows, "accepted": self.accepted, "rejected": dict(self.rejected)}
+
+    def _first_seen(self, email):
+        # Keep an 8 byte digest of each email instead of the email itself. It still costs an int object and a set
+        # slot per unique email
+        key = int.from_bytes(hashlib.blake2b(email.lower().encode("utf-8"), digest_size=8).digest(), "little")
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+    def _reject(self, row, reason, line):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        if self._rejects is not None:
+            entry = {key: value for key, value in row.items() if key is not None}
+            entry["line"] = line
+            entry["reason"] = reason
+            self._rejects.writerow(entry)
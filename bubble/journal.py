@@ -0,0 +1,131 @@
+import json
+import sqlite3
+
+
+class UserJournal:
+    """
+    Durable SQLite journal of a bulk user load. It stores the generated input set once, so a restarted run
+    loads the same users and credentials, and records every user as soon as it is created so a restarted
+    run only sends the users that are still pending. The input set is stored with a fingerprint of where it came
+    from, so a run with other inputs is refused instead of resuming the old ones, see check_inputs.
+    """
+
+    def __init__(self, path):
+        """
+
+        :param path: (str) Journal file, created if it does not exist
+        """
+        self.path = path
+        # Autocommit, so every mark_created is durable on its own
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS users ("
+                          "seq INTEGER PRIMARY KEY, email TEXT NOT NULL UNIQUE, password TEXT NOT NULL, "
+                          "created INTEGER NOT NULL DEFAULT 0)")
+        # Only pending users are indexed, so skipping created users on resume costs nothing
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pending_users ON users(seq) WHERE created = 0")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    def has_inputs(self):
+        """
+
+        :return: (bool) True once record_inputs has stored the whole input set
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'inputs_complete'").fetchone()
+        return row is not None
+
+    def inputs(self):
+        """
+
+        :return: (dict) Fingerprint the input set was recorded with, None if there is none
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'inputs'").fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def check_inputs(self, fingerprint):
+        """
+        Raises ValueError if the journal holds an input set recorded for other inputs.
+
+        :param fingerprint: (dict) Fingerprint of this run's inputs, see record_inputs
+        """
+        if not self.has_inputs():
+            return
+        recorded = self.inputs()
+        if recorded != json.loads(json.dumps(fingerprint)):
+            raise ValueError("Journal {} holds users of {}, not of {}. Use another journal or delete it to start "
+                             "over".format(self.path, recorded or "an unknown input", fingerprint))
+
+    def summary(self):
+        """
+
+        :return: (dict) What record_inputs' summary returned, None if it was not given
+        """
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'summary'").fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def record_inputs(self, users, fingerprint=None, batch_size=10000, summary=None):
+        """
+        Stores the input set in one transaction and marks it complete. Users already in the journal are kept.
+
+        :param users: (iterable) Users of format {"email": "string", "password": "string"}
+        :param fingerprint: (dict) JSON-able description of the inputs, i.e. {"mode": "dummy", "size": 10,
+            "seed": 1}, checked by check_inputs on later runs
+        :param batch_size: (int) Users inserted per statement
+        :param summary: (function) Called once all users are read, its JSON-able result is stored with them for
+            later runs, see summary. I.e. CsvUserSource.stats, as a resumed run does not read the CSV again
+        """
+        self.conn.execute("BEGIN")
+        try:
+            batch = []
+            for user in users:
+                batch.append((user['email'], user['password']))
+                if len(batch) >= batch_size:
+                    self._insert(batch)
+                    batch = []
+            self._insert(batch)
+            if summary is not None:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('summary', ?)",
+                                  (json.dumps(summary(), sort_keys=True),))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('inputs', ?)",
+                              (json.dumps(fingerprint, sort_keys=True),))
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('inputs_complete', '1')")
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+
+    def iter_pending(self, batch_size=1000):
+        """
+        Yields the users that have not been created yet in input order, reading them in batches.
+
+        :param batch_size: (int) Users read per query
+        :return: (generator) Users of format {"email": "string", "password": "string"}
+        """
+        last_seq = -1
+        while True:
+            rows = self.conn.execute("SELECT seq, email, password FROM users WHERE created = 0 AND seq > ? "
+                                     "ORDER BY seq LIMIT ?", (last_seq, batch_size)).fetchall()
+            if not rows:
+                return
+            for seq, email, password in rows:
+                yield {"email": email, "password": password}
+            last_seq = rows[-1][0]
+
+    def mark_created(self, email):
+        self.conn.execute("UPDATE users SET created = 1 WHERE email = ?", (email,))
+
+    def counts(self):
+        """
+
+        :return: (tuple) (number of users in the journal, number created)
+        """
+        total, created = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(created), 0) FROM users").fetchone()
+        return total, created
+
+    def close(self):
+        self.conn.close()
+
+    def _insert(self, batch):
+        if batch:
+            self.conn.executemany("INSERT OR IGNORE INTO users (email, password) VALUES (?, ?)", batch)
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Paths the workflow API is served on, i.e. /version-test/api/1.1/wf/create_user
+WORKFLOW_PREFIXES = ("/api/1.1/wf/", "/version-test/api/1.1/wf/")
+
+
+class MockBubbleServer:
+    """
+    Local stand-in for the Bubble workflow API, so create_users can be measured and tuned offline. Every workflow
+    creates a user from the posted "email" and "password" like create_user does. Latency, random 500s, random 429s
+    and a hard requests/sec limit answered with 429 and Retry-After can be injected.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0,
+                 rate_limit=None, retry_after=1.0, seed=None):
+        """
+
+        :param host: (str) Interface to listen on
+        :param port: (int) Port to listen on, 0 picks a free one
+        :param latency: (float) Seconds every request takes
+        :param jitter: (float) Up to this many seconds are added to the latency at random
+        :param error_rate: (float) Probability of a request failing with 500
+        :param throttle_rate: (float) Probability of a request being throttled with 429
+        :param rate_limit: (float) Requests per second accepted, requests beyond it get 429. Default no limit
+        :param retry_after: (float) Seconds sent in the Retry-After header of a 429, 0 sends no header
+        :param seed: (int) Seed for the injected errors
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.users = {}
+        self.status_counts = {}
+        self._random = random.Random(seed)
+        self._tokens = float(rate_limit) if rate_limit else 0.0
+        self._last_refill = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self):
+        """Base URL create_users posts to, i.e. http://127.0.0.1:8000/version-test/api/1.1/wf"""
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/version-test/api/1.1/wf".format(host, port)
+
+    def start(self):
+        """Serves in a background thread."""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-bubble", daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.users = {}
+            self.status_counts = {}
+
+    def stats(self):
+        """
+
+        :return: (dict) {"users": 0, "status_counts": {200: 0, 429: 0, ...}}
+        """
+        with self._lock:
+            return {"users": len(self.users), "status_counts": dict(self.status_counts)}
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def handle_workflow(self, workflow, body):
+        """
+        Answers one workflow call.
+
+        :param workflow: (str) Workflow name from the path
+        :param body: (bytes) Request body
+        :return: (tuple) (status code, response dict, headers dict)
+        """
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+        with self._lock:
+            if not self._take_token() or self._random.random() < self.throttle_rate:
+                headers = {"Retry-After": "{:g}".format(self.retry_after)} if self.retry_after else {}
+                return self._count(429, {"status": "error", "message": "Too many requests"}, headers)
+            if self._random.random() < self.error_rate:
+                return self._count(500, {"status": "error", "message": "Internal server error"})
+
+            try:
+                params = json.loads(body.decode("utf-8")) if body else {}
+            except ValueError:
+                return self._count(400, {"status": "error", "message": "Body is not valid JSON"})
+            email = params.get("email")
+            if not email or not params.get("password"):
+                return self._count(400, {"status": "error", "message": "Missing parameter email or password"})
+            if email in self.users:
+                return self._count(400, {"status": "error", "message": "The email {} is already in use".format(
+                    email)})
+            user_id = "{}x{}".format(int(time.time() * 1000), len(self.users) + 1)
+            self.users[email] = user_id
+            return self._count(200, {"status": "success", "response": {"workflow": workflow, "user_id": user_id}})
+
+    def _take_token(self):
+        if not self.rate_limit:
+            return True
+        now = time.time()
+        self._tokens = min(float(self.rate_limit), self._tokens + (now - self._last_refill) * self.rate_limit)
+        self._last_refill = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+    def _count(self, status, response, headers=None):
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        return status, response, headers or {}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # Without this small keep-alive responses wait on the client's delayed ACK
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                path = self.path.split("?", 1)[0]
+                prefix = next((p for p in WORKFLOW_PREFIXES if path.startswith(p)), None)
+                if prefix is None or not path[len(prefix):]:
+                    self._respond(404, {"status": "error", "message": "Not found"}, {})
+                    return
+                self._respond(*server.handle_workflow(path[len(prefix):], body))
+
+            def _respond(self, status, response, headers):
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every request takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds added to the latency")
+    parser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0,
+                        help="Probability of a request failing with 500")
+    parser.add_argument("--throttle-rate", dest="throttle_rate", type=float, default=0.0,
+                        help="Probability of a request being throttled with 429")
+    parser.add_argument("--rate-limit", dest="rate_limit", type=float, default=None,
+                        help="Requests/sec accepted before answering 429")
+    parser.add_argument("--retry-after", dest="retry_after", type=float, default=1.0,
+                        help="Seconds sent in Retry-After with a 429, 0 for no header")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the injected errors")
+
+
+def server_from_args(args, host="127.0.0.1", port=0):
+    return MockBubbleServer(host=host, port=port, latency=args.latency, jitter=args.jitter,
+                            error_rate=args.error_rate, throttle_rate=args.throttle_rate, rate_limit=args.rate_limit,
+                            retry_after=args.retry_after, seed=args.seed)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serves a local stand-in for the Bubble workflow API.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="Port to listen on")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    mock = server_from_args(args, host=args.host, port=args.port)
+    print("Serving the Bubble workflow API on {}".format(mock.url))
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.httpd.server_close()
@@ -0,0 +1,135 @@
+import email.utils
+import threading
+import time
+
+# Status codes that mean the endpoint wants us to slow down
+THROTTLE_STATUS_CODES = {429, 503}
+
+
+class RateController:
+    """
+    Paces requests to a rate and caps how many are in flight, adjusting both with AIMD: every 429/503 halves
+    them (at most once per cooldown) and every success adds a little. Like TCP slow start, both double every
+    round of successes until the first throttle so the controller finds the endpoint's limit quickly.
+    A Retry-After header pauses all requests until it has passed. Counts every response by status code.
+    """
+
+    def __init__(self, initial_rate=20.0, min_rate=0.5, max_rate=2000.0, initial_concurrency=8,
+                 max_concurrency=64, increase=5.0, decrease=0.5, cooldown=1.0):
+        """
+
+        :param initial_rate: (float) Requests per second to start at
+        :param min_rate: (float) Lowest requests per second
+        :param max_rate: (float) Highest requests per second
+        :param initial_concurrency: (int) Requests in flight to start at
+        :param max_concurrency: (int) Highest number of requests in flight
+        :param increase: (float) Requests per second the rate grows by per second of successes
+        :param decrease: (float) Factor the rate and concurrency are multiplied by on throttling
+        :param cooldown: (float) Min seconds between decreases so one burst of throttles only backs off once
+        """
+        self.rate = float(initial_rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = float(initial_concurrency)
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.status_counts = {}
+        self.paused_seconds = 0.0
+        self.slow_start = True
+        self._paused_until = 0.0
+        self._next_send = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        Blocks until a request may be sent: no Retry-After pause is active, a concurrency slot is free and the
+        rate allows another request.
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self.in_flight >= int(self.concurrency):
+                    self._cond.wait()
+                elif now < self._next_send:
+                    self._cond.wait(self._next_send - now)
+                else:
+                    self._next_send = max(now, self._next_send) + 1.0 / self.rate
+                    self.in_flight += 1
+                    return
+
+    def release(self, status, retry_after=None):
+        """
+        Records the outcome of a request sent after acquire.
+
+        :param status: (int) Response status code, or None if the request raised
+        :param retry_after: (float) Seconds from the Retry-After header, if any
+        """
+        with self._cond:
+            now = time.time()
+            self.in_flight -= 1
+            key = status if status is not None else "error"
+            self.status_counts[key] = self.status_counts.get(key, 0) + 1
+
+            if retry_after:
+                until = now + retry_after
+                if until > self._paused_until:
+                    self.paused_seconds += until - max(now, self._paused_until)
+                    self._paused_until = until
+
+            if status in THROTTLE_STATUS_CODES or retry_after:
+                if now - self._last_decrease >= self.cooldown:
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self.concurrency = max(1.0, self.concurrency * self.decrease)
+                    self._last_decrease = now
+                self.slow_start = False
+            elif status is not None and status < 400:
+                if self.slow_start:
+                    self.rate = min(self.max_rate, self.rate + 1.0)
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1.0)
+                else:
+                    self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+
+        :return: (dict) {"rate": 0.0, "concurrency": 0, "in_flight": 0, "paused_seconds": 0.0, "slow_start": True,
+                         "status_counts": {200: 0, 429: 0, "error": 0}}
+        """
+        with self._cond:
+            return {"rate": self.rate,
+                    "slow_start": self.slow_start,
+                    "concurrency": int(self.concurrency),
+                    "in_flight": self.in_flight,
+                    "paused_seconds": self.paused_seconds,
+                    "status_counts": dict(self.status_counts)}
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header given either as seconds or as an HTTP date.
+
+    :param value: (str) Header value
+    :return: (float) Seconds to wait, or None if missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
@@ -1,13 +1,23 @@
+import argparse
 import os
 import sys
 import time
 import requests
 import string
 import random
+import heapq
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import tools.stopwatch as stopwatch
+from tools.metrics import MetricsReporter, JsonLinesSink, PrometheusSink, StatsdSink
+from tools.profiling import SlowLapProfiler
+from bubble.rate_control import RateController, parse_retry_after
+from bubble.journal import UserJournal
+from bubble.csv_source import CsvUserSource
 
 # Overall Users API Endpoint
 USERS_VERSION_TEST_URL = "https://{name}/version-test/api/1.1/wf/"
@@ -16,83 +26,382 @@ USERS_LIVE_URL = "https://{name}/api/1.1/wf/"
 HEADER = {"Authorization": "Bearer {token}"}
 PARAMS = {}
 
+# Responses worth retrying a user for
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
 CLOCK = stopwatch.Clock()
 
+ID_ALPHABET = string.ascii_letters + string.digits
+# Maps every random byte to an id character. Bytes from 248 (62 * 4) up are deleted so each character is
+# equally likely.
+_ID_TABLE = bytes.maketrans(bytes(range(256)), bytes(ord(ID_ALPHABET[b % len(ID_ALPHABET)]) for b in range(256)))
+_ID_DELETE = bytes(range(len(ID_ALPHABET) * (256 // len(ID_ALPHABET)), 256))
+
+# Set to False to only print errors
+VERBOSE = True
+
+# Per worker thread state, i.e. each worker's requests.Session
+_local = threading.local()
+
+
+def create_users(users, live=False, endpoint="create_user", concurrency=16, max_tries=8, controller=None,
+                 journal=None, base_url=None, latencies=None):
+    """Creates the users through the Bubble workflow endpoint at the highest rate the endpoint accepts.
+    A RateController paces the requests and adjusts the rate and number in flight (up to `concurrency`) from the
+    responses. Every worker thread keeps its own keep-alive connection. Users that get a 408/429/5xx or a
+    connection error go into a delayed retry queue, honouring Retry-After, instead of holding up the load.
+
+    :param users: (iterable) Users of format {"email": "string", "password": "string"}
+    :param live: (bool) Use the live app instead of version-test
+    :param endpoint: (str) Workflow name
+    :param concurrency: (int) Max number of requests in flight
+    :param max_tries: (int) Max attempts per user before giving up on it
+    :param controller: (RateController) Default starts at 20 users/sec and 8 in flight
+    :param journal: (UserJournal) Journal every created user is recorded in as soon as it is created
+    :param base_url: (str) Workflow API URL to use instead of the app's, i.e. a MockBubbleServer's url
+    :param latencies: (list) Seconds every request took are appended to it
+    :return: (dict) {"created": 0, "failed": [user, ...], "status_counts": {200: 0, ...}}
+    """
+    _out("Starting to populate bubble database with {} users".format(
+        len(users) if hasattr(users, "__len__") else "streamed"))
+    if base_url is None:
+        base_url = USERS_VERSION_TEST_URL if not live else USERS_LIVE_URL
+    url = "{}/{}".format(base_url.rstrip("/"), endpoint)
+    concurrency = max(1, concurrency)
+    if controller is None:
+        controller = RateController(initial_concurrency=min(8, concurrency), max_concurrency=concurrency)
+    results = {"created": 0, "failed": []}
+    retries = []
+    retry_seq = itertools.count()
+    start = time.time()
+
+    def handle(future):
+        user, attempt, status, retry_after, elapsed = future.result()
+        if latencies is not None:
+            latencies.append(elapsed)
+        if status != 200:
+            if (status is None or status in RETRY_STATUS_CODES) and attempt + 1 < max_tries:
+                delay = retry_after if retry_after else min(60, 2**attempt) * random.uniform(0.5, 1.0)
+                heapq.heappush(retries, (time.time() + delay, next(retry_seq), user, attempt + 1))
+            else:
+                _out("Giving up on {} after {} tries. Last status {}".format(user['email'], attempt + 1, status),
+                     "STATUS CODE")
+                results["failed"].append(user)
+            return
+
+        if journal is not None:
+            journal.mark_created(user['email'])
+        results["created"] += 1
+        CLOCK.mark("users")
+
+        if results["created"] % 2000 == 0:
+            _report(len(retries), controller)
+
+    pending = iter(users)
+    submitted = 0
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = set()
+        while True:
+            done = [f for f in in_flight if f.done()]
+            for future in done:
+                in_flight.discard(future)
+                handle(future)
+
+            # Users due for a retry go before new users
+            if retries and retries[0][0] <= time.time():
+                _, _, user, attempt = heapq.heappop(retries)
+            else:
+                user = next(pending, None)
+                attempt = 0
+                if user is not None:
+                    if submitted % 5000 == 0:
+                        _out("curl -X POST {} -H 'application/json' -d {}".format(url, _user_params(user)),
+                             title="CURL")
+                        _out("Created {} users".format(results["created"]))
+                    submitted += 1
 
-def create_users(users, live=False, endpoint="create_user"):
-    _out("Starting to populate bubble database with {} users".format(len(users)))
-    i = 0
-    session = requests.Session()
-    base_url = USERS_VERSION_TEST_URL if not live else USERS_LIVE_URL
-    url = "{}/{}".format(base_url, endpoint)
-    for user in users:
-        params = {"password": user['password'],
-                  "email": user['email'],
-                  "DisplayEmail": user['email']}
-
-        if i % 5000 == 0:
-            _out("curl -X POST {} -H 'application/json' -d {}".format(url, params), title="CURL")
-            _out("Created {} users".format(i))
-
-        if i == 0:
-            CLOCK.start_stopwatch("1")
-            CLOCK.start_stopwatch("10")
-            CLOCK.start_stopwatch("100")
-            CLOCK.start_stopwatch("1000")
-
-        r = session.post(url, json=params, headers=HEADER)
-        exp = 0
-        while r.status_code != 200:
-            _out("Code is {}. Will wait for a bit and then try again. Try {}".format(r.status_code, exp), "STATUS CODE")
-            print(r.json())
-            time.sleep(2**exp)
-            exp += 1
-            r = session.post(url, json=params, headers=HEADER)
-            if exp == 5:
-                _out("Failure to exponentially back off. Please try again")
-                return
-        i += 1
-        if i % 1 == 0:
-            CLOCK.stop_stopwatch("1")
-            CLOCK.start_stopwatch("1")
-        if i % 10 == 0:
-            CLOCK.stop_stopwatch("10")
-            CLOCK.start_stopwatch("10")
-        if i % 100 == 0:
-            CLOCK.stop_stopwatch("100")
-            CLOCK.start_stopwatch("100")
-        if i % 1000 == 0:
-            CLOCK.stop_stopwatch("1000")
-            CLOCK.start_stopwatch("1000")
-
-        if i % 2000 == 0:
-            for sw in CLOCK.get_stopwatch_keys():
-                _out(CLOCK.get_average_time_elapsed(sw), "STATS {}".format(sw))
-
-    for sw in CLOCK.get_stopwatch_keys():
-        _out(CLOCK.get_average_time_elapsed(sw), "STATS {}".format(sw))
+            if user is None:
+                if not in_flight and not retries:
+                    break
+                timeout = max(0, retries[0][0] - time.time()) if retries else None
+                if in_flight:
+                    wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(timeout)
+                continue
 
+            controller.acquire()
+            in_flight.add(executor.submit(_post_user, url, user, attempt, controller))
+
+    _report(len(retries), controller)
+    results["status_counts"] = controller.stats()["status_counts"]
+    elapsed = time.time() - start
+    _out("Created {} users in {:.1f} seconds ({:.1f} users/sec). {} users failed. Responses by status: {}".format(
+        results["created"], elapsed, results["created"] / elapsed if elapsed else 0, len(results["failed"]),
+        results["status_counts"]))
     _out("Finished creating users!")
+    return results
+
+
+def _report(waiting, controller):
+    if "users" in CLOCK.meters:
+        rates = CLOCK.get_rates("users")
+        _out("{count} users created. Users/sec: {1s:.1f} over 1s, {10s:.1f} over 10s, {60s:.1f} over 60s, "
+             "{mean:.1f} overall".format(**rates), "THROUGHPUT")
+    if "request" in CLOCK.stopwatches:
+        _out("Request seconds: mean {mean:.3f}, p50 {p50:.3f}, p90 {p90:.3f}, p99 {p99:.3f}, max {max:.3f}".format(
+            **CLOCK.get_stats("request")), "LATENCY")
+    _out("{} users waiting to retry. Controller: {}".format(waiting, controller.stats()), "CONTROLLER")
+
+
+def load_users(size, journal_path=None, seed=None, **kwargs):
+    """Creates `size` dummy users. With a journal the load is resumable: the first run stores the generated users
+    in the journal and later runs with the same journal only send the users that were not created yet.
+
+    :param size: (int) Number of users
+    :param journal_path: (str) UserJournal file
+    :param seed: (int) Seed for the dummy users, the same seed gives the same users
+    :param kwargs: Passed on to create_users
+    :return: (dict) See create_users
+    """
+    fingerprint = {"mode": "dummy", "size": size, "seed": seed}
+    return _journaled_load(iter_dummy_users(size, seed=seed), journal_path, fingerprint, **kwargs)
+
+
+def load_csv_users(file_name, columns=None, reject_file=None, journal_path=None, **kwargs):
+    """Creates the users of a CSV export while streaming it. Rows are mapped, validated and deduplicated as they
+    are read. Rows that fail, and users that could not be created, go to the reject CSV.
+
+    :param file_name: (str) CSV file, its first line must be the headers
+    :param columns: (dict) User field to CSV column, i.e. {"email": "Email Address", "password": "Password"}
+    :param reject_file: (str) Reject CSV name without .csv. A resumed load appends to it
+    :param journal_path: (str) UserJournal file, see load_users. A changed CSV file or column mapping needs
+        another journal
+    :param kwargs: Passed on to create_users
+    :return: (dict) See create_users, plus "csv": CsvUserSource.stats(). A resumed load reports the stats of
+        the run that read the CSV, with the users that failed to be created in this run
+    """
+    stat = os.stat(file_name)
+    fingerprint = {"mode": "csv", "file": os.path.abspath(file_name), "bytes": stat.st_size,
+                   "mtime_ns": stat.st_mtime_ns, "columns": columns}
+    resumed, recorded = _recorded_inputs(journal_path, fingerprint)
+    with CsvUserSource(file_name, columns=columns, reject_file=reject_file, append_rejects=resumed) as source:
+        results = _journaled_load(source, journal_path, fingerprint, summary=source.stats, **kwargs)
+        for user in results["failed"]:
+            source.reject_user(user, "create failed")
+        results["csv"] = source.stats()
+    if recorded is not None:
+        # The CSV was only read by the run that recorded the journal
+        rejected = dict(recorded["rejected"])
+        for reason, count in results["csv"]["rejected"].items():
+            rejected[reason] = rejected.get(reason, 0) + count
+        results["csv"] = dict(recorded, rejected=rejected)
+    _out("Read {rows} rows from {file}, {accepted} users accepted. Rejected: {rejected}".format(
+        file=file_name, **results["csv"]))
+    return results
+
+
+def _recorded_inputs(journal_path, fingerprint):
+    """Whether a journaled load resumes, and the summary its inputs were recorded with.
 
+    :return: (tuple) (bool, dict or None)
+    """
+    if journal_path is None or not os.path.exists(journal_path):
+        return False, None
+    journal = UserJournal(journal_path)
+    try:
+        journal.check_inputs(fingerprint)
+        return journal.has_inputs(), journal.summary()
+    finally:
+        journal.close()
 
-def create_dummy_users(size):
+
+def _journaled_load(users, journal_path, fingerprint, summary=None, **kwargs):
+    if journal_path is None:
+        return create_users(users, **kwargs)
+
+    journal = UserJournal(journal_path)
+    try:
+        # A journal of other inputs would silently resume its own users
+        journal.check_inputs(fingerprint)
+        if not journal.has_inputs():
+            journal.record_inputs(users, fingerprint, summary=summary)
+        total, created = journal.counts()
+        _out("Journal {} has {} users, {} already created".format(journal_path, total, created))
+        return create_users(journal.iter_pending(), journal=journal, **kwargs)
+    finally:
+        journal.close()
+
+
+def create_dummy_users(size, seed=None):
     _out("Creating dummy users of size {}".format(size))
-    users = []
-    for i in range(size):
-        users.append({"email": "{}@gmail.com".format(id_generator()), "password": id_generator(5)})
+    users = list(iter_dummy_users(size, seed=seed))
     _out("Finished creating dummy users of size {}".format(size))
     return users
 
 
-def id_generator(size=9, chars=string.ascii_letters + string.digits):
+def iter_dummy_users(size, seed=None, batch_size=10000):
+    """Yields `size` dummy users lazily, so a load can start sending at once and memory stays flat.
+
+    :param size: (int) Number of users
+    :param seed: (int) Seed, the same seed gives the same users
+    :param batch_size: (int) Users generated per block of random bytes
+    :return: (generator) Users of format {"email": "string", "password": "string"}
+    """
+    for batch in iter_dummy_user_batches(size, seed=seed, batch_size=batch_size):
+        for user in batch:
+            yield user
+
+
+def iter_dummy_user_batches(size, seed=None, batch_size=10000, email_size=9, password_size=5):
+    """Yields `size` dummy users in lists of up to `batch_size`. The ids of a whole batch are cut from one block of
+    random bytes.
+
+    :param size: (int) Number of users
+    :param seed: (int) Seed, the same seed gives the same users
+    :param batch_size: (int) Users per list
+    :param email_size: (int) Characters in the email's local part
+    :param password_size: (int) Characters in the password
+    :return: (generator) Lists of users of format {"email": "string", "password": "string"}
+    """
+    rng = random.Random(seed)
+    user_size = email_size + password_size
+    remaining = size
+    while remaining > 0:
+        count = min(batch_size, remaining)
+        chars = _random_ids(rng, count * user_size)
+        batch = []
+        for i in range(0, count * user_size, user_size):
+            batch.append({"email": "{}@gmail.com".format(chars[i:i + email_size]),
+                          "password": chars[i + email_size:i + user_size]})
+        remaining -= count
+        yield batch
+
+
+def id_generator(size=9, chars=ID_ALPHABET):
     return ''.join(random.choice(chars) for _ in range(size))
 
 
+def _random_ids(rng, size):
+    """Returns `size` random ID_ALPHABET characters made from blocks of random bytes."""
+    chunks = []
+    missing = size
+    while missing > 0:
+        # About 3% of bytes are deleted, so ask for a little more than is missing
+        chunk = rng.randbytes(missing + missing // 16 + 16).translate(_ID_TABLE, _ID_DELETE)
+        chunks.append(chunk[:missing])
+        missing -= len(chunks[-1])
+    return b"".join(chunks).decode("ascii")
+
+
+def _session():
+    """Returns the calling worker thread's requests.Session, which keeps one connection alive to the endpoint."""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _local.session = session
+    return session
+
+
+def _user_params(user):
+    return {"password": user['password'],
+            "email": user['email'],
+            "DisplayEmail": user['email']}
+
+
+def _post_user(url, user, attempt, controller):
+    """Posts one user once. The request must already be acquired from the controller and is released here.
+
+    :return: (tuple) (user, attempt, status code or None on a connection error, Retry-After seconds or None,
+                      seconds the request took)
+    """
+    status = None
+    retry_after = None
+    start = time.time()
+    try:
+        with CLOCK.time("request"):
+            r = _session().post(url, json=_user_params(user), headers=HEADER)
+        status = r.status_code
+        retry_after = parse_retry_after(r.headers.get("Retry-After"))
+    except requests.RequestException as e:
+        _out("Request for {} failed: {}. Try {}".format(user['email'], e, attempt), "STATUS CODE")
+    finally:
+        controller.release(status, retry_after)
+    return user, attempt, status, retry_after, time.time() - start
+
+
 def _out(msg, title=None):
+    if not VERBOSE and title != "STATUS CODE":
+        return
     title = title if title else "MESSAGE"
     print("\n[{}] {}".format(title, msg))
 
 
-create_users(create_dummy_users(200000))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Creates dummy users through the Bubble create_user workflow. "
+                                                 "Loads with a journal resume where the last run stopped.")
+    parser.add_argument("--size", type=int, default=200000, help="Number of users")
+    parser.add_argument("--csv", default=None, help="Create the users of this CSV export instead of dummy users")
+    parser.add_argument("--email-column", dest="email_column", default="email", help="CSV column of the email")
+    parser.add_argument("--password-column", dest="password_column", default="password",
+                        help="CSV column of the password")
+    parser.add_argument("--rejects", default=None, help="Reject CSV for --csv, without .csv")
+    parser.add_argument("--journal", default="create_users.journal",
+                        help="UserJournal file. A run with other inputs than the journal's is refused")
+    parser.add_argument("--no-journal", dest="journal", action="store_const", const=None,
+                        help="Do not journal the load, it starts over when restarted")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the dummy users")
+    parser.add_argument("--live", action="store_true", help="Use the live app instead of version-test")
+    parser.add_argument("--base-url", dest="base_url", default=None,
+                        help="Workflow API URL to use instead of the app's, i.e. a mock_server.py URL")
+    parser.add_argument("--endpoint", default="create_user", help="Workflow name")
+    parser.add_argument("--concurrency", type=int, default=16, help="Max number of requests in flight")
+    parser.add_argument("--max-tries", dest="max_tries", type=int, default=8, help="Max attempts per user")
+    parser.add_argument("--quiet", action="store_true", help="Only print errors")
+    parser.add_argument("--metrics-file", dest="metrics_file", default=None,
+                        help="Append request and throughput metrics to this JSON lines file")
+    parser.add_argument("--metrics-port", dest="metrics_port", type=int, default=None,
+                        help="Serve the metrics for Prometheus on this port")
+    parser.add_argument("--statsd", default=None, help="Send the metrics to statsd at host:port")
+    parser.add_argument("--metrics-interval", dest="metrics_interval", type=float, default=10.0,
+                        help="Seconds between metrics reports")
+    parser.add_argument("--profile-slow", dest="profile_slow", type=float, default=None,
+                        help="Capture a profile when a request takes longer than this many seconds")
+    parser.add_argument("--profile-factor", dest="profile_factor", type=float, default=None,
+                        help="Capture a profile when a request takes this many times the median request")
+    parser.add_argument("--profile-mode", dest="profile_mode", default="stack", choices=SlowLapProfiler.MODES,
+                        help="What a capture records")
+    parser.add_argument("--profile-dir", dest="profile_dir", default="profiles", help="Directory of the captures")
+    args = parser.parse_args()
+
+    VERBOSE = not args.quiet
+    if args.profile_slow is not None or args.profile_factor is not None:
+        CLOCK.arm("request", SlowLapProfiler(args.profile_dir, mode=args.profile_mode),
+                  threshold=args.profile_slow, factor=args.profile_factor)
+    sinks = []
+    if args.metrics_file:
+        sinks.append(JsonLinesSink(args.metrics_file))
+    if args.metrics_port is not None:
+        sinks.append(PrometheusSink(host="0.0.0.0", port=args.metrics_port, prefix="bubble"))
+    if args.statsd:
+        statsd_host, _, statsd_port = args.statsd.partition(":")
+        sinks.append(StatsdSink(statsd_host, int(statsd_port or 8125), prefix="bubble"))
+    reporter = MetricsReporter(CLOCK, sinks, interval=args.metrics_interval).start() if sinks else None
+
+    options = dict(journal_path=args.journal, live=args.live, base_url=args.base_url, endpoint=args.endpoint,
+                   concurrency=args.concurrency, max_tries=args.max_tries)
+    try:
+        if args.csv:
+            load_csv_users(args.csv, columns={"email": args.email_column, "password": args.password_column},
+                           reject_file=args.rejects, **options)
+        else:
+            load_users(args.size, seed=args.seed, **options)
+    finally:
+        CLOCK.disarm("request")
+        if reporter is not None:
+            reporter.stop()
 
 
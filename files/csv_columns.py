@@ -0,0 +1,725 @@
+import codecs
+import csv
+import io
+import itertools
+import math
+import operator
+import os
+import re
+import sys
+import warnings
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import files.csv_helper as csv_helper
+
+# Column types, from the narrowest. Values that do not fit a column's type widen it, see _common_kind
+KINDS = ("int", "float", "bool", "datetime", "category", "str")
+
+# Comparison operators of ColumnTable.mask
+OPERATORS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le, ">": operator.gt,
+             ">=": operator.ge}
+
+BOOLS = {"true": 1, "false": 0}
+
+# Range of an int column, array('q') / int64
+INT_MIN = -(1 << 63)
+INT_MAX = (1 << 63) - 1
+
+# Inferred columns take numbers written with a leading zero, i.e. zip codes or ids like 007, as text, while a lone 0
+# and 0.5 are numbers. Searched for in the values joined by newlines, which is faster than a match per value
+LEADING_ZERO_RE = re.compile(r"\n[ \t]*[+-]?0\d")
+
+# Naive datetimes are taken as UTC
+EPOCH = datetime(1970, 1, 1)
+
+# A category column with more distinct values than this, and more than half its rows, is stored as str
+MAX_CATEGORIES = 1 << 16
+
+# Rows read per block. Values are converted one column of a block at a time
+BLOCK_ROWS = 10000
+
+
+def load_csv_columns(file_name, types=None, usecols=None, use_numpy=None, workers=1,
+                     chunk_bytes=64 * 1024 * 1024, encoding=None, dialect=None, sample_rows=1000):
+    """
+    Loads a CSV into a ColumnTable, one typed array per column instead of a dict of strs per row.
+    Short rows are padded with empty cells and long rows are cut to the Headers.
+    Column types are inferred from the first sample_rows rows unless given, and widen if later values do not fit:
+        int, float: array('q') / array('d'), empty cells make an int column float with NaN, ints past 64 bits
+            and numbers with a leading zero (00501) make it a category or str so ids keep their text
+        bool: array('b') of 1, 0 and -1 for empty cells, from true/false in any case
+        datetime: ISO 8601, array('d') of Unix seconds with NaN for empty cells, naive times are taken as UTC
+        category: dictionary-encoded, array('i') codes into a list of the distinct values
+        str: all values UTF-8 encoded in one buffer with an offsets array, for columns with too many distinct
+             values to be a category
+    With NumPy the arrays become ndarrays without copying (datetime becomes datetime64[us]).
+
+    INPUT:
+        file_name (str): Full path to file, first line in CSV must be Headers
+        types (dict): Column name to one of KINDS, fixing its type
+            Default: None, inferred
+        usecols (list): Only load these columns
+            Default: None, all
+        use_numpy (bool)
+            Default: None, when NumPy can be imported
+        workers (int): Processes parsing byte ranges of the file, see csv_helper.split_csv_ranges
+            Default: 1, this process
+        chunk_bytes (int): Bytes per range with workers
+            Default: 64 MiB
+        encoding (str)
+            Default: detected
+        dialect (csv.Dialect)
+            Default: detected
+        sample_rows (int): Rows types are inferred from
+            Default: 1000
+
+    OUTPUT:
+        (ColumnTable)
+    """
+    types = dict(types or {})
+    for name, kind in types.items():
+        if kind not in KINDS:
+            raise ValueError("Column {} has unknown type {}. Use one of {}".format(name, kind, KINDS))
+    if use_numpy and np is None:
+        raise ImportError("use_numpy needs numpy installed")
+    use_numpy = np is not None if use_numpy is None else use_numpy
+    encoding, dialect = csv_helper.csv_format(file_name, encoding, dialect)
+    dialect_params = {name: getattr(dialect, name) for name in csv_helper.DIALECT_ATTRIBUTES
+                      if hasattr(dialect, name)}
+
+    headers = csv_helper.read_csv_headers(file_name, encoding, dialect)
+    indexes = [i for i, name in enumerate(headers) if usecols is None or name in usecols]
+    names = [headers[i] for i in indexes]
+    if usecols is not None:
+        missing = [name for name in usecols if name not in headers]
+        if missing:
+            raise ValueError("CSV {} has no column {}. Headers are {}".format(file_name, missing, headers))
+
+    sample = []
+    with open(file_name, "r", newline="", encoding=encoding) as f:
+        reader = csv.reader(f, **dialect_params)
+        next((row for row in reader if row), None)
+        for row in itertools.islice(reader, sample_rows):
+            sample.append(row)
+    kinds = []
+    for name, i in zip(names, indexes):
+        values = [row[i] for row in sample if i < len(row)]
+        kind = types.get(name) or _infer_kind(values)
+        if kind == "category" and name not in types and len(values) >= 100 and len(set(values)) * 2 > len(values):
+            # Mostly unique, i.e. emails or ids, dictionary encoding would not save anything
+            kind = "str"
+        kinds.append(kind)
+    fixed = [name in types for name in names]
+
+    ranges = None
+    if (workers or 1) > 1 and not dialect_params.get("escapechar") and \
+            codecs.lookup(encoding).name in csv_helper.BYTE_SPLIT_ENCODINGS:
+        ranges = list(csv_helper.split_csv_ranges(file_name, chunk_bytes, dialect_params.get("quotechar") or '"'))
+        # The first range is the Headers and any blank lines before them, which _load_range skips on its own
+        ranges = ranges[1:]
+    source = (file_name, encoding, dialect_params, len(headers))
+    builders = _load_columns(source, ranges, workers, indexes, kinds, fixed)
+    rebuilt = [j for j, builder in enumerate(builders) if builder.rebuilt]
+    if rebuilt:
+        # These widened to text after some of their values were parsed, read them again as text so every value
+        # is kept as it is in the file
+        again = _load_columns(source, ranges, workers, [indexes[j] for j in rebuilt],
+                              [builders[j].kind for j in rebuilt], [True] * len(rebuilt))
+        for j, builder in zip(rebuilt, again):
+            builders[j] = builder
+    lengths = set(len(builder) for builder in builders)
+    if len(lengths) > 1:
+        raise ValueError("CSV {} columns loaded with different lengths {}".format(file_name, lengths))
+
+    columns = OrderedDict((name, builder.finish(use_numpy)) for name, builder in zip(names, builders))
+    return ColumnTable(columns)
+
+
+def _load_columns(source, ranges, workers, indexes, kinds, fixed):
+    """Loads the columns at indexes from the whole file in this process, or from ranges in a process pool."""
+    params = source + (indexes, kinds, fixed)
+    if ranges is None:
+        return _load_range(None, None, *params)
+    builders = None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_load_range, start, end, *params) for start, end in ranges]
+        for future in futures:
+            part = future.result()
+            if builders is None:
+                builders = part
+            else:
+                for builder, other in zip(builders, part):
+                    builder.merge(other)
+    if builders is None:
+        builders = [_ColumnBuilder(kind, is_fixed) for kind, is_fixed in zip(kinds, fixed)]
+    return builders
+
+
+class Column:
+    """
+    One column of a ColumnTable. `data` holds numeric, bool and datetime values, `codes` and `categories` a
+    category column, `buffer` and `offsets` a str column.
+    """
+
+    def __init__(self, kind, data=None, codes=None, categories=None, buffer=None, offsets=None):
+        self.kind = kind
+        self.data = data
+        self.codes = codes
+        self.categories = categories
+        self.buffer = buffer
+        self.offsets = offsets
+        storage = next(part for part in (data, codes, offsets) if part is not None)
+        self.numpy = np is not None and isinstance(storage, np.ndarray)
+
+    def __len__(self):
+        if self.kind == "category":
+            return len(self.codes)
+        if self.kind == "str":
+            return len(self.offsets) - 1
+        return len(self.data)
+
+    def __getitem__(self, i):
+        if self.kind == "category":
+            return self.categories[self.codes[i]]
+        if self.kind == "str":
+            return bytes(self.buffer[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+        return self.data[i]
+
+    @property
+    def nbytes(self):
+        """Bytes of the column's arrays and categories"""
+        total = sum(sys.getsizeof(category) for category in self.categories) if self.categories else 0
+        for part in (self.data, self.codes, self.offsets):
+            if part is not None:
+                total += part.nbytes if self.numpy else len(part) * part.itemsize
+        if self.buffer is not None:
+            total += len(self.buffer)
+        return total
+
+    def values(self):
+        """
+
+        :return: (list) Decoded values, or the ndarray of a numeric column with NumPy
+        """
+        if self.kind == "category":
+            categories = self.categories
+            return [categories[code] for code in self.codes]
+        if self.kind == "str":
+            return [self[i] for i in range(len(self))]
+        return self.data
+
+    def mask(self, op, value):
+        """
+        Compares every value of the column without decoding it.
+
+        :param op: (str) One of OPERATORS or "in"
+        :param value: A value, or a collection of values for "in"
+        :return: (numpy.ndarray of bool with NumPy, else bytearray of 0/1)
+        """
+        if self.kind == "category":
+            # Compare the codes, so the comparison runs once per distinct value
+            if op == "in":
+                wanted = [code for code, category in enumerate(self.categories) if category in value]
+            else:
+                compare = OPERATORS[op]
+                wanted = [code for code, category in enumerate(self.categories) if compare(category, value)]
+            if self.numpy:
+                return np.isin(self.codes, wanted)
+            wanted = set(wanted)
+            return bytearray(code in wanted for code in self.codes)
+        if self.kind == "str":
+            values = self.values()
+        else:
+            values = self.data
+            if self.kind == "datetime":
+                value = [self._datetime_value(v) for v in value] if op == "in" else self._datetime_value(value)
+        if op == "in":
+            if self.numpy and self.kind != "str":
+                return np.isin(values, list(value))
+            value = set(value)
+            mask = bytearray(v in value for v in values)
+        else:
+            compare = OPERATORS[op]
+            if self.numpy and self.kind != "str":
+                return compare(values, value)
+            mask = bytearray(compare(v, value) for v in values)
+        return _numpy_mask(mask) if self.numpy else mask
+
+    def _datetime_value(self, value):
+        seconds = _parse_datetime(value) if isinstance(value, str) else _timestamp(value)
+        return np.datetime64(int(round(seconds * 1e6)), "us") if self.numpy else seconds
+
+    def compress(self, mask):
+        """
+
+        :param mask: Row mask from mask
+        :return: (Column) The rows where mask is true
+        """
+        if self.numpy:
+            mask = _numpy_mask(mask)
+        if self.kind == "str":
+            indexes = np.flatnonzero(mask) if self.numpy else itertools.compress(itertools.count(), mask)
+            buffer = bytearray()
+            offsets = array("q", [0])
+            for i in indexes:
+                buffer += self.buffer[self.offsets[i]:self.offsets[i + 1]]
+                offsets.append(len(buffer))
+            return Column("str", buffer=buffer, offsets=np.frombuffer(offsets, dtype=np.int64) if self.numpy
+                          else offsets)
+        if self.kind == "category":
+            codes = self.codes[mask] if self.numpy else array("i", itertools.compress(self.codes, mask))
+            return Column("category", codes=codes, categories=self.categories)
+        if self.numpy:
+            return Column(self.kind, data=self.data[mask])
+        return Column(self.kind, data=array(self.data.typecode, itertools.compress(self.data, mask)))
+
+
+class ColumnTable:
+    """
+    Columns loaded by load_csv_columns. Projection, filtering and aggregation work on whole columns, no
+    per-row dicts are built unless rows() is asked for.
+
+        table = load_csv_columns("users.csv")
+        active = table.filter(table.where(("status", "==", "active"), ("age", ">=", 18)))
+        active.select("country", "spend").aggregate("country", "spend", "sum")
+    """
+
+    def __init__(self, columns):
+        """
+
+        :param columns: (OrderedDict) Column name to Column
+        """
+        self.columns = columns
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()))) if self.columns else 0
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def names(self):
+        return list(self.columns)
+
+    @property
+    def types(self):
+        return OrderedDict((name, column.kind) for name, column in self.columns.items())
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+    def select(self, *names):
+        """Projection, the columns are shared and not copied."""
+        return ColumnTable(OrderedDict((name, self.columns[name]) for name in names))
+
+    def mask(self, name, op, value):
+        """See Column.mask"""
+        return self.columns[name].mask(op, value)
+
+    def where(self, *conditions):
+        """
+        ANDs masks.
+
+        :param conditions: (tuple) (name, op, value) conditions
+        :return: Row mask, see Column.mask
+        """
+        result = None
+        for name, op, value in conditions:
+            mask = self.mask(name, op, value)
+            if result is None:
+                result = mask
+            elif isinstance(result, bytearray) and isinstance(mask, bytearray):
+                result = bytearray(a and b for a, b in zip(result, mask))
+            else:
+                result = _numpy_mask(result) & _numpy_mask(mask)
+        return result
+
+    def filter(self, mask):
+        """
+
+        :param mask: Row mask from mask or where
+        :return: (ColumnTable) The rows where mask is true
+        """
+        return ColumnTable(OrderedDict((name, column.compress(mask)) for name, column in self.columns.items()))
+
+    def aggregate(self, by, name=None, how="sum"):
+        """
+        Groups by a category column.
+
+        :param by: (str) Category column
+        :param name: (str) Numeric column, not needed for count
+        :param how: (str) sum, mean or count
+        :return: (dict) Category to result
+        """
+        group = self.columns[by]
+        if group.kind != "category":
+            raise ValueError("Column {} is {}, only category columns can be grouped by".format(by, group.kind))
+        if how not in ("sum", "mean", "count"):
+            raise ValueError("Unknown aggregate {}, use sum, mean or count".format(how))
+        size = len(group.categories)
+        if group.numpy:
+            counts = np.bincount(group.codes, minlength=size)
+            if how != "count":
+                values = np.asarray(self.columns[name].data, dtype=np.float64)
+                keep = ~np.isnan(values)
+                sums = np.bincount(group.codes[keep], weights=values[keep], minlength=size)
+                counts = np.bincount(group.codes[keep], minlength=size)
+        else:
+            counts = [0] * size
+            sums = [0.0] * size
+            values = self.columns[name].data if how != "count" else itertools.repeat(0.0)
+            for code, value in zip(group.codes, values):
+                if value == value:
+                    counts[code] += 1
+                    sums[code] += value
+        results = OrderedDict()
+        for code, category in enumerate(group.categories):
+            if how == "count":
+                results[category] = int(counts[code])
+            elif how == "sum":
+                results[category] = float(sums[code])
+            else:
+                results[category] = float(sums[code]) / int(counts[code]) if counts[code] else float("nan")
+        return results
+
+    def rows(self):
+        """Yields every row as a dict, for code that needs rows."""
+        names = self.names
+        for values in zip(*(self.columns[name].values() for name in names)):
+            yield dict(zip(names, values))
+
+
+class _ColumnBuilder:
+    """
+    Appends the text values of one column, converting them to its kind and widening the kind when a value does not
+    fit. Empty cells seen before the kind is known are counted in pending_empty and added once it is.
+    A column widened to category or str after values were parsed is marked rebuilt, since their text is rebuilt
+    from the parsed values and may differ from the file, i.e. "1.50" becomes "1.5".
+    """
+
+    def __init__(self, kind, fixed=False):
+        self.fixed = fixed
+        self.pending_empty = 0
+        self.rebuilt = False
+        self._set_kind(kind)
+
+    def __len__(self):
+        if self.kind is None:
+            return self.pending_empty
+        if self.kind == "category":
+            return len(self.codes)
+        if self.kind == "str":
+            return len(self.offsets) - 1
+        return len(self.data)
+
+    def extend(self, values):
+        if self.kind is None:
+            first = next((i for i, value in enumerate(values) if value), None)
+            if first is None:
+                self.pending_empty += len(values)
+                return
+            self.pending_empty += first
+            values = values[first:]
+            self._set_kind(_infer_kind(values[:1000]))
+        try:
+            # Fast path, converts the values into a new array so nothing is added if one fails
+            getattr(self, "_extend_" + self.kind)(values)
+        except ValueError:
+            for value in values:
+                self._append(value)
+
+    def merge(self, other):
+        """Appends the values of a builder of the same column, widening either to a kind both fit."""
+        if other.kind is None:
+            self._extend_empty(other.pending_empty)
+            return
+        if self.kind is None:
+            merged = _ColumnBuilder(other.kind, self.fixed)
+            merged._extend_empty(self.pending_empty)
+            merged.merge(other)
+            self.__dict__.update(merged.__dict__)
+            return
+        kind = _common_kind(self.kind, other.kind)
+        if kind == "float" and "int" in (self.kind, other.kind):
+            # Empty cells in the other range made it float
+            self._widen("float")
+            other._widen("float")
+        self._widen(kind)
+        other._widen(kind)
+        self.rebuilt = self.rebuilt or other.rebuilt
+        if kind == "category":
+            index = self.index
+            remap = array("i", [index.setdefault(category, len(index)) for category in other.index])
+            self.codes.extend(array("i", map(remap.__getitem__, other.codes)))
+        elif kind == "str":
+            base = len(self.buffer)
+            self.buffer += other.buffer
+            self.offsets.extend(array("q", [offset + base for offset in other.offsets[1:]]))
+        else:
+            self.data.extend(other.data)
+
+    def finish(self, use_numpy):
+        if self.kind is None:
+            # Every cell was empty
+            self._set_kind("category")
+        if self.kind == "category":
+            codes = _to_numpy(self.codes, np.int32) if use_numpy else self.codes
+            return Column("category", codes=codes, categories=list(self.index))
+        if self.kind == "str":
+            offsets = _to_numpy(self.offsets, np.int64) if use_numpy else self.offsets
+            return Column("str", buffer=self.buffer, offsets=offsets)
+        data = self.data
+        if use_numpy:
+            data = _to_numpy(data, {"q": np.int64, "d": np.float64, "b": np.int8}[data.typecode])
+            if self.kind == "datetime":
+                seconds = data
+                data = np.full(len(seconds), np.datetime64("NaT"), dtype="datetime64[us]")
+                known = ~np.isnan(seconds)
+                data[known] = np.round(seconds[known] * 1e6).astype(np.int64)
+        return Column(self.kind, data=data)
+
+    def _set_kind(self, kind):
+        self.kind = kind
+        self.data = self.codes = self.index = self.buffer = self.offsets = None
+        if kind == "int":
+            self.data = array("q")
+        elif kind in ("float", "datetime"):
+            self.data = array("d")
+        elif kind == "bool":
+            self.data = array("b")
+        elif kind == "category":
+            self.index = {}
+            self.codes = array("i")
+        elif kind == "str":
+            self.buffer = bytearray()
+            self.offsets = array("q", [0])
+        if kind is not None and self.pending_empty:
+            pending, self.pending_empty = self.pending_empty, 0
+            self._extend_empty(pending)
+
+    def _extend_int(self, values):
+        try:
+            data = array("q", map(int, values))
+        except OverflowError as e:
+            raise ValueError("Value is past 64 bits: {}".format(e))
+        if not self.fixed:
+            _check_leading_zeros(values)
+        self.data.extend(data)
+
+    def _extend_float(self, values):
+        data = array("d", map(float, values))
+        if not self.fixed:
+            _check_leading_zeros(values)
+        self.data.extend(data)
+
+    def _extend_bool(self, values):
+        try:
+            self.data.extend(array("b", map(BOOLS.__getitem__, map(str.lower, values))))
+        except KeyError as e:
+            raise ValueError("{} is not a bool".format(e))
+
+    def _extend_datetime(self, values):
+        if np is not None and len(values) > 1:
+            # NumPy parses ISO 8601 in C. It warns on time zone offsets, those take the Python path below
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("error")
+                    parsed = np.array(values, dtype="datetime64[us]")
+                seconds = parsed.astype(np.int64) / 1e6
+                seconds[np.isnat(parsed)] = np.nan
+                self.data.extend(array("d", seconds.tobytes()))
+                return
+            except (ValueError, Warning):
+                pass
+        self.data.extend(array("d", map(_parse_datetime, values)))
+
+    def _extend_category(self, values):
+        index = self.index
+        self.codes.extend(array("i", [index.setdefault(value, len(index)) for value in values]))
+        if not self.fixed and len(index) > MAX_CATEGORIES and len(index) * 2 > len(self.codes):
+            self._widen("str")
+
+    def _extend_str(self, values):
+        encoded = [value.encode("utf-8") for value in values]
+        self.offsets.extend(array("q", itertools.accumulate(map(len, encoded), initial=len(self.buffer)))[1:])
+        self.buffer += b"".join(encoded)
+
+    def _extend_empty(self, count):
+        if not count:
+            return
+        if self.kind is None:
+            self.pending_empty += count
+            return
+        if self.kind == "int":
+            # Ints have no missing value
+            self._widen("float")
+        if self.kind in ("float", "datetime"):
+            self.data.extend(array("d", [math.nan]) * count)
+        elif self.kind == "bool":
+            self.data.extend(array("b", [-1]) * count)
+        else:
+            getattr(self, "_extend_" + self.kind)([""] * count)
+
+    def _append(self, value):
+        """Slow path for one value that may be empty or need a wider kind."""
+        if not value:
+            self._extend_empty(1)
+            return
+        while True:
+            try:
+                getattr(self, "_extend_" + self.kind)([value])
+                return
+            except ValueError:
+                if self.fixed:
+                    raise ValueError("Value {!r} is not {}".format(value, self.kind))
+                self._widen(_common_kind(self.kind, _infer_kind([value])))
+
+    def _widen(self, kind):
+        if kind == self.kind:
+            return
+        if kind == "float" and self.kind == "int":
+            self.data = array("d", self.data)
+            self.kind = "float"
+            return
+        # Everything else widens to category or str through the text of the values
+        if self.kind not in ("category", "str") and len(self):
+            self.rebuilt = True
+        texts = self._texts()
+        self._set_kind(kind)
+        getattr(self, "_extend_" + kind)(texts)
+
+    def _texts(self):
+        if self.kind == "category":
+            categories = list(self.index)
+            return [categories[code] for code in self.codes]
+        if self.kind == "str":
+            return [bytes(self.buffer[a:b]).decode("utf-8") for a, b in zip(self.offsets, self.offsets[1:])]
+        if self.kind == "bool":
+            return [("false", "true")[v] if v >= 0 else "" for v in self.data]
+        if self.kind == "datetime":
+            return [datetime.fromtimestamp(v, timezone.utc).isoformat() if v == v else "" for v in self.data]
+        if self.kind == "float":
+            return [repr(v) if v == v else "" for v in self.data]
+        return [str(v) for v in self.data]
+
+
+def _load_range(start, end, file_name, encoding, dialect_params, width, indexes, kinds, fixed):
+    """Loads the rows of a byte range of the file, or of the whole file without one, into column builders."""
+    builders = [_ColumnBuilder(kind, is_fixed) for kind, is_fixed in zip(kinds, fixed)]
+    if start is None:
+        f = open(file_name, "r", newline="", encoding=encoding)
+        reader = csv.reader(f, **dialect_params)
+        next((row for row in reader if row), None)
+    else:
+        with open(file_name, "rb") as raw:
+            raw.seek(start)
+            f = io.StringIO(raw.read(end - start).decode(encoding), newline="")
+        reader = csv.reader(f, **dialect_params)
+    with f:
+        while True:
+            block = list(itertools.islice(reader, BLOCK_ROWS))
+            if not block:
+                break
+            rows = block
+            if set(map(len, block)) != {width}:
+                rows = [row if len(row) == width else (row + [""] * (width - len(row)))[:width]
+                        for row in block if row]
+            if not rows:
+                continue
+            columns = list(zip(*rows))
+            for builder, i in zip(builders, indexes):
+                builder.extend(columns[i])
+    return builders
+
+
+def _to_numpy(values, dtype):
+    # frombuffer shares the array's memory, it only fails on an empty buffer in old NumPy versions
+    return np.frombuffer(values, dtype=dtype) if len(values) else np.zeros(0, dtype=dtype)
+
+
+def _numpy_mask(mask):
+    # NumPy reads a bytearray or an int array as row indexes, only a bool array filters rows
+    if isinstance(mask, np.ndarray) and mask.dtype == np.bool_:
+        return mask
+    if isinstance(mask, (bytes, bytearray)):
+        return np.frombuffer(mask, dtype=np.uint8).astype(np.bool_)
+    return np.asarray(mask, dtype=np.bool_)
+
+
+def _infer_kind(values):
+    values = [value for value in values if value]
+    if not values:
+        return None
+    for kind, parse in (("int", _parse_int), ("float", _parse_float), ("bool", _parse_bool),
+                        ("datetime", _parse_datetime)):
+        try:
+            for value in values:
+                parse(value)
+            return kind
+        except ValueError:
+            continue
+        except OverflowError:
+            # Integers past 64 bits are ids, a float would round them
+            return "category"
+    return "category"
+
+
+def _common_kind(a, b):
+    if a == b:
+        return a
+    if {a, b} == {"int", "float"}:
+        return "float"
+    if "str" in (a, b):
+        return "str"
+    return "category"
+
+
+def _parse_int(value):
+    number = int(value)
+    _check_leading_zeros([value])
+    if not INT_MIN <= number <= INT_MAX:
+        raise OverflowError("{!r} is past 64 bits".format(value))
+    return number
+
+
+def _parse_float(value):
+    number = float(value)
+    _check_leading_zeros([value])
+    return number
+
+
+def _check_leading_zeros(values):
+    match = LEADING_ZERO_RE.search("\n" + "\n".join(values))
+    if match is not None:
+        raise ValueError("{!r} has a leading zero".format(match.group().strip()))
+
+
+def _parse_bool(value):
+    try:
+        return BOOLS[value.lower()]
+    except KeyError:
+        raise ValueError("{!r} is not a bool".format(value))
+
+
+def _parse_datetime(value):
+    # Plain numbers are ints or floats, not dates
+    if len(value) < 10 or value[4] != "-":
+        raise ValueError("{!r} is not an ISO 8601 date".format(value))
+    return _timestamp(datetime.fromisoformat(value))
+
+
+def _timestamp(value):
+    if value.tzinfo is None:
+        return (value - EPOCH).total_seconds()
+    return value.timestamp()
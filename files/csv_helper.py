@@ -2,31 +2,359 @@ import os
 import sys
 import json
 import csv
+import codecs
 import pprint
+import io
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 
+# Delimiters sniff_csv chooses from
+SNIFF_DELIMITERS = ",;\t|"
 
-def csv_to_dict(file_name):
+# csv.Dialect attributes, passed to worker processes as a dict since sniffed dialects cannot be pickled
+DIALECT_ATTRIBUTES = ("delimiter", "quotechar", "escapechar", "doublequote", "skipinitialspace", "quoting",
+                      "lineterminator", "strict")
+
+# Encodings in which quotes and newlines are single ASCII bytes, so a file can be split on bytes
+BYTE_SPLIT_ENCODINGS = ("utf-8", "utf-8-sig", "ascii", "cp1252", "latin-1", "iso-8859-1")
+
+
+def csv_to_dict(file_name, **kwargs):
+    """
+    Converts CSV contents to a list of Dictionaries, see iter_csv_dicts.
+    First line in CSV must be Headers.
+
+    INPUT:
+        file_name (str): Full path to file
+        kwargs: Passed on to iter_csv_dicts
+
+    OUTPUT:
+        (list)
+    """
+    return list(iter_csv_dicts(file_name, **kwargs))
+
+
+def csv_to_columns(file_name, **kwargs):
     """
-    Converts CSV contents to a Dictionary.
+    Loads CSV contents as typed, compact columns instead of Dictionaries, see csv_columns.load_csv_columns.
     First line in CSV must be Headers.
 
     INPUT:
         file_name (str): Full path to file
+        kwargs: Passed on to load_csv_columns
 
     OUTPUT:
-        (dict)
+        (csv_columns.ColumnTable)
     """
-    entries = []
-    with open(file_name, "r") as f:
-        reader = csv.reader(f)
-        headers = reader.next()
-        _out(headers, "csv_to_dict - HEADERS")
-        for row in reader:
-            entry = {}
-            for i in range(len(headers)):
-                entry[headers[i]] = row[i]
-            entries.append(entry)
-    return entries
+    # csv_columns builds on this module
+    import files.csv_columns as csv_columns
+    return csv_columns.load_csv_columns(file_name, **kwargs)
+
+
+def iter_csv_dicts(file_name, chunksize=None, encoding=None, dialect=None, short_rows="fill", long_rows="extra",
+                   fill_value="", extra_key=None, line_key=None):
+    """
+    Streams CSV contents as Dictionaries, so memory stays flat whatever the size of the file.
+    First line in CSV must be Headers. Blank lines are skipped.
+    Encoding and dialect are detected from the first block of the file unless given, see sniff_csv.
+
+    INPUT:
+        file_name (str): Full path to file
+        chunksize (int): Yield lists of up to this many rows instead of single rows
+            Default: None
+        encoding (str)
+            Default: detected
+        dialect (csv.Dialect)
+            Default: detected
+        short_rows (str): Rows with fewer fields than headers are
+            "fill": padded with fill_value (Default)
+            "skip": skipped
+            "error": ValueError
+        long_rows (str): Rows with more fields than headers are
+            "extra": kept, with the extra fields as a list under extra_key (Default)
+            "truncate": cut to the headers
+            "skip": skipped
+            "error": ValueError
+        fill_value: Value of missing fields of short rows
+            Default: ""
+        extra_key: Key of the extra fields of long rows, None like csv.DictReader
+            Default: None
+        line_key (str): Key to store each row's line number under
+            Default: None, no line numbers
+
+    OUTPUT:
+        (generator): Dictionaries, or lists of Dictionaries with chunksize
+    """
+    if short_rows not in ("fill", "skip", "error"):
+        raise ValueError("short_rows must be fill, skip or error, not {}".format(short_rows))
+    if long_rows not in ("extra", "truncate", "skip", "error"):
+        raise ValueError("long_rows must be extra, truncate, skip or error, not {}".format(long_rows))
+    encoding, dialect = csv_format(file_name, encoding, dialect)
+
+    with open(file_name, "r", newline="", encoding=encoding) as f:
+        reader = csv.reader(f, dialect)
+        headers = next((row for row in reader if row), None)
+        if headers is None:
+            return
+        width = len(headers)
+        if not chunksize and line_key is None:
+            # Fast path, one generator frame per row and zip and dict build the row in C
+            for row in reader:
+                if len(row) == width:
+                    yield dict(zip(headers, row))
+                elif row:
+                    entry = _irregular_row(file_name, reader, headers, row, short_rows, long_rows, fill_value,
+                                           extra_key)
+                    if entry is not None:
+                        yield entry
+            return
+        rows = _dict_rows(file_name, reader, headers, short_rows, long_rows, fill_value, extra_key, line_key)
+        if not chunksize:
+            yield from rows
+            return
+        while True:
+            chunk = list(itertools.islice(rows, chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+
+def iter_csv_dicts_parallel(file_name, workers=None, chunk_bytes=8 * 1024 * 1024, ordered=True, row_func=None,
+                            encoding=None, dialect=None, short_rows="fill", long_rows="extra", fill_value="",
+                            extra_key=None):
+    """
+    Parses a CSV on several cores. The file is cut into byte ranges of about chunk_bytes that end on line
+    boundaries outside quoted fields (see split_csv_ranges), every range is parsed in a process pool and the
+    rows come back one list per range. The Headers are read once in this process and shared with the workers.
+    Falls back to parsing in this process when the file cannot be split on bytes, i.e. utf-16 or an escapechar.
+
+    INPUT:
+        file_name (str): Full path to file
+        workers (int): Processes, 1 parses in this process
+            Default: one per core
+        chunk_bytes (int): Bytes per range
+            Default: 8 MiB
+        ordered (bool): Yield ranges in file order, else as soon as they are parsed
+            Default: True
+        row_func (function): Runs in the workers on every row, returning the value to yield or None to drop the
+            row. Must be picklable, i.e. defined at module level
+            Default: None
+        encoding, dialect, short_rows, long_rows, fill_value, extra_key: See iter_csv_dicts
+
+    OUTPUT:
+        (generator): Lists of Dictionaries, or of row_func results
+    """
+    encoding, dialect = csv_format(file_name, encoding, dialect)
+    dialect_params = {name: getattr(dialect, name) for name in DIALECT_ATTRIBUTES if hasattr(dialect, name)}
+
+    if codecs.lookup(encoding).name not in BYTE_SPLIT_ENCODINGS or dialect_params.get("escapechar"):
+        chunks = iter_csv_dicts(file_name, chunksize=100000, encoding=encoding, dialect=dialect,
+                                short_rows=short_rows, long_rows=long_rows, fill_value=fill_value,
+                                extra_key=extra_key)
+        for chunk in chunks:
+            rows = chunk if row_func is None else [row for row in map(row_func, chunk) if row is not None]
+            if rows:
+                yield rows
+        return
+
+    ranges = split_csv_ranges(file_name, chunk_bytes, dialect_params.get("quotechar") or '"')
+    header_range = next(ranges, None)
+    if header_range is None:
+        return
+    with open(file_name, "rb") as f:
+        f.seek(header_range[0])
+        header_text = f.read(header_range[1] - header_range[0]).decode(encoding)
+    headers = next((row for row in csv.reader(io.StringIO(header_text, newline=""), **dialect_params) if row), None)
+    if headers is None:
+        return
+    params = (file_name, headers, encoding, dialect_params, short_rows, long_rows, fill_value, extra_key, row_func)
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for start, end in ranges:
+            rows = _parse_csv_range(start, end, *params)
+            if rows:
+                yield rows
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Bound the ranges in flight so a slow consumer does not pile up parsed rows
+        max_in_flight = 2 * workers
+        in_flight = deque()
+        for start, end in ranges:
+            in_flight.append(executor.submit(_parse_csv_range, start, end, *params))
+            while len(in_flight) >= max_in_flight:
+                for rows in _completed_ranges(in_flight, ordered):
+                    if rows:
+                        yield rows
+        while in_flight:
+            for rows in _completed_ranges(in_flight, ordered):
+                if rows:
+                    yield rows
+
+
+def split_csv_ranges(file_name, chunk_bytes=8 * 1024 * 1024, quotechar='"', block_size=1024 * 1024):
+    """
+    Cuts a CSV into byte ranges of about chunk_bytes that end right after a newline outside quoted fields, so
+    every range holds whole records. A newline is outside quotes when an even number of quote characters come
+    before it in the file, which holds for files whose quote characters only open, close or double up inside
+    quoted fields, as csv.writer writes them. The first range is the Headers line, with any blank lines before it.
+
+    INPUT:
+        file_name (str): Full path to file
+        chunk_bytes (int): Bytes per range
+            Default: 8 MiB
+        quotechar (str)
+            Default: '"'
+        block_size (int): Bytes scanned at a time
+            Default: 1 MiB
+
+    OUTPUT:
+        (generator): (start, end) byte offsets
+    """
+    quote = quotechar.encode("ascii")
+    size = os.path.getsize(file_name)
+    with open(file_name, "rb") as f:
+        start = 0
+        # The Headers range ends at the first boundary after a line that is not blank
+        target = 0
+        headers_found = False
+        # Block offset of the record being read while looking for the Headers, and whether it began with text in an
+        # earlier block
+        record_from = 0
+        record_text = False
+        # Quotes before block_start
+        quotes = 0
+        # A byte order mark belongs to the Headers range but is not text of its first line
+        block_start = len(codecs.BOM_UTF8) if f.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8 else 0
+        f.seek(block_start)
+        block = f.read(block_size)
+        while block:
+            # Quotes before block_start + counted_to
+            counted = quotes
+            counted_to = 0
+            position = max(target - block_start, 0)
+            while position < len(block):
+                newline = block.find(b"\n", position)
+                if newline < 0:
+                    break
+                counted += block.count(quote, counted_to, newline)
+                counted_to = newline
+                if counted % 2:
+                    position = newline + 1
+                    continue
+                if not headers_found:
+                    if not record_text and _blank_line(block[record_from:newline]):
+                        # csv.reader skips blank lines before the Headers, keep them in the Headers range
+                        record_from = position = newline + 1
+                        continue
+                    headers_found = True
+                end = block_start + newline + 1
+                yield start, end
+                start = end
+                target = start + chunk_bytes
+                position = target - block_start
+            if not headers_found:
+                record_text = record_text or not _blank_line(block[record_from:])
+                record_from = 0
+            quotes = counted + block.count(quote, counted_to)
+            block_start += len(block)
+            block = f.read(block_size)
+        if start < size:
+            yield start, size
+
+
+def read_csv_headers(file_name, encoding=None, dialect=None):
+    """
+    Reads the Headers of a CSV, detecting encoding and dialect like iter_csv_dicts.
+
+    INPUT:
+        file_name (str): Full path to file
+        encoding (str)
+        dialect (csv.Dialect)
+
+    OUTPUT:
+        (list): Empty if the file is empty
+    """
+    encoding, dialect = csv_format(file_name, encoding, dialect)
+    with open(file_name, "r", newline="", encoding=encoding) as f:
+        return next((row for row in csv.reader(f, dialect) if row), [])
+
+
+def csv_format(file_name, encoding=None, dialect=None):
+    """
+    Fills in the encoding and dialect of a CSV that were not given, see sniff_csv.
+
+    INPUT:
+        file_name (str): Full path to file
+        encoding (str)
+            Default: detected
+        dialect (csv.Dialect)
+            Default: detected
+
+    OUTPUT:
+        (tuple): (encoding (str), dialect (csv.Dialect))
+    """
+    if encoding is None or dialect is None:
+        sniffed_encoding, sniffed_dialect = sniff_csv(file_name)
+        encoding = encoding or sniffed_encoding
+        dialect = dialect or sniffed_dialect
+    return encoding, dialect
+
+
+def sniff_csv(file_name, sample_size=65536, sniff_size=8192):
+    """
+    Detects the encoding and dialect of a CSV from its first block.
+    A byte order mark picks utf-8-sig or utf-16, else the block must decode as utf-8 or cp1252 is assumed.
+    The dialect is csv.excel with the delimiter sniffed from the first lines, quoting is always excel's.
+
+    INPUT:
+        file_name (str): Full path to file
+        sample_size (int): Bytes read to detect the encoding
+            Default: 64 KiB
+        sniff_size (int): Characters of whole lines the delimiter is sniffed from. csv.Sniffer's quote regexes
+            slow down badly on long samples of quoted, multi-line fields
+            Default: 8 KiB
+
+    OUTPUT:
+        (tuple): (encoding (str), dialect (csv.Dialect))
+    """
+    with open(file_name, "rb") as f:
+        block = f.read(sample_size)
+
+    if block.startswith(codecs.BOM_UTF8):
+        encoding = "utf-8-sig"
+    elif block.startswith(codecs.BOM_UTF16_LE) or block.startswith(codecs.BOM_UTF16_BE):
+        encoding = "utf-16"
+    else:
+        try:
+            # A multibyte character may be cut at the end of the block
+            codecs.getincrementaldecoder("utf-8")().decode(block, final=len(block) < sample_size)
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "cp1252"
+
+    sample = codecs.getincrementaldecoder(encoding)(errors="replace").decode(block)
+    # Only sniff whole lines
+    if len(sample) > sniff_size or len(block) >= sample_size:
+        sample = sample[:sniff_size]
+        if "\n" in sample:
+            sample = sample[:sample.rindex("\n") + 1]
+    try:
+        delimiter = csv.Sniffer().sniff(sample, delimiters=SNIFF_DELIMITERS).delimiter
+    except csv.Error:
+        # Ragged rows defeat the sniffer, go by the delimiter used most in the header line
+        header_line = sample.split("\n", 1)[0]
+        delimiter = max(SNIFF_DELIMITERS, key=header_line.count)
+        if header_line.count(delimiter) <= header_line.count(","):
+            delimiter = ","
+    # Only the delimiter is taken from the sniffer. It guesses doublequote and skipinitialspace from the sample
+    # alone, so a quote doubled by csv.writer past the sample would be mis-split and " name" read as "name"
+    if delimiter == ",":
+        return encoding, csv.excel
+    return encoding, type("sniffed", (csv.excel,), {"delimiter": delimiter})
 
 
 def write_to_files(csv_keys, file_name, data, path_to_file=None):
@@ -39,14 +367,95 @@ def write_to_files(csv_keys, file_name, data, path_to_file=None):
         data (list): List of dictionaries
         path_to_file (str)
     """
+    with csv_writer(csv_keys, file_name, path_to_file) as dict_writer:
+        dict_writer.writerows(data)
+
+
+@contextmanager
+def csv_writer(csv_keys, file_name, path_to_file=None, append=False):
+    """
+    Opens {path_to_file}/{file_name}.csv with csv_keys as the header and yields a DictWriter, so rows can be
+    written one at a time as they are produced.
+
+    INPUT:
+        csv_keys (list)
+        file_name (str)
+        path_to_file (str)
+        append (bool): Add rows to an existing file instead of replacing it, the header is only written to a new
+            or empty file
+            Default: False
+
+    OUTPUT:
+        (csv.DictWriter)
+    """
     if path_to_file:
         file_name = os.path.expanduser("{}/{}".format(path_to_file, file_name))
 
-    _out("Writing out to file {}.csv".format(file_name))
-    with open("{}.csv".format(file_name), 'w') as csvfile:
+    _out("{} file {}.csv".format("Appending to" if append else "Writing out to", file_name))
+    with open("{}.csv".format(file_name), 'a' if append else 'w', newline='') as csvfile:
         dict_writer = csv.DictWriter(csvfile, list(csv_keys))
-        dict_writer.writeheader()
-        dict_writer.writerows(data)
+        if csvfile.tell() == 0:
+            dict_writer.writeheader()
+        yield dict_writer
+
+
+def _dict_rows(file_name, reader, headers, short_rows, long_rows, fill_value, extra_key, line_key):
+    width = len(headers)
+    for row in reader:
+        if len(row) == width:
+            entry = dict(zip(headers, row))
+        elif row:
+            entry = _irregular_row(file_name, reader, headers, row, short_rows, long_rows, fill_value, extra_key)
+            if entry is None:
+                continue
+        else:
+            continue
+        if line_key is not None:
+            entry[line_key] = reader.line_num
+        yield entry
+
+
+def _irregular_row(file_name, reader, headers, row, short_rows, long_rows, fill_value, extra_key):
+    """Applies the short_rows or long_rows policy of iter_csv_dicts, returning None for a skipped row."""
+    width = len(headers)
+    policy = short_rows if len(row) < width else long_rows
+    if policy == "skip":
+        return None
+    if policy == "error":
+        raise ValueError("{} line {} has {} fields, expected {}".format(file_name, reader.line_num, len(row), width))
+    if len(row) < width:
+        return dict(zip(headers, row + [fill_value] * (width - len(row))))
+    entry = dict(zip(headers, row))
+    if policy == "extra":
+        entry[extra_key] = row[width:]
+    return entry
+
+
+def _blank_line(line):
+    # A line csv.reader yields no fields for
+    return not line.strip(b"\r")
+
+
+def _parse_csv_range(start, end, file_name, headers, encoding, dialect_params, short_rows, long_rows, fill_value,
+                     extra_key, row_func):
+    with open(file_name, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode(encoding)
+    reader = csv.reader(io.StringIO(text, newline=""), **dialect_params)
+    rows = _dict_rows(file_name, reader, headers, short_rows, long_rows, fill_value, extra_key, None)
+    if row_func is None:
+        return list(rows)
+    return [row for row in map(row_func, rows) if row is not None]
+
+
+def _completed_ranges(in_flight, ordered):
+    if ordered:
+        return [in_flight.popleft().result()]
+    wait(in_flight, return_when=FIRST_COMPLETED)
+    done = [future for future in in_flight if future.done()]
+    for future in done:
+        in_flight.remove(future)
+    return [future.result() for future in done]
 
 
 def _out(msg, title=None):
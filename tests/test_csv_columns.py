@@ -0,0 +1,133 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import files.csv_columns as csv_columns
+
+NUMPY = [False] + ([True] if csv_columns.np is not None else [])
+
+
+def _write_users(path, count=200):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "email", "score", "joined", "active", "country"])
+        for i in range(count):
+            writer.writerow([i, "u{}@x.com".format(i), i * 1.5, "2024-01-{:02d}T00:00:00".format(i % 28 + 1),
+                             "true" if i % 2 else "false", ("us", "fr", "de")[i % 3]])
+
+
+@pytest.fixture
+def users_csv(tmp_path):
+    path = str(tmp_path / "users.csv")
+    _write_users(path)
+    return path
+
+
+@pytest.mark.parametrize("use_numpy", NUMPY)
+def test_filter_on_str_column(users_csv, use_numpy):
+    table = csv_columns.load_csv_columns(users_csv, use_numpy=use_numpy)
+    assert table.types["email"] == "str"
+
+    rows = list(table.filter(table.mask("email", "==", "u5@x.com")).rows())
+
+    assert [(row["id"], row["email"], row["score"]) for row in rows] == [(5, "u5@x.com", 7.5)]
+    assert bool(rows[0]["active"]) is True
+
+
+@pytest.mark.parametrize("use_numpy", NUMPY)
+def test_filter_on_str_and_numeric_conditions(users_csv, use_numpy):
+    table = csv_columns.load_csv_columns(users_csv, use_numpy=use_numpy)
+    emails = ["u{}@x.com".format(i) for i in (3, 4, 150, 152)]
+
+    mask = table.where(("email", "in", emails), ("score", ">=", 6.0), ("country", "!=", "de"))
+    rows = list(table.filter(mask).rows())
+
+    assert [(row["id"], row["email"], row["country"]) for row in rows] == [(4, "u4@x.com", "fr"),
+                                                                          (150, "u150@x.com", "us")]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_widening_to_text_keeps_the_file_text(tmp_path, workers):
+    path = str(tmp_path / "mixed.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["code", "amount", "flag", "when"])
+        writer.writerows([["00000", "1.50", "TRUE", "2024-01-01T10:00:00"]] * 50)
+        writer.writerow(["A1", "n/a", "maybe", "soon"])
+
+    table = csv_columns.load_csv_columns(path, sample_rows=10, workers=workers, chunk_bytes=256)
+
+    assert table.types == {"code": "category", "amount": "category", "flag": "category", "when": "category"}
+    rows = list(table.rows())
+    assert rows[0] == {"code": "00000", "amount": "1.50", "flag": "TRUE", "when": "2024-01-01T10:00:00"}
+    assert rows[-1] == {"code": "A1", "amount": "n/a", "flag": "maybe", "when": "soon"}
+
+
+@pytest.mark.parametrize("sample_rows", [1, 1000])
+def test_ints_past_64_bits_are_kept_as_text(tmp_path, sample_rows):
+    path = str(tmp_path / "ids.csv")
+    ids = ["1", "2", "12345678901234567890", "-98765432109876543210"]
+    with open(path, "w", newline="") as f:
+        f.write("id\n" + "\n".join(ids) + "\n")
+
+    table = csv_columns.load_csv_columns(path, sample_rows=sample_rows)
+
+    assert table.types["id"] in ("category", "str")
+    assert list(table["id"].values()) == ids
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_leading_blank_lines_before_the_headers(tmp_path, workers):
+    path = str(tmp_path / "blank.csv")
+    with open(path, "w", newline="") as f:
+        f.write("\r\n\n")
+    with open(path, "a", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "name"])
+        writer.writerows([i, "user{}".format(i % 3)] for i in range(50))
+
+    table = csv_columns.load_csv_columns(path, workers=workers, chunk_bytes=64)
+
+    assert len(table) == 50
+    assert table.types == {"id": "int", "name": "category"}
+    assert list(table["id"].values())[:2] == [0, 1]
+
+
+@pytest.mark.parametrize("sample_rows", [1, 1000])
+def test_numbers_with_leading_zeros_are_kept_as_text(tmp_path, sample_rows):
+    path = str(tmp_path / "zips.csv")
+    with open(path, "w", newline="") as f:
+        f.write("zip,agent,share\n10001,1,0.5\n00501,007,0\n02134,42,00.25\n")
+
+    table = csv_columns.load_csv_columns(path, sample_rows=sample_rows)
+
+    assert table.types["zip"] in ("category", "str")
+    assert table.types["agent"] in ("category", "str")
+    assert table.types["share"] in ("category", "str")
+    assert list(table["zip"].values()) == ["10001", "00501", "02134"]
+    assert list(table["agent"].values()) == ["1", "007", "42"]
+    assert list(table["share"].values()) == ["0.5", "0", "00.25"]
+
+
+def test_lone_zeros_are_numbers(tmp_path):
+    path = str(tmp_path / "zeros.csv")
+    with open(path, "w", newline="") as f:
+        f.write("count,ratio\n0,0.5\n-3,0\n10,-0.25\n")
+
+    table = csv_columns.load_csv_columns(path)
+
+    assert table.types == {"count": "int", "ratio": "float"}
+
+
+def test_given_numeric_types_take_leading_zeros(tmp_path):
+    path = str(tmp_path / "zeros.csv")
+    with open(path, "w", newline="") as f:
+        f.write("count,ratio\n007,00.5\n")
+
+    table = csv_columns.load_csv_columns(path, types={"count": "int", "ratio": "float"})
+
+    assert list(table.rows()) == [{"count": 7, "ratio": 0.5}]
@@ -0,0 +1,80 @@
+import csv
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import files.csv_helper as csv_helper
+
+LEADING_BLANK_CSV = "\r\n\nid,name,note\r\n" + "".join('{},user{},"line one\r\nline two"\r\n'.format(i, i)
+                                                     for i in range(40))
+
+
+@pytest.fixture
+def leading_blank_csv(tmp_path):
+    path = str(tmp_path / "blank.csv")
+    with open(path, "w", newline="") as f:
+        f.write(LEADING_BLANK_CSV)
+    return path
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 1024])
+def test_split_csv_ranges_keeps_leading_blank_lines_with_the_headers(leading_blank_csv, block_size):
+    ranges = list(csv_helper.split_csv_ranges(leading_blank_csv, chunk_bytes=100, block_size=block_size))
+
+    assert ranges[0] == (0, len("\r\n\nid,name,note\r\n"))
+    assert ranges[-1][1] == len(LEADING_BLANK_CSV)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_parallel_matches_serial_with_leading_blank_lines(leading_blank_csv, workers):
+    serial = list(csv_helper.iter_csv_dicts(leading_blank_csv))
+
+    parallel = [row for rows in csv_helper.iter_csv_dicts_parallel(leading_blank_csv, workers=workers,
+                                                                   chunk_bytes=100)
+                for row in rows]
+
+    assert len(serial) == 40
+    assert parallel == serial
+
+
+def test_quotes_past_the_sniffed_sample_are_parsed_like_excel(tmp_path):
+    path = str(tmp_path / "notes.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "note"])
+        writer.writerows([i, "plain note {}".format(i)] for i in range(5000))
+        writer.writerow([5000, 'he said "hi", then left'])
+
+    rows = csv_helper.csv_to_dict(path)
+    parallel = [row for rows in csv_helper.iter_csv_dicts_parallel(path, workers=2, chunk_bytes=4096)
+                for row in rows]
+
+    assert rows[-1] == {"id": "5000", "note": 'he said "hi", then left'}
+    assert parallel == rows
+
+
+def test_spaces_after_delimiters_are_kept(tmp_path):
+    path = str(tmp_path / "spaced.csv")
+    with open(path, "w", newline="") as f:
+        f.write("id, name\n1, ann\n2, bob\n")
+
+    assert csv_helper.csv_to_dict(path) == [{"id": "1", " name": " ann"}, {"id": "2", " name": " bob"}]
+
+
+def test_delimiter_is_sniffed_from_the_first_lines(tmp_path):
+    path = str(tmp_path / "semicolons.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(["id", "note", "email"])
+        writer.writerows([i, 'line one, with "quotes"\nline two', "user{}@example.com".format(i)] for i in range(5000))
+
+    encoding, dialect = csv_helper.sniff_csv(path)
+
+    assert encoding == "utf-8"
+    assert dialect.delimiter == ";"
+    assert dialect.doublequote and not dialect.skipinitialspace
+    assert csv_helper.csv_format(path, dialect=csv.excel) == ("utf-8", csv.excel)
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.metrics import PrometheusSink
+
+
+def test_prometheus_quantiles_are_nan_without_observations():
+    sink = PrometheusSink(port=0)
+    try:
+        idle = {"count": 0, "total": 0.0, "p50": 0.0, "p90": 0.0, "p99": 0.0}
+        busy = {"count": 2, "total": 0.5, "p50": 0.2, "p90": 0.3, "p99": 0.3}
+        sink.write({"timers": {"request": idle, "users": busy}, "meters": {}, "reset": True})
+        lines = sink._text.decode("utf-8").splitlines()
+    finally:
+        sink.close()
+
+    assert 'clock_request_seconds{quantile="0.5"} NaN' in lines
+    assert 'clock_request_seconds{quantile="0.99"} NaN' in lines
+    assert "clock_request_seconds_count 0" in lines
+    assert 'clock_users_seconds{quantile="0.9"} 0.3' in lines
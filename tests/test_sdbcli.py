@@ -0,0 +1,102 @@
+import asyncio
+import bisect
+import os
+import re
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "aws"))
+
+from sdb_emulator import SimpleDbEmulator
+from sdbcli import AsyncSimpleDbHelper, RequestThrottler, ShardedDomain, SimpleDbHelper
+
+
+def test_throttler_releases_the_slot_when_the_operation_raises():
+    throttler = RequestThrottler(initial_concurrency=2, max_concurrency=2)
+
+    def malformed(**params):
+        raise KeyError("Value")
+
+    for _ in range(2):
+        with pytest.raises(KeyError):
+            throttler.call("put_attributes", malformed, DomainName="users")
+
+    assert throttler.stats()["InFlight"] == 0
+    done = threading.Event()
+    thread = threading.Thread(target=lambda: done.set() if throttler.call("list_domains", dict) == {} else None,
+                              daemon=True)
+    thread.start()
+    assert done.wait(5), "list_domains blocked on leaked concurrency slots"
+
+
+class FakeSelects(SimpleDbHelper):
+    """Answers the count(*) and itemName() selects of keyspace_boundaries from a sorted list of item names."""
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        self.verbose = False
+
+    def select_iter(self, query, page_prefetch=1):
+        low = re.search(r"itemName\(\) >= '((?:[^']|'')*)'", query)
+        high = re.search(r"itemName\(\) < '((?:[^']|'')*)'", query)
+        start = bisect.bisect_left(self.names, low.group(1).replace("''", "'")) if low else 0
+        end = bisect.bisect_left(self.names, high.group(1).replace("''", "'")) if high else len(self.names)
+        names = self.names[start:end]
+        if query.startswith("select count(*)"):
+            return iter([{"Name": "Domain", "Attributes": [{"Name": "Count", "Value": str(len(names))}]}])
+        return iter([{"Name": names[-1 if " desc " in query else 0]}] if names else [])
+
+
+@pytest.mark.parametrize("names", [
+    ["tenant-{}-user-{}".format("7" * 40, i) for i in range(1000)],
+    ["\u00fcser-{:04d}".format(i) for i in range(1000)],
+    ["\u00fc{:03d}".format(i) for i in range(500)] + ["user-{:03d}".format(i) for i in range(500)],
+])
+def test_keyspace_boundaries_split_on_the_item_names(names):
+    helper = FakeSelects(names)
+
+    boundaries = helper.keyspace_boundaries("users", segments=4)
+
+    assert len(boundaries) == 3
+    edges = [0] + [bisect.bisect_left(helper.names, boundary) for boundary in boundaries] + [len(names)]
+    sizes = [b - a for a, b in zip(edges, edges[1:])]
+    assert max(sizes) - min(sizes) <= len(names) // 8
+
+
+def test_batch_puts_share_one_bounded_loop():
+    helper = SimpleDbHelper(backend=SimpleDbEmulator())
+    helper.create_domain("users")
+    sessions = ShardedDomain(helper, "sessions", shards=3)
+    sessions.create()
+    items = [{"Name": "user{}".format(i), "Attributes": [{"Name": "a", "Value": "v", "Replace": True}]}
+             for i in range(60)]
+
+    async def put_async():
+        async with AsyncSimpleDbHelper(helper) as sdb:
+            return await sdb.batch_put_items("users", iter(items), workers=2)
+
+    plain = helper.batch_put_items("users", iter(items), workers=2)
+    awaited = asyncio.run(put_async())
+    sharded = sessions.batch_put_items(iter(items), workers=2)
+
+    assert [(r["Chunk"], r["Domain"], r["ItemCount"]) for r in plain] == \
+        [(0, "users", 25), (1, "users", 25), (2, "users", 10)]
+    assert awaited == plain
+    assert sorted({r["Domain"] for r in sharded}) == sessions.domain_names
+    assert sum(r["ItemCount"] for r in sharded) == 60
+    assert all(r["Success"] for r in plain + awaited + sharded)
+
+
+def test_only_failed_chunks_keep_their_item_names():
+    helper = SimpleDbHelper(backend=SimpleDbEmulator())
+    helper.create_domain("users")
+    items = [{"Name": "user{}".format(i), "Attributes": [{"Name": "a", "Value": "v", "Replace": True}]}
+             for i in range(30)]
+
+    stored = helper.batch_put_items("users", items)
+    missing = helper.batch_put_items("no-such-domain", items[:5])
+
+    assert [(r["ItemCount"], r["ItemNames"], r["Success"]) for r in stored] == [(25, [], True), (5, [], True)]
+    assert [(r["ItemNames"], r["Success"]) for r in missing] == [(["user{}".format(i) for i in range(5)], False)]
@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import tools.stopwatch as stopwatch
+
+
+class RecordingProfiler:
+
+    def __init__(self):
+        self.captures = []
+
+    def arm(self):
+        pass
+
+    def disarm(self):
+        pass
+
+    def capture(self, name, elapsed, threshold, profile=None):
+        self.captures.append(elapsed)
+
+
+def _lap(watch, clock, seconds):
+    token = watch.start_lap()
+    clock[0] += int(seconds * 1e9)
+    watch.stop_lap(token)
+
+
+def test_factor_uses_the_median_across_resets(monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(stopwatch.time, "perf_counter_ns", lambda: clock[0])
+    watch = stopwatch.Stopwatch("request")
+    profiler = RecordingProfiler()
+    watch.arm(profiler, factor=10)
+
+    for _ in range(300):
+        _lap(watch, clock, 0.001)
+    watch.snapshot(reset=True)
+    # The first lap after the reset is slow, it must not become the median
+    _lap(watch, clock, 0.2)
+    for _ in range(300):
+        _lap(watch, clock, 0.001)
+    _lap(watch, clock, 0.05)
+
+    assert profiler.captures == [0.2, 0.05]
+    assert watch.stats()["count"] == 302
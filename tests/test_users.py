@@ -0,0 +1,39 @@
+import csv
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bubble.users as users
+
+
+def _fail_all(pending, journal=None, **kwargs):
+    return {"created": 0, "failed": list(pending), "status_counts": {}}
+
+
+def _create_all(pending, journal=None, **kwargs):
+    created = 0
+    for user in pending:
+        journal.mark_created(user["email"])
+        created += 1
+    return {"created": created, "failed": [], "status_counts": {200: created}}
+
+
+def test_resumed_csv_load_keeps_the_first_runs_rejects(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.csv")
+    with open(path, "w", newline="") as f:
+        f.write("email,password\nann@example.com,secret\nnot-an-email,secret\nbob@example.com,secret\n")
+    reject_file = str(tmp_path / "rejects")
+    journal_path = str(tmp_path / "journal.db")
+
+    monkeypatch.setattr(users, "create_users", _fail_all)
+    first = users.load_csv_users(path, reject_file=reject_file, journal_path=journal_path)
+    monkeypatch.setattr(users, "create_users", _create_all)
+    resumed = users.load_csv_users(path, reject_file=reject_file, journal_path=journal_path)
+
+    assert first["csv"] == {"rows": 3, "accepted": 2, "rejected": {"invalid email": 1, "create failed": 2}}
+    assert resumed["created"] == 2
+    assert resumed["csv"] == {"rows": 3, "accepted": 2, "rejected": {"invalid email": 1}}
+    with open(reject_file + ".csv", newline="") as f:
+        reasons = [row["reason"] for row in csv.DictReader(f)]
+    assert reasons == ["invalid email", "create failed", "create failed"]
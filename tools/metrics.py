@@ -0,0 +1,256 @@
+import json
+import re
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MetricsReporter:
+    """
+    Background thread that takes a Clock snapshot every `interval` seconds and hands it to every sink, so
+    nothing is printed or written on the timed code path.
+
+        reporter = MetricsReporter(clock, [JsonLinesSink("metrics.jsonl"), PrometheusSink(port=9100)]).start()
+        ...
+        reporter.stop()
+
+    A sink is any object with a write(snapshot) method and optionally close(). The sinks here report counters
+    correctly with reset or not, see CounterDeltas.
+    """
+
+    def __init__(self, clock, sinks, interval=10.0, reset=True):
+        """
+
+        :param clock: (Clock)
+        :param sinks: (list) Sinks the snapshots are written to
+        :param interval: (float) Seconds between snapshots
+        :param reset: (bool) Snapshot and reset, so every report covers one interval
+        """
+        self.clock = clock
+        self.sinks = list(sinks)
+        self.interval = interval
+        self.reset = reset
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-reporter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the thread, reports a last time and closes the sinks."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.report()
+        for sink in self.sinks:
+            close = getattr(sink, "close", None)
+            if close is not None:
+                close()
+
+    def report(self):
+        snapshot = self.clock.snapshot(reset=self.reset)
+        for sink in self.sinks:
+            sink.write(snapshot)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+
+class JsonLinesSink:
+    """Appends every snapshot to a file as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+
+    def write(self, snapshot):
+        self._file.write(json.dumps(snapshot) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CounterDeltas:
+    """
+    Turns the counters of successive snapshots into the increase since the previous one. Counters of a snapshot
+    that reset are already per interval. Without reset they are totals, so the previous total is taken off, and a
+    total that went down was reset in between and counts from zero.
+    """
+
+    def __init__(self):
+        self._last = {}
+
+    def delta(self, key, value, reset):
+        """
+
+        :param key: Counter, i.e. ("timer", name, "count")
+        :param value: (float) The counter in this snapshot
+        :param reset: (bool) The snapshot reset, so value is the interval's
+        :return: (float) Increase since the previous snapshot
+        """
+        last = self._last.get(key, 0)
+        self._last[key] = 0 if reset else value
+        if reset or value < last:
+            return value
+        return value - last
+
+
+class StatsdSink:
+    """
+    Sends every snapshot to statsd over UDP: timer stats as gauges in milliseconds (<prefix>.<timer>.p99), the
+    laps since the previous snapshot as a counter (<prefix>.<timer>.laps), meter rates as gauges and the meter
+    events since the previous snapshot as a counter (<prefix>.<meter>.count).
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, prefix="clock", max_packet=1400):
+        """
+
+        :param host: (str) statsd host
+        :param port: (int) statsd port
+        :param prefix: (str) Prefix of every metric name
+        :param max_packet: (int) Max bytes per datagram, lines are packed up to it
+        """
+        self.address = (host, port)
+        self.prefix = prefix
+        self.max_packet = max_packet
+        self._deltas = CounterDeltas()
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def write(self, snapshot):
+        reset = snapshot.get("reset", True)
+        lines = []
+        for name, stats in snapshot["timers"].items():
+            for stat in ("mean", "min", "max", "p50", "p90", "p99"):
+                lines.append("{}.{}.{}:{:.3f}|g".format(self.prefix, _metric_name(name, "."), stat,
+                                                        stats[stat] * 1000))
+            laps = self._deltas.delta(("timer", name), stats["count"], reset)
+            lines.append("{}.{}.laps:{}|c".format(self.prefix, _metric_name(name, "."), laps))
+        for name, rates in snapshot["meters"].items():
+            for key, value in rates.items():
+                if key == "count":
+                    # count is the meter's total whether the snapshot reset or not
+                    count = self._deltas.delta(("meter", name), value, False)
+                    lines.append("{}.{}.count:{}|c".format(self.prefix, _metric_name(name, "."), count))
+                elif key != "interval_count":
+                    lines.append("{}.{}.{}:{:.3f}|g".format(self.prefix, _metric_name(name, "."), key, value))
+
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) + 1 > self.max_packet:
+                self._send(packet)
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line) + 1
+        if packet:
+            self._send(packet)
+
+    def close(self):
+        self._socket.close()
+
+    def _send(self, packet):
+        try:
+            self._socket.sendto("\n".join(packet).encode("utf-8"), self.address)
+        except OSError:
+            # statsd being down must not stop the reporter
+            pass
+
+
+class PrometheusSink:
+    """
+    Serves the latest snapshot in the Prometheus text format on http://host:port/metrics. Timers are summaries
+    in seconds, with count and sum kept cumulative whether the snapshots reset or not; meters are a <name>_total
+    counter and <name>_rate gauges.
+    """
+
+    def __init__(self, host="127.0.0.1", port=9100, prefix="clock"):
+        """
+
+        :param host: (str) Interface to listen on
+        :param port: (int) Port to listen on, 0 picks a free one
+        :param prefix: (str) Prefix of every metric name
+        """
+        self.prefix = prefix
+        self._counts = {}
+        self._sums = {}
+        self._deltas = CounterDeltas()
+        self._text = b""
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="prometheus-sink", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}/metrics".format(host, port)
+
+    def write(self, snapshot):
+        reset = snapshot.get("reset", True)
+        lines = []
+        for name, stats in snapshot["timers"].items():
+            metric = "{}_{}_seconds".format(self.prefix, _metric_name(name, "_"))
+            self._counts[metric] = self._counts.get(metric, 0) + self._deltas.delta((metric, "count"),
+                                                                                    stats["count"], reset)
+            self._sums[metric] = self._sums.get(metric, 0.0) + self._deltas.delta((metric, "sum"), stats["total"],
+                                                                                  reset)
+            lines.append("# TYPE {} summary".format(metric))
+            for quantile, stat in (("0.5", "p50"), ("0.9", "p90"), ("0.99", "p99")):
+                # An interval without observations has no quantiles, its 0.0 would read as instant requests
+                value = repr(stats[stat]) if stats["count"] else "NaN"
+                lines.append('{}{{quantile="{}"}} {}'.format(metric, quantile, value))
+            lines.append("{}_sum {!r}".format(metric, self._sums[metric]))
+            lines.append("{}_count {}".format(metric, self._counts[metric]))
+        for name, rates in snapshot["meters"].items():
+            metric = "{}_{}".format(self.prefix, _metric_name(name, "_"))
+            lines.append("# TYPE {}_total counter".format(metric))
+            lines.append("{}_total {}".format(metric, rates["count"]))
+            lines.append("# TYPE {}_rate gauge".format(metric))
+            for key, value in rates.items():
+                if key not in ("count", "interval_count"):
+                    lines.append('{}_rate{{window="{}"}} {!r}'.format(metric, key, value))
+        with self._lock:
+            self._text = ("\n".join(lines) + "\n").encode("utf-8")
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler_class(self):
+        sink = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                with sink._lock:
+                    body = sink._text
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def _metric_name(name, separator):
+    return re.sub(r"[^a-zA-Z0-9_]+", separator, str(name)).strip(separator) or "unnamed"
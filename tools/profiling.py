@@ -0,0 +1,204 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+
+class SlowLapProfiler:
+    """
+    Captures what the process was doing when a lap of an armed stopwatch crossed its threshold, see Clock.arm.
+    Nothing runs until the profiler is armed. Modes:
+
+        stack        A background thread samples every thread's stack each `sample_interval` seconds into a ring
+                     covering the last `window` seconds. A capture writes the ring as collapsed stacks
+                     ("thread;file:function;... count"), ready for flamegraph.pl or speedscope.
+        tracemalloc  Allocations are traced while armed. A capture writes the top allocation growth since the
+                     previous capture.
+        cprofile     Every lap timed with Clock.time or Clock.timed is profiled on its own thread. A capture writes
+                     the slow lap's pstats file.
+
+    Captures are at most one per `min_interval` seconds and only the newest `max_captures` files are kept in
+    `directory`.
+    """
+
+    MODES = ("stack", "tracemalloc", "cprofile")
+
+    def __init__(self, directory, mode="stack", max_captures=20, min_interval=60.0, window=5.0, sample_interval=0.01,
+                 tracemalloc_frames=16, top=50):
+        """
+
+        :param directory: (str) Directory the captures are written to, created if missing
+        :param mode: (str) One of MODES
+        :param max_captures: (int) Capture files kept, the oldest are deleted
+        :param min_interval: (float) Min seconds between captures
+        :param window: (float) Seconds of stack samples kept for stack mode
+        :param sample_interval: (float) Seconds between stack samples for stack mode
+        :param tracemalloc_frames: (int) Frames stored per allocation for tracemalloc mode
+        :param top: (int) Allocation sites written per tracemalloc capture
+        """
+        if mode not in self.MODES:
+            raise ValueError("Unknown profiling mode {}. Use one of {}".format(mode, self.MODES))
+        self.directory = directory
+        self.mode = mode
+        self.max_captures = max_captures
+        self.min_interval = min_interval
+        self.window = window
+        self.sample_interval = sample_interval
+        self.tracemalloc_frames = tracemalloc_frames
+        self.top = top
+        self.captures = 0
+        self.skipped = 0
+        self._armed = 0
+        self._last_capture = None
+        self._samples = deque(maxlen=100000)
+        self._sampler = None
+        self._stop = threading.Event()
+        self._started_tracemalloc = False
+        self._baseline = None
+        self._lock = threading.Lock()
+
+    def arm(self):
+        """Starts sampling or tracing. Profilers shared by several stopwatches are armed once."""
+        with self._lock:
+            self._armed += 1
+            if self._armed > 1:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            if self.mode == "stack":
+                self._stop.clear()
+                self._sampler = threading.Thread(target=self._sample, name="stack-sampler", daemon=True)
+                self._sampler.start()
+            elif self.mode == "tracemalloc":
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(self.tracemalloc_frames)
+                    self._started_tracemalloc = True
+                self._baseline = tracemalloc.take_snapshot()
+
+    def disarm(self):
+        with self._lock:
+            self._armed = max(0, self._armed - 1)
+            if self._armed:
+                return
+            sampler = self._sampler
+            self._sampler = None
+            self._baseline = None
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+        if sampler is not None:
+            self._stop.set()
+            sampler.join()
+        self._samples.clear()
+
+    def begin_lap(self):
+        """
+
+        :return: (cProfile.Profile) Profile running for the lap in cprofile mode, else None
+        """
+        if self.mode != "cprofile":
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active on this thread
+            return None
+        return profile
+
+    def end_lap(self, profile):
+        profile.disable()
+
+    def capture(self, name, elapsed, threshold, profile=None):
+        """
+        Writes a capture for a slow lap unless one was written less than min_interval seconds ago.
+
+        :param name: (str) Stopwatch name
+        :param elapsed: (float) Seconds the lap took
+        :param threshold: (float) Seconds the lap crossed
+        :param profile: (cProfile.Profile) The lap's profile in cprofile mode
+        :return: (str) Path of the capture, or None if it was skipped
+        """
+        now = time.time()
+        with self._lock:
+            if not self._armed or (self._last_capture is not None and now - self._last_capture < self.min_interval):
+                self.skipped += 1
+                return None
+            if self.mode == "cprofile" and profile is None:
+                self.skipped += 1
+                return None
+            self._last_capture = now
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + "-{:03d}".format(int(now * 1000) % 1000)
+        header = "# {} lap took {:.6f}s, threshold {:.6f}s, at {}\n".format(name, elapsed, threshold, stamp)
+        base = os.path.join(self.directory, "slow-{}-{}".format(stamp, _file_name(name)))
+        if self.mode == "stack":
+            path = base + ".stacks.txt"
+            with open(path, "w") as f:
+                f.write(header)
+                f.writelines("{} {}\n".format(stack, count) for stack, count in self._collapsed_stacks(now))
+        elif self.mode == "tracemalloc":
+            path = base + ".tracemalloc.txt"
+            snapshot = tracemalloc.take_snapshot()
+            with self._lock:
+                baseline, self._baseline = self._baseline, snapshot
+            with open(path, "w") as f:
+                f.write(header)
+                for stat in snapshot.compare_to(baseline, "traceback")[:self.top]:
+                    f.write("\n{}\n".format(stat))
+                    f.writelines("    {}\n".format(line) for line in stat.traceback.format())
+        else:
+            path = base + ".prof"
+            profile.dump_stats(path)
+
+        with self._lock:
+            self.captures += 1
+        self._prune()
+        return path
+
+    def stats(self):
+        """
+
+        :return: (dict) {"armed": False, "captures": 0, "skipped": 0}
+        """
+        with self._lock:
+            return {"armed": self._armed > 0, "captures": self.captures, "skipped": self.skipped}
+
+    def _sample(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            now = time.time()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._samples.append((now, ";".join(reversed(stack))))
+            while self._samples and self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+
+    def _collapsed_stacks(self, now):
+        counts = {}
+        for sampled, stack in list(self._samples):
+            if sampled >= now - self.window:
+                counts[stack] = counts.get(stack, 0) + 1
+        return sorted(counts.items(), key=lambda entry: -entry[1])
+
+    def _prune(self):
+        captures = sorted(entry for entry in os.listdir(self.directory) if entry.startswith("slow-"))
+        for entry in captures[:max(0, len(captures) - self.max_captures)]:
+            try:
+                os.remove(os.path.join(self.directory, entry))
+            except OSError:
+                pass
+
+
+def _file_name(name):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in str(name))
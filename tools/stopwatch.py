@@ -1,16 +1,38 @@
+import functools
+import itertools
+import math
+import threading
 import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+
+def percentile(values, q):
+    """
+    Exact percentile of a list of samples by nearest rank, for benchmarks that keep every sample. Stopwatch
+    keeps a LogHistogram instead.
+
+    :param values: (list) Samples
+    :param q: (float) Percentile, 0-100
+    :return: (float) 0 if there are no values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
 
 
 class StopwatchLap:
 
-    def __init__(self, start_time=time.time(), end_time=time.time()):
+    def __init__(self, start_time=None, end_time=None):
         """
 
-        :param start_time:
-        :param end_time:
+        :param start_time: (float) time.perf_counter() seconds, default now
+        :param end_time: (float) time.perf_counter() seconds, default now
         """
-        self.start = start_time
-        self.end = end_time
+        self.start = start_time if start_time is not None else time.perf_counter()
+        self.end = end_time if end_time is not None else time.perf_counter()
 
     def calculate_time_elapsed(self):
         return self.end - self.start
@@ -22,61 +44,508 @@ class StopwatchLap:
         self.end = end_time
 
 
+class LogHistogram:
+    """
+    Fixed-size histogram of positive values in logarithmic buckets, so every percentile it returns is within
+    `precision` of the true value whatever the number of values recorded. Values outside [min_value, max_value]
+    are counted in the first or last bucket.
+    """
+
+    def __init__(self, min_value=1e-6, max_value=3600.0, precision=0.01):
+        """
+
+        :param min_value: (float) Smallest value told apart, 1 microsecond by default
+        :param max_value: (float) Largest value told apart, 1 hour by default
+        :param precision: (float) Relative width of a bucket
+        """
+        self.min_value = min_value
+        self.max_value = max_value
+        self._log_base = math.log1p(precision)
+        self._last = int(math.log(max_value / min_value) / self._log_base)
+        self.counts = [0] * (self._last + 1)
+        self.count = 0
+
+    def record(self, value):
+        self.counts[self._index(value)] += 1
+        self.count += 1
+
+    def percentile(self, q):
+        """
+        :param q: (float) Percentile, 0-100
+        :return: (float) Geometric middle of the bucket holding the q-th percentile, 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, int(math.ceil(q / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.min_value * math.exp((index + 0.5) * self._log_base)
+        return self.max_value
+
+    def clear(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+
+    def _index(self, value):
+        if value <= self.min_value:
+            return 0
+        return min(self._last, int(math.log(value / self.min_value) / self._log_base))
+
+
 class Stopwatch:
-    def __init__(self, name):
+    """
+    Times laps and keeps running aggregates of them instead of the laps themselves: count, total, min/max,
+    Welford mean and variance and a LogHistogram for percentiles. Memory stays flat and every stat is O(1)
+    however many laps are timed. Laps are timed with the monotonic perf_counter_ns. start_lap returns a token
+    that stop_lap takes to stop that lap; without a token the oldest open lap is stopped. Safe to use from
+    many threads.
+    """
+
+    def __init__(self, name, window=0):
+        """
+
+        :param name: (str)
+        :param window: (int) Number of the most recent completed laps to keep in `laps`, 0 keeps none
+        """
         self.name = name
-        self.laps = []
-        self.current_lap = 0
-        self.next_new_lap = 0
+        self.laps = deque(maxlen=window)
+        self.open_laps = OrderedDict()
+        self.histogram = LogHistogram()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._tokens = itertools.count(1)
+        self._lock = threading.Lock()
+        # Slow lap profiling, see arm. Unarmed stop_lap only checks profiler is None
+        self.profiler = None
+        self.threshold = None
+        self.factor = None
+        self._median = 0.0
+        # Laps since arming with a factor, not cleared by reset so the median outlives a snapshot interval
+        self._median_histogram = None
+
+    def arm(self, profiler, threshold=None, factor=None):
+        """
+        Has the profiler capture whenever a lap is slower than the threshold.
+
+        :param profiler: (tools.profiling.SlowLapProfiler)
+        :param threshold: (float) Seconds
+        :param factor: (float) Laps slower than factor times the median lap since arming are slow too. Resets do not
+            clear that median
+        """
+        if threshold is None and factor is None:
+            raise ValueError("Stopwatch {} needs a threshold or a factor to be armed".format(self.name))
+        if self.profiler is not None:
+            self.disarm()
+        profiler.arm()
+        self.threshold = threshold
+        self.factor = factor
+        self._median = 0.0
+        self._median_histogram = LogHistogram() if factor is not None else None
+        self.profiler = profiler
+
+    def disarm(self):
+        profiler, self.profiler = self.profiler, None
+        if profiler is not None:
+            profiler.disarm()
 
     def calculate_average_time(self):
-        total_time = 0
-        for lap in self.laps:
-            if lap.calculate_time_elapsed() >= 0:
-                total_time += lap.calculate_time_elapsed()
-        print("{}: {}/{}".format(self.name, total_time, len(self.laps)))
-        return total_time / float(len(self.laps)) if len(self.laps) > 0 else 0
+        return self.mean
 
     def start_lap(self):
-        self.laps.append(StopwatchLap())
-        self.laps[self.next_new_lap].set_start(time.time())
-        self.next_new_lap += 1
+        """
+
+        :return: (int) Token of the lap for stop_lap
+        """
+        start = time.perf_counter_ns()
+        with self._lock:
+            token = next(self._tokens)
+            self.open_laps[token] = start
+        return token
+
+    def stop_lap(self, token=None, profile=None):
+        """
+
+        :param token: (int) Token start_lap returned, default the oldest open lap
+        :param profile: (cProfile.Profile) Profile of the lap, captured if the lap is slow
+        :return: (float) Seconds the lap took, None if there was no such open lap
+        """
+        end = time.perf_counter_ns()
+        with self._lock:
+            if token is None:
+                if not self.open_laps:
+                    return None
+                token, start = self.open_laps.popitem(last=False)
+            else:
+                start = self.open_laps.pop(token, None)
+                if start is None:
+                    return None
+            elapsed = (end - start) / 1e9
+            if self.laps.maxlen:
+                self.laps.append(StopwatchLap(start / 1e9, end / 1e9))
+            self._record(elapsed)
+            median_histogram = self._median_histogram
+            if median_histogram is not None and elapsed >= 0:
+                median_histogram.record(elapsed)
+                count = median_histogram.count
+                # Often while there are few laps, then every 256 laps
+                if count & (count - 1) == 0 or count & 255 == 0:
+                    self._median = median_histogram.percentile(50)
+        profiler = self.profiler
+        if profiler is not None:
+            threshold = self._slow_threshold()
+            if threshold is not None and elapsed >= threshold:
+                profiler.capture(self.name, elapsed, threshold, profile)
+        return elapsed
+
+    def _slow_threshold(self):
+        thresholds = [t for t in (self.threshold, self.factor * self._median if self.factor else None) if t]
+        return min(thresholds) if thresholds else None
+
+    def record(self, elapsed):
+        """
+        Adds a lap that took `elapsed` seconds to the aggregates.
+
+        :param elapsed: (float)
+        """
+        with self._lock:
+            self._record(elapsed)
+
+    def _record(self, elapsed):
+        if elapsed < 0:
+            return
+        self.count += 1
+        self.total += elapsed
+        self.min = elapsed if self.min is None else min(self.min, elapsed)
+        self.max = elapsed if self.max is None else max(self.max, elapsed)
+        delta = elapsed - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (elapsed - self.mean)
+        self.histogram.record(elapsed)
+
+    def variance(self):
+        with self._lock:
+            return self._variance()
+
+    def percentile(self, q):
+        """
+        :param q: (float) Percentile, 0-100
+        :return: (float) Seconds, within 1% and clamped to the min and max lap
+        """
+        with self._lock:
+            return self._percentile(q)
+
+    def stats(self):
+        """
+
+        :return: (dict) {"count": 0, "total": 0.0, "mean": 0.0, "stdev": 0.0, "min": 0.0, "max": 0.0,
+                         "p50": 0.0, "p90": 0.0, "p99": 0.0}
+        """
+        return self.snapshot()
+
+    def snapshot(self, reset=False):
+        """
+        Same as stats, optionally starting over in the same step so no lap is missed or counted twice.
+
+        :param reset: (bool) Clear the aggregates after reading them. Open laps are kept
+        :return: (dict) See stats
+        """
+        with self._lock:
+            stats = {"count": self.count,
+                     "total": self.total,
+                     "mean": self.mean,
+                     "stdev": math.sqrt(self._variance()),
+                     "min": self.min or 0.0,
+                     "max": self.max or 0.0,
+                     "p50": self._percentile(50),
+                     "p90": self._percentile(90),
+                     "p99": self._percentile(99)}
+            if reset:
+                self._reset()
+        return stats
+
+    def reset(self):
+        with self._lock:
+            self._reset()
 
-    def stop_lap(self):
-        if self.current_lap < len(self.laps):
-            self.laps[self.current_lap].set_end(time.time())
-            self.current_lap += 1
+    def _reset(self):
+        self.laps.clear()
+        self.histogram.clear()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def _variance(self):
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def _percentile(self, q):
+        if self.count == 0:
+            return 0.0
+        return min(self.max, max(self.min, self.histogram.percentile(q)))
+
+
+class RateMeter:
+    """
+    Events/sec over sliding windows and as exponentially weighted moving averages. Events are counted in a ring of
+    per-second buckets, so memory is fixed by the longest window and mark is O(1). The averages are updated once a
+    second, like load averages, catching up in O(1) after idle seconds. Safe to use from many threads.
+    """
+
+    def __init__(self, name, windows=(1, 10, 60), ewma_periods=(10, 60, 300)):
+        """
+
+        :param name: (str)
+        :param windows: (tuple) Sliding windows in seconds
+        :param ewma_periods: (tuple) Time constants of the moving averages in seconds
+        """
+        self.name = name
+        self.windows = tuple(windows)
+        self.ewma_periods = tuple(ewma_periods)
+        self.count = 0
+        self.start = time.monotonic()
+        size = max(self.windows) + 1
+        self._counts = [0] * size
+        self._seconds = [None] * size
+        self._alphas = [1.0 - math.exp(-1.0 / period) for period in self.ewma_periods]
+        self._ewmas = [None] * len(self.ewma_periods)
+        self._next_tick = self.start + 1.0
+        self._uncounted = 0
+        self._snapshot_count = 0
+        self._lock = threading.Lock()
+
+    def mark(self, n=1):
+        """
+        Records n events now.
+
+        :param n: (int)
+        """
+        now = time.monotonic()
+        second = int(now)
+        index = second % len(self._counts)
+        with self._lock:
+            self._tick(now)
+            if self._seconds[index] != second:
+                self._seconds[index] = second
+                self._counts[index] = 0
+            self._counts[index] += n
+            self._uncounted += n
+            self.count += n
+
+    def rate(self, window):
+        """
+        :param window: (int) Seconds, at most the longest window
+        :return: (float) Events/sec over the last `window` seconds, or since the meter started if that is shorter
+        """
+        now = time.monotonic()
+        second = int(now)
+        with self._lock:
+            total = 0
+            for offset in range(min(window, len(self._counts) - 1) + 1):
+                index = (second - offset) % len(self._counts)
+                if self._seconds[index] == second - offset:
+                    total += self._counts[index]
+        span = min(now - (second - window), now - self.start)
+        return total / span if span > 0 else 0.0
+
+    def ewma(self, period):
+        """
+        :param period: (int) One of ewma_periods
+        :return: (float) Moving average of events/sec, 0 before the first second has passed
+        """
+        with self._lock:
+            self._tick(time.monotonic())
+            value = self._ewmas[self.ewma_periods.index(period)]
+        return value or 0.0
+
+    def rates(self):
+        """
+
+        :return: (dict) {"count": 0, "mean": 0.0, "1s": 0.0, "10s": 0.0, "60s": 0.0, "ewma_10s": 0.0, ...}
+        """
+        elapsed = time.monotonic() - self.start
+        rates = {"count": self.count, "mean": self.count / elapsed if elapsed > 0 else 0.0}
+        for window in self.windows:
+            rates["{}s".format(window)] = self.rate(window)
+        for period in self.ewma_periods:
+            rates["ewma_{}s".format(period)] = self.ewma(period)
+        return rates
+
+    def snapshot(self, reset=False):
+        """
+        Same as rates plus "interval_count", the events since the last snapshot that reset.
+
+        :param reset: (bool) Start the next interval. The windows and averages slide on regardless
+        :return: (dict) See rates
+        """
+        rates = self.rates()
+        with self._lock:
+            rates["interval_count"] = self.count - self._snapshot_count
+            if reset:
+                self._snapshot_count = self.count
+        return rates
+
+    def _tick(self, now):
+        if now < self._next_tick:
+            return
+        ticks = int(now - self._next_tick) + 1
+        self._next_tick += ticks
+        for i, alpha in enumerate(self._alphas):
+            if self._ewmas[i] is None:
+                self._ewmas[i] = float(self._uncounted)
+            else:
+                self._ewmas[i] += alpha * (self._uncounted - self._ewmas[i])
+            # The seconds after the first had no events
+            self._ewmas[i] *= (1.0 - alpha) ** (ticks - 1)
+        self._uncounted = 0
 
 
 class Clock:
     """
-    A clock that contains instances of StopwatchLap classes.
+    A clock that contains instances of Stopwatch classes. Safe to use from many threads.
+
+        token = clock.start_stopwatch("request")
+        clock.stop_stopwatch("request", token)
+
+        with clock.time("request"):
+            ...
+
+        @clock.timed("request")
+        def handle(): ...
+
+        clock.mark("users")
+        clock.get_rates("users")
     """
 
-    def __init__(self):
+    def __init__(self, window=0):
         """
 
+        :param window: (int) Number of recent laps each Stopwatch keeps, see Stopwatch
         """
         self.initial_start = time.time()
         self.current_lap = False
+        self.window = window
         self.stopwatches = {}
+        self.meters = {}
+        self._lock = threading.Lock()
 
     def start_stopwatch(self, stopwatch_name):
         """
 
         :param stopwatch_name:
-        :return:
+        :return: (int) Token of the lap for stop_stopwatch
+        """
+        return self.get_stopwatch(stopwatch_name).start_lap()
+
+    def stop_stopwatch(self, stopwatch_name, token=None):
+        """
+
+        :param stopwatch_name:
+        :param token: (int) Token start_stopwatch returned, default the oldest open lap
+        :return: (float) Seconds the lap took
+        """
+        return self.stopwatches[stopwatch_name].stop_lap(token)
+
+    def get_stopwatch(self, stopwatch_name):
+        stopwatch = self.stopwatches.get(stopwatch_name)
+        if stopwatch is None:
+            with self._lock:
+                stopwatch = self.stopwatches.get(stopwatch_name)
+                if stopwatch is None:
+                    stopwatch = Stopwatch(stopwatch_name, self.window)
+                    self.stopwatches[stopwatch_name] = stopwatch
+        return stopwatch
+
+    def arm(self, stopwatch_name, profiler, threshold=None, factor=None):
+        """
+        Captures a profile whenever a lap of the stopwatch is slow, see Stopwatch.arm.
+
+        :param stopwatch_name:
+        :param profiler: (tools.profiling.SlowLapProfiler)
+        :param threshold: (float) Seconds
+        :param factor: (float) Laps slower than factor times the median lap since arming are slow too. Resets do not
+            clear that median
         """
-        if stopwatch_name not in self.stopwatches:
-            self.stopwatches[stopwatch_name] = Stopwatch(stopwatch_name)
+        self.get_stopwatch(stopwatch_name).arm(profiler, threshold, factor)
 
-        self.stopwatches[stopwatch_name].start_lap()
+    def disarm(self, stopwatch_name):
+        self.get_stopwatch(stopwatch_name).disarm()
 
-    def stop_stopwatch(self, stopwatch_name):
-        self.stopwatches[stopwatch_name].stop_lap()
+    @contextmanager
+    def time(self, stopwatch_name):
+        """Times the body of a with block as one lap of the stopwatch."""
+        stopwatch = self.get_stopwatch(stopwatch_name)
+        profiler = stopwatch.profiler
+        profile = profiler.begin_lap() if profiler is not None else None
+        token = stopwatch.start_lap()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profiler.end_lap(profile)
+            stopwatch.stop_lap(token, profile)
+
+    def timed(self, stopwatch_name):
+        """Decorator timing every call of the function as one lap of the stopwatch."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.time(stopwatch_name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
 
     def get_average_time_elapsed(self, stopwatch_name):
         return self.stopwatches[stopwatch_name].calculate_average_time()
 
+    def get_stats(self, stopwatch_name):
+        return self.stopwatches[stopwatch_name].stats()
+
+    def mark(self, meter_name, n=1):
+        """
+        Records n events on the meter, see RateMeter.
+
+        :param meter_name:
+        :param n: (int)
+        """
+        self.get_meter(meter_name).mark(n)
+
+    def get_meter(self, meter_name):
+        meter = self.meters.get(meter_name)
+        if meter is None:
+            with self._lock:
+                meter = self.meters.get(meter_name)
+                if meter is None:
+                    meter = RateMeter(meter_name)
+                    self.meters[meter_name] = meter
+        return meter
+
+    def get_rates(self, meter_name):
+        return self.meters[meter_name].rates()
+
+    def snapshot(self, reset=False):
+        """
+        Reads every stopwatch and meter, see tools.metrics for reporting them on an interval.
+
+        :param reset: (bool) Start a new interval: stopwatch aggregates are cleared and meter interval counts restart
+        :return: (dict) {"time": unix seconds, "reset": reset, "timers": {name: Stopwatch.snapshot()},
+                         "meters": {name: RateMeter.snapshot()}}
+        """
+        with self._lock:
+            stopwatches = list(self.stopwatches.values())
+            meters = list(self.meters.values())
+        return {"time": time.time(),
+                "reset": reset,
+                "timers": {stopwatch.name: stopwatch.snapshot(reset) for stopwatch in stopwatches},
+                "meters": {meter.name: meter.snapshot(reset) for meter in meters}}
+
     def get_stopwatch_keys(self):
-        return self.stopwatches.keys()
+        with self._lock:
+            return list(self.stopwatches.keys())